@@ -0,0 +1,1394 @@
+"""性能基准测试
+
+用法: python bench.py [名称 ...]   (不带参数时运行全部)
+"""
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from shutil import copyfile
+
+from effect_store import EffectStore, COMPACT_EVERY
+import wire_protocol
+from effect_columns import EffectColumns
+from effect_library import write_library
+from effect_model import FireworkEffect, LaunchMode, ExplodeMode, GradientMode, LaserColor
+
+
+def make_effect_data(effect_id):
+    """生成与 process_message 保存格式相同的效果字典"""
+    return {
+        'id': effect_id,
+        'color1': {'r': effect_id % 256, 'g': (effect_id * 7) % 256, 'b': (effect_id * 13) % 256},
+        'color2': {'r': (effect_id * 3) % 256, 'g': (effect_id * 5) % 256, 'b': (effect_id * 11) % 256},
+        'maxBrightness': 128 + effect_id % 128,
+        'launchMode': effect_id % 3,
+        'gradientMode': (effect_id // 3) % 3,
+        'explodeMode': (effect_id // 9) % 3,
+        'laserColor': (effect_id // 27) % 3,
+        'mirrorAngle': effect_id % 181,
+        'explosionLEDCount': 50 + effect_id % 151,
+        'speedDelay': 10 + effect_id % 41,
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def make_library(count):
+    return {i: make_effect_data(i) for i in range(1, count + 1)}
+
+
+def _legacy_save(effects, effects_file, backup_dir):
+    """旧版 save_to_file: 复制备份 + 扫描备份目录 + 全量 indent=2 重写"""
+    if os.path.exists(effects_file):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        copyfile(effects_file, os.path.join(backup_dir, f"effects_data_{timestamp}.json"))
+        backups = sorted(os.listdir(backup_dir))
+        while len(backups) > 5:
+            os.remove(os.path.join(backup_dir, backups[0]))
+            backups.pop(0)
+    with open(effects_file, 'w') as f:
+        json.dump({
+            'last_updated': datetime.now().isoformat(),
+            'effects_count': len(effects),
+            'effects': effects
+        }, f, indent=2)
+
+
+def bench_save(sizes=(10_000, 100_000), saves=5):
+    """单次保存延迟: 旧版全量重写 vs 追加日志(含一次压缩的均摊)"""
+    for size in sizes:
+        effects = make_library(size)
+        with tempfile.TemporaryDirectory() as tmp:
+            backup_dir = os.path.join(tmp, 'backups')
+            os.makedirs(backup_dir)
+            effects_file = os.path.join(tmp, 'effects_data.json')
+            _legacy_save(effects, effects_file, backup_dir)
+            start = time.perf_counter()
+            for i in range(saves):
+                effect_id = size + i + 1
+                effects[effect_id] = make_effect_data(effect_id)
+                _legacy_save(effects, effects_file, backup_dir)
+            legacy = (time.perf_counter() - start) / saves
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = EffectStore(tmp)
+            store.compact(effects)
+            start = time.perf_counter()
+            for i in range(COMPACT_EVERY):
+                effect_id = size + saves + i + 1
+                effects[effect_id] = make_effect_data(effect_id)
+                if store.append(effect_id, effects[effect_id]):
+                    store.compact(effects)
+            journal = (time.perf_counter() - start) / COMPACT_EVERY
+            store.close()
+
+        print(f"save @ {size:>7} effects: full rewrite {legacy * 1000:8.2f} ms, "
+              f"journal append {journal * 1000:8.3f} ms")
+
+
+def bench_backup(size=100_000, saves=400, compact_every=20, interval=0.002):
+    """保存路径延迟: 压缩时同步备份 vs 后台去抖的增量备份
+
+    每 interval 秒保存一个效果，每 compact_every 个压缩一次，连续保存视为一串。
+    """
+    from effect_library import MappedEffectStore
+
+    effects = _make_effects(size)
+    for background in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            store = MappedEffectStore(tmp, compact_every=compact_every,
+                                      background_backups=background)
+            store.compact(effects)
+            store.backup.flush()
+            library = store.load()
+            appends, compacts = [], []
+            for i in range(saves):
+                effect_id = size + i + 1
+                library[effect_id] = effects[i % size + 1]
+                start = time.perf_counter()
+                if store.append(effect_id, library[effect_id]):
+                    store.compact(library)
+                    compacts.append(time.perf_counter() - start)
+                else:
+                    appends.append(time.perf_counter() - start)
+                time.sleep(interval)
+            start = time.perf_counter()
+            store.close()
+            drain = time.perf_counter() - start
+            stats = store.backup.stats()
+            kinds = Counter(entry['kind'] for entry in store.backup.entries)
+        label = 'background worker' if background else 'inline backup    '
+        print(f"{label}: append {_percentiles(appends)}")
+        print(f"{label}: append + compact {_percentiles(compacts)}")
+        print(f"{label}: {stats['scheduled']} snapshots -> {stats['written']} backups "
+              f"({kinds['full']} full, {kinds['delta']} delta, {stats['bytes'] / 1024:.0f} KB), "
+              f"close {drain * 1000:.0f} ms")
+
+
+def _legacy_play_command(effect):
+    """旧版 play_effect 中的 f-string 拼接"""
+    return (f"P,{effect['color1']['r']},{effect['color1']['g']},{effect['color1']['b']}," + \
+            f"{effect['color2']['r']},{effect['color2']['g']},{effect['color2']['b']}," + \
+            f"{effect['maxBrightness']},{int(effect['launchMode'])}," + \
+            f"{int(effect['gradientMode'])},{int(effect['explodeMode'])}," + \
+            f"{int(effect['laserColor'])},{effect['mirrorAngle']}," + \
+            f"{effect['explosionLEDCount']},{effect['speedDelay']}\n").encode()
+
+
+def _play_fields(effect):
+    return (effect['color1']['r'], effect['color1']['g'], effect['color1']['b'],
+            effect['color2']['r'], effect['color2']['g'], effect['color2']['b'],
+            effect['maxBrightness'], effect['launchMode'], effect['gradientMode'],
+            effect['explodeMode'], effect['laserColor'], effect['mirrorAngle'],
+            effect['explosionLEDCount'], effect['speedDelay'])
+
+
+def bench_wire(count=5_000):
+    """P 命令: 文本 f-string vs 二进制帧，经 loop:// 串口回环"""
+    from serial.urlhandler.protocol_loop import Serial as LoopSerial
+
+    effects = [make_effect_data(i) for i in range(1, count + 1)]
+    fields = [_play_fields(e) for e in effects]
+
+    start = time.perf_counter()
+    text_cmds = [_legacy_play_command(e) for e in effects]
+    text_encode = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    frames = [wire_protocol.encode_frame(f) for f in fields]
+    frame_encode = (time.perf_counter() - start) / count
+
+    # loop:// 的缓冲区只有 4 KB，逐条写入并读回
+    port = LoopSerial('loop://', timeout=1)
+    received = b''.join(port.write(c) and port.read(len(c)) for c in text_cmds)
+    start = time.perf_counter()
+    decoded_text = [wire_protocol.decode_text(line) for line in received.splitlines()]
+    text_decode = (time.perf_counter() - start) / count
+
+    received = b''.join(port.write(f) and port.read(len(f)) for f in frames)
+    size = wire_protocol.FRAME_SIZE
+    start = time.perf_counter()
+    decoded_frames = [wire_protocol.decode_frame(received[i:i + size])
+                      for i in range(0, len(received), size)]
+    frame_decode = (time.perf_counter() - start) / count
+    port.close()
+
+    assert decoded_text == decoded_frames == fields
+    text_bytes = sum(len(c) for c in text_cmds) / count
+    print(f"text : {text_bytes:5.1f} B/cmd, encode {text_encode * 1e6:6.2f} us, "
+          f"decode {text_decode * 1e6:6.2f} us")
+    print(f"frame: {size:5.1f} B/cmd, encode {frame_encode * 1e6:6.2f} us, "
+          f"decode {frame_decode * 1e6:6.2f} us")
+
+
+def _measure(build, peak=False):
+    """返回 (结果, 耗时秒, 占用内存字节)；耗时不在 tracemalloc 下测量
+
+    peak=True 时内存取构建过程中的峰值，而不是结束时仍占用的量。
+    """
+    start = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = build()
+    current, highest = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, highest if peak else current
+
+
+def bench_model(count=100_000, plays=5):
+    """效果库: 旧版 dict-of-dicts vs FireworkEffect (内存/构建/播放编码)"""
+    def build_dicts():
+        library = make_library(count)
+        for e in library.values():
+            e['launchMode'] = LaunchMode(e['launchMode'])
+            e['gradientMode'] = GradientMode(e['gradientMode'])
+            e['explodeMode'] = ExplodeMode(e['explodeMode'])
+            e['laserColor'] = LaserColor(e['laserColor'])
+        return library
+
+    raw = make_library(count)
+
+    def build_effects():
+        return {i: FireworkEffect.from_json(e) for i, e in raw.items()}
+
+    dicts, dict_time, dict_mem = _measure(build_dicts)
+    effects, effect_time, effect_mem = _measure(build_effects)
+
+    start = time.perf_counter()
+    for _ in range(plays):
+        for e in dicts.values():
+            _legacy_play_command(e)
+    dict_play = (time.perf_counter() - start) / (plays * count)
+    start = time.perf_counter()
+    for _ in range(plays):
+        for e in effects.values():
+            e.wire()
+    effect_play = (time.perf_counter() - start) / (plays * count)
+
+    print(f"dict-of-dicts : {dict_mem / 2**20:7.1f} MB, build {dict_time:5.2f} s, "
+          f"play encode {dict_play * 1e6:5.2f} us")
+    print(f"FireworkEffect: {effect_mem / 2**20:7.1f} MB, build {effect_time:5.2f} s, "
+          f"play encode {effect_play * 1e6:5.2f} us (cached after first play)")
+
+
+def bench_columns(count=100_000, repeat=5):
+    """统计/筛选: dict 存储逐条遍历 vs 列式向量化"""
+    raw = make_library(count)
+    effects, _, dict_mem = _measure(
+        lambda: {i: FireworkEffect.from_json(e) for i, e in raw.items()})
+    table, build_time, table_mem = _measure(lambda: EffectColumns.from_effects(effects))
+
+    def dict_query():
+        stats = {
+            'last_effect_id': max(effects.keys()),
+            'launch': set(e.launch_mode.name for e in effects.values()),
+            'explode': set(e.explode_mode.name for e in effects.values()),
+            'gradient': set(e.gradient_mode.name for e in effects.values()),
+            'laser': set(e.laser_color.name for e in effects.values()),
+        }
+        hits = [i for i, e in effects.items()
+                if e.launch_mode == LaunchMode.PENDULUM_ASCEND
+                and e.laser_color == LaserColor.LASER_RED]
+        return stats, hits
+
+    def column_query():
+        stats = table.mode_histograms(), table.last_effect_id()
+        hits = table.select(launch_mode=LaunchMode.PENDULUM_ASCEND,
+                            laser_color=LaserColor.LASER_RED)
+        return stats, hits
+
+    assert dict_query()[1] == column_query()[1]
+    for name, query in (('dict', dict_query), ('columns', column_query)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            query()
+        print(f"{name:8}: stats + filter {(time.perf_counter() - start) / repeat * 1000:8.2f} ms")
+    print(f"memory  : FireworkEffect dict {dict_mem / 2**20:6.1f} MB, "
+          f"columns {table_mem / 2**20:6.1f} MB (arrays {table.nbytes() / 2**20:.1f} MB), "
+          f"column build {build_time:.2f} s")
+
+
+def _make_effects(count):
+    return {i: FireworkEffect.from_json(make_effect_data(i)) for i in range(1, count + 1)}
+
+
+def bench_startup(sizes=(1_000, 100_000, 1_000_000)):
+    """FireworkController() 构造 -> 第一个 R, 请求发出 P 命令: JSON 全量读入 vs 映射库文件"""
+    import control
+
+    for size in sizes:
+        effects = _make_effects(size)
+        target = size // 2 + 1
+        with tempfile.TemporaryDirectory() as tmp:
+            json_store = EffectStore(tmp, encode=FireworkEffect.to_json,
+                                     decode=FireworkEffect.from_json)
+            json_store.compact(effects)
+            json_store.close()
+            write_library(os.path.join(tmp, 'effects_data.lib'), effects)
+
+            # 旧流程: 整个 JSON 读入并解码后才能响应
+            def json_startup(tmp=tmp, target=target):
+                loaded = EffectStore(tmp, encode=FireworkEffect.to_json,
+                                     decode=FireworkEffect.from_json).load()
+                return loaded[target].wire()
+            _, json_time, json_mem = _measure(json_startup, peak=True)
+
+            def mapped_startup(tmp=tmp, target=target):
+                controller = control.FireworkController(port='loop://', data_dir=tmp)
+                controller.process_message(f"R,{target}")
+                sent = controller.arduino.read(controller.arduino.in_waiting)
+                controller.close()
+                controller.arduino.close()
+                return sent
+            sent, mapped_time, mapped_mem = _measure(mapped_startup, peak=True)
+            assert sent == effects[target].wire()
+
+        # 内存为 Python 堆峰值，映射的文件页不计入
+        print(f"startup @ {size:>8} effects: json {json_time * 1000:9.1f} ms "
+              f"(peak {json_mem / 2**20:7.1f} MB), mapped {mapped_time * 1000:7.1f} ms "
+              f"(peak {mapped_mem / 2**20:5.1f} MB)")
+        del effects
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    return f"p50 {pick(50):7.3f} ms, p99 {pick(99):7.3f} ms, max {ordered[-1] * 1000:7.3f} ms"
+
+
+async def _wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("simulated firmware did not respond")
+        await asyncio.sleep(0.0002)
+
+
+def bench_sim(messages=5_000, plays=200, saves=200, sequence=50, duration=0.02):
+    """用模拟串口测 process_message 吞吐、端到端播放/保存延迟与烟花长河的衔接"""
+    import control
+    from serial_sim import SimulatedArduino
+
+    effect = _make_effects(1)[1]
+    save_msg = "S," + ",".join(str(v) for v in effect.fields())
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        sim = SimulatedArduino(timeout=0.5)
+        controller = control.FireworkController(port=sim, data_dir=tmp)
+        # 1. 同步调用 process_message 的吞吐与每条消息 CPU
+        mix = [save_msg, "R,1", "CUSTOMIZE MODE", "Mode: STEP_ASCEND", "R,999999"]
+        batch = [mix[i % len(mix)] for i in range(messages)]
+        wall, cpu = time.perf_counter(), time.process_time()
+        for msg in batch:
+            controller.process_message(msg)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        # 2. 经 run_async 的端到端延迟
+        async def run():
+            task = asyncio.create_task(controller.run_async())
+            await _wait_for(lambda: controller.protocol != control.PROTOCOL_TEXT)
+
+            play_latency = []
+            for _ in range(plays):
+                count = len(sim.played)
+                sent = time.perf_counter()
+                sim.request_play(1)
+                await _wait_for(lambda count=count: len(sim.played) > count)
+                play_latency.append(sim.played[-1].started - sent)
+                await _wait_for(lambda: controller.pipeline.idle)
+
+            save_latency = []
+            saved = controller.save_effect
+            done = []
+            controller.save_effect = lambda *a: (saved(*a), done.append(time.perf_counter()))
+            for _ in range(saves):
+                sent = time.perf_counter()
+                sim.println(save_msg)
+                await _wait_for(lambda: len(done) > len(save_latency))
+                save_latency.append(done[-1] - sent)
+            controller.save_effect = saved
+
+            # 3. 烟花长河: 上一个播完到下一个开始播放之间灯带的空闲时间
+            ids = list(controller.effects_data)[:sequence]
+            controller.effects_data = {i: controller.effects_data[i] for i in ids}
+            sim.effect_duration = duration
+            count = len(sim.played)
+            sim.set_mode('IDLE')
+            await _wait_for(lambda: len(sim.played) >= count + len(ids),
+                            timeout=len(ids) * duration * 3 + 5)
+            records = sim.played[count:]
+            gaps = [b.started - a.finished for a, b in zip(records, records[1:])]
+
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            return play_latency, save_latency, gaps
+
+        play_latency, save_latency, gaps = asyncio.run(run())
+        controller.close()
+        sim.close()
+
+    print(f"process_message: {messages / wall:9.0f} msg/s, CPU {cpu / messages * 1e6:6.1f} us/msg")
+    print(f"R -> firmware plays : {_percentiles(play_latency)}")
+    print(f"S -> effect stored  : {_percentiles(save_latency)}")
+    print(f"sequence idle gaps  : {_percentiles(gaps)}")
+
+
+def bench_pipeline(count=40, time_scale=0.005, fixed_sleeps=(3, 5), seed=1):
+    """烟花长河节奏: 固定 sleep vs 按完成回执推进，比较灯带占空比与丢失的命令
+
+    模拟固件的播放时长 = 预测时长 * (0.85~1.15)，整体按 time_scale 压缩。
+    """
+    import random
+    from effect_timing import predict_duration
+    from serial_sim import SimulatedArduino
+    from show_pipeline import play_blocking
+
+    rng = random.Random(seed)
+    effects = [FireworkEffect(
+        color1=(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        color2=(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        max_brightness=rng.randint(128, 255),
+        launch_mode=rng.choice(list(LaunchMode)),
+        gradient_mode=rng.choice(list(GradientMode)),
+        explode_mode=rng.choice(list(ExplodeMode)),
+        laser_color=rng.choice(list(LaserColor)),
+        mirror_angle=rng.randint(0, 180),
+        explosion_led_count=rng.randint(50, 200),
+        speed_delay=rng.randint(10, 50)) for _ in range(count)]
+    jitter = {effect.fields(): rng.uniform(0.85, 1.15) for effect in effects}
+
+    def duration(fields):
+        effect = FireworkEffect.from_fields(fields)
+        return predict_duration(effect) * jitter[tuple(fields)] * time_scale
+
+    def report(name, sim, started):
+        records = sim.played
+        wall = records[-1].finished - started if records else 0.0
+        busy = sum(r.finished - r.started for r in records)
+        gaps = [b.started - a.finished for a, b in zip(records, records[1:])]
+        mean_gap = sum(gaps) / len(gaps) * 1000 if gaps else 0.0
+        print(f"{name:18}: played {len(records):3}/{count}, duty cycle {busy / wall:6.1%}, "
+              f"mean idle gap {mean_gap:8.3f} ms")
+
+    for sleep in fixed_sleeps:
+        sim = SimulatedArduino(effect_duration=duration, boot_messages=False)
+        started = time.perf_counter()
+        for effect in effects:
+            sim.write(effect.wire())
+            time.sleep(sleep * time_scale)
+        time.sleep(0.01)  # 等最后一个播完
+        while sim.busy:
+            time.sleep(0.001)
+        report(f"fixed sleep {sleep} s", sim, started)
+        sim.close()
+
+    sim = SimulatedArduino(timeout=0.1, effect_duration=duration, boot_messages=False)
+    started = time.perf_counter()
+    pipeline = play_blocking(sim, effects, on_message=None)
+    report("ack pipeline", sim, started)
+    print(f"predicted/actual duration scale learned from acks: {pipeline.scale / time_scale:.3f}")
+    sim.close()
+
+
+def _legacy_dispatch(states, msg, on_state, on_play, on_save, on_test):
+    """改为查表分发之前 process_message 的判断顺序，处理动作换成回调"""
+    if 'MODE' in msg:
+        for state, state_msg in states.items():
+            if state_msg in msg:
+                on_state(state)
+                return
+    version = wire_protocol.parse_hello(msg)
+    if version is not None:
+        return
+    if msg.startswith('R,'):
+        try:
+            on_play(int(msg.split(',')[1]))
+        except (IndexError, ValueError):
+            pass
+    if msg.startswith('S,'):
+        parts = msg.split(',')
+        if len(parts) >= 15:
+            on_save(parts[1:15])
+    elif msg.startswith('T,'):
+        parts = msg.split(',')
+        on_test(parts[1:])
+
+
+def bench_dispatch(messages=200_000, repeat=5):
+    """消息分发本身的吞吐: 旧的逐项判断 vs 首字节查表 (处理函数均为空操作)"""
+    import control
+
+    effect = _make_effects(1)[1]
+    # 固件实际输出以调试信息为主，夹杂横幅、点播、保存与测试数据
+    mix = ["Received effect parameters:", "Launch Mode: Step", "Explosion LED Count: 40",
+           "Speed Delay: 5", ">> Step Ascend", "Laser: Off", "Mirror angle: 90",
+           "Explode Firework!", "IDLE MODE", "CUSTOMIZE MODE", "R,12",
+           "S," + ",".join(str(v) for v in effect.fields()), "T,ADC,joystick,512,498"]
+    batch = [mix[i % len(mix)] for i in range(messages)]
+    noop = lambda *args: None
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        controller = control.FireworkController(port='loop://', data_dir=tmp)
+        controller.handle_state_change = noop
+        for command in list(controller.handlers):
+            controller.register_handler(command, noop)
+
+        def legacy():
+            for msg in batch:
+                _legacy_dispatch(control.STATES, msg, noop, noop, noop, noop)
+
+        def table():
+            for msg in batch:
+                controller.process_message(msg)
+
+        results = {}
+        for name, run in (('legacy', legacy), ('table', table)):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - start)
+            results[name] = best
+        counts = dict(controller.message_counts)
+        controller.close()
+
+    for name, seconds in results.items():
+        print(f"{name:7}: {messages / seconds:10.0f} msg/s, {seconds / messages * 1e9:6.0f} ns/msg")
+    print(f"speedup: {results['legacy'] / results['table']:.2f}x")
+    print(f"message counts: {counts}")
+
+
+def _render_gradient_loop(effect):
+    """逐颗 LED 计算 explosionGradientNormal 的各帧，作为向量化渲染的对照"""
+    import numpy as np
+    from effect_model import TOTAL_LED_COUNT
+
+    def blend8(a, b, amount):
+        return (a * 256 + b + (b - a) * amount) >> 8
+
+    strip_len, volume = effect.explosion_led_count, effect.mirror_angle
+    start, end = TOTAL_LED_COUNT - 1, TOTAL_LED_COUNT - volume
+    frames = []
+    for step in [(start, g) for g in range(1, strip_len + 1)] + \
+            [(pos, strip_len) for pos in range(start, end, -1)]:
+        pos, length = step
+        leds = np.zeros((TOTAL_LED_COUNT, 3), np.uint8)
+        for i in range(length):
+            index = pos - i
+            if 0 <= index < TOTAL_LED_COUNT:
+                amount = int(np.float32(i) / np.float32(strip_len - 1) * np.float32(255))
+                leds[index] = [blend8(a, b, amount) for a, b in zip(effect.color1, effect.color2)]
+        frames.append(leds)
+    frames.append(np.zeros((TOTAL_LED_COUNT, 3), np.uint8))
+    return np.stack(frames)
+
+
+def bench_render(count=200, seed=1):
+    """离线渲染: 每个效果的渲染耗时，以及爆炸条带向量化 vs 逐颗 LED 计算"""
+    import random
+    import numpy as np
+    from effect_render import render
+
+    rng = random.Random(seed)
+    effects = [FireworkEffect(
+        color1=(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        color2=(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        max_brightness=rng.randint(128, 255),
+        launch_mode=rng.choice(list(LaunchMode)),
+        gradient_mode=rng.choice(list(GradientMode)),
+        explode_mode=rng.choice(list(ExplodeMode)),
+        laser_color=rng.choice(list(LaserColor)),
+        mirror_angle=rng.randint(0, 180),
+        explosion_led_count=rng.randint(50, 200),
+        speed_delay=rng.randint(10, 50)) for _ in range(count)]
+
+    start = time.perf_counter()
+    frames = sum(len(render(effect, seed=seed)) for effect in effects)
+    elapsed = time.perf_counter() - start
+    print(f"render: {elapsed / count * 1000:6.2f} ms/effect, {frames / elapsed:9.0f} frames/s")
+
+    effect = FireworkEffect(color1=(255, 0, 0), color2=(0, 0, 255), max_brightness=255,
+                            launch_mode=LaunchMode.NORMAL_ASCEND,
+                            gradient_mode=GradientMode.GRADIENT, explode_mode=ExplodeMode.NORMAL,
+                            laser_color=LaserColor.LASER_NONE, mirror_angle=180,
+                            explosion_led_count=200, speed_delay=20)
+    vector = render(effect)
+    launch = len(vector) - effect.explosion_led_count - effect.mirror_angle
+    start = time.perf_counter()
+    loop = _render_gradient_loop(effect)
+    loop_time = time.perf_counter() - start
+    start = time.perf_counter()
+    render(effect)
+    vector_time = time.perf_counter() - start
+    assert np.array_equal(vector.frames[launch:], loop), "vectorized render differs"
+    print(f"gradient explosion ({len(loop)} frames): per-LED loop {loop_time * 1000:8.1f} ms, "
+          f"vectorized (whole effect) {vector_time * 1000:6.1f} ms")
+
+
+def bench_render_cache(count=2_000, distinct=100, seed=1):
+    """已保存效果的指标: 每次重新渲染 vs 渲染缓存 (内存 / 冷启动后读磁盘)
+
+    库中的效果来自 distinct 组参数，只有 ID、保存时间和激光不同，模拟反复保存相近的效果。
+    """
+    import random
+    from render_cache import RenderCache, compute_metrics
+    from effect_render import render
+
+    rng = random.Random(seed)
+    bases = list(_make_effects(distinct).values())
+    effects = []
+    for i in range(count):
+        fields = list(rng.choice(bases).fields())
+        fields[10] = rng.choice(list(LaserColor))
+        effects.append(FireworkEffect.from_fields(fields, id=i))
+
+    start = time.perf_counter()
+    for effect in effects[:count // 10]:
+        compute_metrics(render(effect))
+    uncached = (time.perf_counter() - start) * 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = RenderCache(cache_dir=tmp)
+        start = time.perf_counter()
+        for effect in effects:
+            cache.metrics(effect)
+        cached = time.perf_counter() - start
+        stats = cache.stats()
+
+        # 冷启动: 新进程只有磁盘上的缓存
+        cold = RenderCache(cache_dir=tmp)
+        start = time.perf_counter()
+        for effect in bases:
+            cold.get(effect)
+        disk = time.perf_counter() - start
+        disk_bytes = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+
+    print(f"metrics for {count} effects: render every time {uncached:7.2f} s, "
+          f"cached {cached:6.3f} s ({uncached / cached:.0f}x)")
+    print(f"cache: hit rate {stats['hit_rate']:.1%}, {stats['entries']} renderings in "
+          f"{stats['memory_bytes'] / 1e6:.1f} MB memory, {disk_bytes / 1e6:.1f} MB on disk")
+    print(f"cold start from disk: {disk / distinct * 1000:.2f} ms/effect")
+
+
+def bench_pool(unit_counts=(1, 2, 4, 8), plays=100, cues=40, duration=0.005, seed=1):
+    """多台控制器: 播放吞吐随端点数的扩展，以及同步起播时各固件开始播放的时间差
+
+    同步测试中一半模拟固件只支持文本协议(命令传输 + 解析慢几毫秒)，
+    每次起播前各端点先播一个随机时长的效果，使它们的空闲时刻错开。
+    """
+    import random
+    from controller_pool import ControllerPool
+    from serial_sim import SimulatedArduino
+
+    effect = _make_effects(1)[1]
+
+    async def throughput(count):
+        sims = [SimulatedArduino(timeout=0.5, effect_duration=duration) for _ in range(count)]
+        pool = ControllerPool(sims)
+        stop = asyncio.Event()
+        task = asyncio.create_task(pool.run_async(stop))
+        await _wait_for(lambda: pool.ready)
+        start = time.perf_counter()
+        for name in pool.units:
+            for _ in range(plays):
+                pool.play(effect, name)
+        await _wait_for(lambda: all(len(sim.played) >= plays for sim in sims), timeout=30)
+        wall = time.perf_counter() - start
+        stop.set()
+        await task
+        for sim in sims:
+            sim.close()
+        return count * plays / wall
+
+    # 同步起播的效果 speedDelay 为 0，用来在固件记录中识别
+    cue_effect = FireworkEffect.from_fields(effect.fields()[:13] + (0,))
+    rng = random.Random(seed)
+    fillers = [FireworkEffect.from_fields(effect.fields()[:13] + (rng.randint(1, 50),))
+               for _ in range(cues * 4)]
+
+    def sim_duration(fields):
+        return 0.002 if fields[13] == 0 else fields[13] * 0.0005
+
+    async def skew(mode, count=4):
+        sims = [SimulatedArduino(timeout=0.5, effect_duration=sim_duration, binary=i % 2 == 0)
+                for i in range(count)]
+        pool = ControllerPool(sims)
+        if mode == 'cue, no compensation':
+            for unit in pool.units.values():
+                unit.command_latency = lambda effect: 0.0
+        stop = asyncio.Event()
+        task = asyncio.create_task(pool.run_async(stop))
+        await _wait_for(lambda: pool.ready)
+        filler = iter(fillers)
+        for _ in range(cues):
+            for name in pool.units:
+                pool.play(next(filler), name)
+            if mode == 'broadcast':
+                pool.broadcast(cue_effect)
+            else:
+                pool.cue(cue_effect)
+            await _wait_for(lambda: pool.idle)
+        stop.set()
+        await task
+        starts = [[r.started for r in sim.played if r.fields[13] == 0] for sim in sims]
+        for sim in sims:
+            sim.close()
+        return [max(group) - min(group) for group in zip(*starts)], pool
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rates = {count: asyncio.run(throughput(count)) for count in unit_counts}
+        results = {mode: asyncio.run(skew(mode))
+                   for mode in ('broadcast', 'cue, no compensation', 'cue')}
+
+    base = rates[unit_counts[0]]
+    for count, rate in rates.items():
+        print(f"{count} units: {rate:7.1f} plays/s ({rate / base:4.2f}x)")
+    for mode, (spreads, pool) in results.items():
+        print(f"start skew, {mode:21}: {_percentiles(spreads)}")
+    print(f"cue write spread: {pool.stats()['write_spread']}")
+
+
+def bench_batch(count=2 * wire_protocol.MAX_BATCH_ITEMS, seed=1):
+    """烟花长河: 逐个发送(play_next_firework + 回执) vs 批量上传由固件本地连续播放
+
+    比较相邻两个烟花之间灯带空闲时间的抖动；"busy host" 时上位机另有一个线程在做 CPU 计算。
+    批量之间要多一次上传(每个效果 19 字节)，这些间隔单独列出。
+    """
+    import random
+    import statistics
+    import threading
+    import control
+    from serial_sim import SimulatedArduino
+
+    rng = random.Random(seed)
+    effects = {i: FireworkEffect.from_fields(effect.fields(), id=i)
+               for i, effect in _make_effects(count).items()}
+    durations = {effect.fields(): rng.uniform(0.01, 0.03) for effect in effects.values()}
+
+    async def run_sequence(sim, tmp):
+        controller = control.FireworkController(port=sim, data_dir=tmp)
+        controller.effects_data = dict(effects)
+        task = asyncio.create_task(controller.run_async())
+        await _wait_for(lambda: controller.protocol != control.PROTOCOL_TEXT)
+        sim.set_mode('IDLE')
+        await _wait_for(lambda: len(sim.played) >= count, timeout=count * 0.1 + 5)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        controller.close()
+
+    def busy(stop):
+        while not stop.is_set():
+            sum(i * i for i in range(10_000))
+
+    for load in (False, True):
+        for name, version in (("per-effect acks", 1), ("batch upload", wire_protocol.PROTOCOL_VERSION)):
+            sim = SimulatedArduino(timeout=0.5, effect_duration=lambda f: durations[tuple(f)],
+                                   protocol_version=version, boot_messages=False)
+            stop = threading.Event()
+            worker = threading.Thread(target=busy, args=(stop,), daemon=True)
+            if load:
+                worker.start()
+            with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(run_sequence(sim, tmp))
+            stop.set()
+            sim.close()
+            records = sim.played[:count]
+            gaps = [b.started - a.finished for a, b in zip(records, records[1:])]
+            label = f"{name}{', busy host' if load else ''}"
+            if version >= wire_protocol.BATCH_MIN_VERSION:
+                size = wire_protocol.MAX_BATCH_ITEMS
+                boundaries = [gaps[i - 1] for i in range(size, count, size)]
+                gaps = [gap for i, gap in enumerate(gaps, 1) if i % size]
+                label += f" ({len(boundaries)} uploads {statistics.mean(boundaries) * 1000:.1f} ms)"
+            print(f"{label:48}: gap mean {statistics.mean(gaps) * 1000:6.3f} ms, "
+                  f"stdev {statistics.stdev(gaps) * 1000:6.3f} ms, {_percentiles(gaps)}")
+
+
+def bench_backpressure(requests=20, automated=30, previews=50, duration=0.03):
+    """慢消费者: 突发的点播、自动播放与预览 -> 直接写串口 vs 出站队列(回执归还信用 + 预览合并)
+
+    丢失 = 发出的播放请求 - 固件播放的 - 队列有意合并/丢弃的。
+    """
+    import control
+    from serial_sim import SimulatedArduino
+
+    effects = _make_effects(requests + automated + previews)
+    ids = list(effects)
+    keypad, auto, preview = (ids[:requests], ids[requests:requests + automated],
+                             ids[requests + automated:])
+
+    def burst(play, do_preview):
+        """按键、脚本与预览交错到达，间隔 1 ms"""
+        for i in range(max(len(keypad), len(auto), len(preview))):
+            if i < len(keypad):
+                play(keypad[i])
+            if i < len(auto):
+                play(auto[i])
+            if i < len(preview):
+                do_preview(effects[preview[i]])
+            yield
+
+    # 1. 原来的做法: 每个请求立即同步写串口
+    sim = SimulatedArduino(effect_duration=duration, boot_messages=False)
+    write = lambda effect: sim.write(effect.wire())
+    for _ in burst(lambda i: write(effects[i]), write):
+        time.sleep(0.001)
+    while True:
+        time.sleep(duration * 2)
+        if not sim.busy and not sim._rx:
+            break
+    sim.close()
+    naive = (len(sim.played), sim.rx_overruns, sim.dropped_bytes)
+
+    # 2. 出站队列
+    async def queued():
+        sim = SimulatedArduino(timeout=0.5, effect_duration=duration, boot_messages=False)
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            controller = control.FireworkController(port=sim, data_dir=tmp)
+            controller.effects_data = dict(effects)
+            task = asyncio.create_task(controller.run_async())
+            await _wait_for(lambda: controller.protocol != control.PROTOCOL_TEXT)
+            for _ in burst(lambda i: controller.play_effect(i, urgent=i in keypad),
+                           controller.preview):
+                await asyncio.sleep(0.001)
+            await _wait_for(lambda: controller.pipeline.idle and not controller.pipeline.pending,
+                            timeout=30)
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+            controller.close()
+        sim.close()
+        return sim, controller.pipeline
+
+    sim, pipeline = asyncio.run(queued())
+    issued = requests + automated + previews
+    print(f"direct writes: {issued} commands, played {naive[0]:3}, lost {issued - naive[0]:3} "
+          f"(RX overrun {naive[1]} B, drained {naive[2]} B)")
+    played = len(sim.played)
+    lost = issued - played - pipeline.coalesced - pipeline.dropped
+    print(f"command queue: {issued} commands, played {played:3}, lost {lost:3} "
+          f"(coalesced previews {pipeline.coalesced}, dropped {pipeline.dropped}, "
+          f"RX overrun {sim.rx_overruns} B, drained {sim.dropped_bytes} B, "
+          f"firmware reports {pipeline.overrun_bytes} B)")
+    latest = effects[preview[-1]].fields()
+    print(f"latest preview played: {any(r.fields == latest for r in sim.played)}")
+
+
+def bench_metrics(messages=50_000):
+    """指标与日志的热路径开销: 每条消息的处理耗时(日志关闭 / 打开)、单次 observe 与导出耗时"""
+    import control
+    import metrics
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        controller = control.FireworkController(port='loop://', data_dir=tmp)
+        batch = ['T,sensor,light,%d' % (i % 1024) for i in range(messages)]
+
+        def per_message():
+            start = time.perf_counter()
+            for msg in batch:
+                controller.process_message(msg)
+            return (time.perf_counter() - start) / messages * 1e6
+
+        logger = logging.getLogger('control')
+        level = logger.level
+        handler = logging.StreamHandler(io.StringIO())
+        try:
+            logger.setLevel(logging.INFO)
+            disabled = per_message()
+            logger.addHandler(handler)
+            logger.propagate = False
+            logger.setLevel(logging.DEBUG)
+            enabled = per_message()
+        finally:
+            logger.removeHandler(handler)
+            logger.propagate = True
+            logger.setLevel(level)
+        controller.arduino.close()
+        controller.close()
+
+    histogram = metrics.Histogram('bench_seconds', '')
+    start = time.perf_counter()
+    for i in range(messages):
+        histogram.observe(i * 1e-6)
+    observe = (time.perf_counter() - start) / messages * 1e6
+    start = time.perf_counter()
+    for _ in range(100):
+        text = metrics.REGISTRY.to_prometheus()
+    export = (time.perf_counter() - start) / 100 * 1e3
+
+    print(f"process_message (debug log off): {disabled:6.2f} us/msg")
+    print(f"process_message (debug log on) : {enabled:6.2f} us/msg")
+    print(f"Histogram.observe              : {observe:6.2f} us")
+    print(f"Prometheus export              : {export:6.2f} ms "
+          f"({len(metrics.REGISTRY.metrics)} metrics, {len(text)} bytes)")
+
+
+def _legacy_random_effect(rng):
+    """旧版 generate_random_effect: 每个效果十几次 random 调用并重建枚举列表"""
+    def random_color():
+        return (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+
+    return FireworkEffect(
+        color1=random_color(),
+        color2=random_color(),
+        max_brightness=rng.randint(128, 255),
+        launch_mode=rng.choice(list(LaunchMode)),
+        gradient_mode=rng.choice(list(GradientMode)),
+        explode_mode=rng.choice(list(ExplodeMode)),
+        laser_color=rng.choice(list(LaserColor)),
+        mirror_angle=rng.randint(0, 180),
+        explosion_led_count=rng.randint(50, 200),
+        speed_delay=rng.randint(10, 50)
+    )
+
+
+def bench_generate(count=1_000_000, legacy=20_000, seed=1):
+    """随机演出计划: 逐个 random 生成 vs NumPy 批量生成(含相邻发射模式不重复与调色板约束)"""
+    import random
+    import numpy as np
+    from effect_generator import EffectGenerator
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for _ in range(legacy):
+        _legacy_random_effect(rng)
+    per_effect = (time.perf_counter() - start) / legacy
+
+    options = {
+        'plain': {},
+        'no repeat + weights': {'no_repeat': ('launch_mode',),
+                                'weights': {'launch_mode': [2, 1, 1], 'laser_color': [4, 1, 1]}},
+        'no repeat + palette': {'no_repeat': ('launch_mode', 'explode_mode'),
+                                'palette': [(255, 0, 0), (255, 160, 0), (255, 255, 255),
+                                            (0, 80, 255)]},
+    }
+    print(f"per-effect random : {per_effect * 1e6:6.2f} us/effect, "
+          f"{count} effects ~ {per_effect * count:6.2f} s (extrapolated from {legacy})")
+    for name, kwargs in options.items():
+        generator = EffectGenerator(seed, **kwargs)
+        start = time.perf_counter()
+        show = generator.generate(count)
+        elapsed = time.perf_counter() - start
+        launch = show.column('launch_mode')
+        repeats = int(np.count_nonzero(launch[1:] == launch[:-1]))
+        print(f"batch, {name:19}: {elapsed * 1000:6.0f} ms for {count} effects "
+              f"({elapsed / count * 1e9:4.0f} ns/effect), adjacent launch repeats {repeats}")
+    # 播放/上传时按需取出效果对象
+    start = time.perf_counter()
+    batch = list(show.effects(0, 1024))
+    materialize = (time.perf_counter() - start) / len(batch)
+    print(f"columns -> FireworkEffect: {materialize * 1e6:.2f} us/effect "
+          f"(first {len(batch)} of the plan)")
+
+
+class _NullPort:
+    """丢弃写入的串口，只统计字节数"""
+
+    def __init__(self):
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+        return len(data)
+
+
+def bench_play(count=100_000, library=50_000, plays=200_000):
+    """播放路径吞吐: 每次拼 f-string vs 缓存的已编码命令，经 play_effect + 流水线写出"""
+    import control
+
+    dicts = [make_effect_data(i) for i in range(1, count + 1)]
+    port = _NullPort()
+    start = time.perf_counter()
+    for effect in dicts:
+        port.write(_legacy_play_command(effect))
+    legacy = count / (time.perf_counter() - start)
+
+    effects = [FireworkEffect.from_json(e) for e in dicts]
+    start = time.perf_counter()
+    for effect in effects:
+        port.write(effect.wire())
+    first = count / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for effect in effects:
+        port.write(effect.wire())
+    cached = count / (time.perf_counter() - start)
+    print(f"encode + write, f-string from dict : {legacy:10.0f} plays/s")
+    print(f"encode + write, first wire()       : {first:10.0f} plays/s")
+    print(f"encode + write, cached wire()      : {cached:10.0f} plays/s")
+
+    # 完整的 play_effect: 入队 -> 写出 -> 完成回执；烟花长河反复播放同一批效果
+    rates = {}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        write_library(os.path.join(tmp, 'effects_data.lib'), _make_effects(library))
+        for label, ids in (('hot set of 1000 effects', range(1, 1001)),
+                           (f'whole {library}-effect library', range(1, library + 1))):
+            controller = control.FireworkController(port=_NullPort(), data_dir=tmp)
+            ids = list(ids)
+            start = time.perf_counter()
+            for i in range(plays):
+                controller.play_effect(ids[i % len(ids)])
+                controller.pipeline.complete(None)
+            rates[label] = plays / (time.perf_counter() - start)
+            controller.close()
+    for label, rate in rates.items():
+        print(f"play_effect + ack, {label:28}: {rate:8.0f} plays/s")
+
+
+class _VirtualClock:
+    """模拟时钟: sleep 多睡 0.05-1.5 ms (定时器粒度)，每次写串口花 0.3-2 ms (play_effect、打印、USB)"""
+
+    def __init__(self, seed=1):
+        import random
+        self.rng = random.Random(seed)
+        self.now = 0
+        self.stall = {}  # 第几次写 -> 额外阻塞的秒数
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += round((seconds + self.rng.uniform(0.00005, 0.0015)) * 1e9)
+        else:
+            self.now += round(self.rng.uniform(2e-6, 10e-6) * 1e9)
+
+    def write(self, data):
+        self.now += round((self.rng.uniform(0.0003, 0.002) + self.stall.pop(self.writes, 0)) * 1e9)
+        self.writes += 1
+
+    writes = 0
+
+
+def _chained_sleeps(show, clock):
+    """旧的播放方式: 写出后 sleep(到下一个 cue 的间隔)，返回每个 cue 的迟到纳秒数"""
+    start = clock.clock()
+    lateness = []
+    for i, command in enumerate(show.commands):
+        lateness.append(clock.clock() - (start + show.offsets[i]))
+        clock.write(command)
+        if i + 1 < len(show):
+            clock.sleep((show.offsets[i + 1] - show.offsets[i]) / 1e9)
+    return lateness
+
+
+def bench_timeline(hours=1.0, seed=1):
+    """时间线播放的 cue 迟到: 连续 sleep(间隔) vs 按绝对截止时刻，模拟时钟下播放一小时"""
+    import random
+    from show_timeline import CATCH_UP, SKIP, ShowRunner, compile_show
+
+    rng = random.Random(seed)
+    effects = _make_effects(64)
+    cues = []
+    at = 0.0
+    while at < hours * 3600:
+        cues.append((round(at, 3), rng.randrange(1, 65)))
+        at += rng.uniform(1.5, 4.0)
+    start = time.perf_counter()
+    show = compile_show(cues, effects)
+    print(f"compiled {len(show)} cues in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def window(lateness, offsets, low, high):
+        picked = [late / 1e9 for late, offset in zip(lateness, offsets) if low <= offset / 60e9 < high]
+        return _percentiles(picked)
+
+    minutes = hours * 60
+    legacy = _chained_sleeps(show, _VirtualClock(seed))
+    clock = _VirtualClock(seed)
+    runner = ShowRunner(show, clock.write, clock=clock.clock, sleep=clock.sleep).run()
+    # 每个 cue 的起播时刻提前了命令传输时间，迟到按写出时刻计算
+    for name, lateness in (('chained sleep()', legacy), ('monotonic deadlines', runner.lateness)):
+        print(f"{name:20}: first 10 min {window(lateness, show.offsets, 0, 10)}")
+        print(f"{'':20}  last 10 min  {window(lateness, show.offsets, minutes - 10, minutes)}")
+
+    # 写串口卡住 0.35 s 时，间隔 0.1 s 的密集段里的 cue
+    dense = compile_show([(i * 0.1, 1 + i % 64) for i in range(100)], effects)
+    for policy in (CATCH_UP, SKIP):
+        clock = _VirtualClock(seed)
+        clock.stall[20] = 0.35
+        runner = ShowRunner(dense, clock.write, policy, clock=clock.clock, sleep=clock.sleep).run()
+        late = sorted(runner.lateness)
+        print(f"0.35 s stall, {policy:8}: fired {runner.fired:3}, skipped {runner.skipped}, "
+              f"late > 50 ms {sum(l > 50e6 for l in late)}, "
+              f"p50 {late[len(late) // 2] / 1e6:.3f} ms, max {late[-1] / 1e6:.1f} ms")
+
+    # 真实时钟: 200 个间隔 10 ms 的 cue
+    fast = compile_show([(i * 0.01, 1 + i % 64) for i in range(200)], effects)
+    port = _NullPort()
+    start = time.monotonic_ns()
+    legacy = []
+    for i, command in enumerate(fast.commands):
+        legacy.append((time.monotonic_ns() - start - fast.offsets[i]) / 1e9)
+        port.write(command)
+        if i + 1 < len(fast):
+            time.sleep((fast.offsets[i + 1] - fast.offsets[i]) / 1e9)
+    runner = ShowRunner(fast, port.write).run()
+    print(f"real clock, chained sleep()    : {_percentiles(legacy)}")
+    print(f"real clock, monotonic deadlines: "
+          f"{_percentiles([late / 1e9 for late in runner.lateness])}")
+
+
+def bench_telemetry(days=7, interval=0.5, flush_every=5.0, legacy=100_000):
+    """T 消息的存储: 不断增长的字典列表 vs 定长环形缓冲区，模拟时钟下连续运行 days 天"""
+    from telemetry import TelemetryStore
+
+    messages = int(days * 86400 / interval)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    test_data = []
+    start = time.perf_counter()
+    for i in range(legacy):
+        parts = ['ADC', 'joystick', str(i % 1024), str((i * 7) % 1024)]
+        test_data.append({'type': parts[0], 'name': parts[1], 'value': parts[2:],
+                          'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+    legacy_time = (time.perf_counter() - start) / legacy
+    per_message = (tracemalloc.get_traced_memory()[0] - base) / legacy
+    del test_data
+    tracemalloc.stop()
+    print(f"list of dicts : {legacy_time * 1e6:5.2f} us/msg, {per_message:5.0f} B/msg "
+          f"-> {per_message * messages / 2**20:6.0f} MB after {days} days")
+
+    now = [0]
+    with tempfile.TemporaryDirectory() as tmp:
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        store = TelemetryStore(tmp, clock=lambda: now[0], background=False)
+        step = round(interval * 1e9)
+        flush_step = round(flush_every / interval)
+        per_day = int(86400 / interval)
+        usage = []
+        elapsed = 0.0
+        for i in range(messages):
+            now[0] += step
+            values = (str(i % 1024), str((i * 7) % 1024))
+            t = time.perf_counter()
+            store.add('ADC', 'joystick', values)
+            elapsed += time.perf_counter() - t
+            if i % flush_step == flush_step - 1:
+                store.flush()
+            if i % per_day == per_day - 1:
+                usage.append(tracemalloc.get_traced_memory()[0] - base)
+        store.flush()
+        tracemalloc.stop()
+        disk = sum(os.path.getsize(os.path.join(tmp, f)) for f in store.segments)
+        print(f"ring buffer   : {elapsed / messages * 1e6:5.2f} us/msg (under tracemalloc), "
+              f"Python heap per day (MB): {' '.join(f'{u / 2**20:.2f}' for u in usage)}")
+        print(f"                {store.stats()}, segments on disk {disk / 2**20:.1f} MB")
+
+        for label, window in (('last minute', 60.0), ('last hour', 3600.0)):
+            start = time.perf_counter()
+            stats = store.window_stats(window)
+            rate = store.rate(window)
+            query = time.perf_counter() - start
+            first = stats[('ADC', 'joystick', 0)]
+            print(f"window_stats + rate, {label:11}: {query * 1000:6.2f} ms, {rate:5.0f} samples/min, "
+                  f"joystick[0] min {first['min']:.0f} max {first['max']:.0f}")
+        start = time.perf_counter()
+        minutes = store.rate_per_minute(10)
+        print(f"rate_per_minute(10): {(time.perf_counter() - start) * 1000:.2f} ms, {minutes}")
+        store.close()
+
+
+def _near_duplicates(effects, count, seed=1):
+    """在 effects 中追加 count 个由已有效果微调而来的近似重复(可能基于之前的近似重复)"""
+    import random
+    rng = random.Random(seed)
+    jitter = lambda value, amount, high: min(high, max(0, value + rng.randint(-amount, amount)))
+    next_id = max(effects) + 1
+    for _ in range(count):
+        base = effects[rng.randrange(1, next_id)]
+        effects[next_id] = FireworkEffect(
+            (jitter(base.color1[0], 20, 255), jitter(base.color1[1], 20, 255), base.color1[2]),
+            (base.color2[0], jitter(base.color2[1], 20, 255), base.color2[2]),
+            jitter(base.max_brightness, 20, 255), base.launch_mode, base.gradient_mode,
+            base.explode_mode, base.laser_color, jitter(base.mirror_angle, 8, 180),
+            jitter(base.explosion_led_count, 8, 280), jitter(base.speed_delay, 2, 0xFFFF),
+            id=next_id)
+        next_id += 1
+    return effects
+
+
+def bench_dedupe(count=100_000, duplicates=10_000, checks=500):
+    """近似重复检测: 保存时逐个比较 vs LSH 索引；整库去重逐个查找 vs 向量化"""
+    from effect_generator import generate_effects
+    from effect_similarity import SimilarityIndex, effect_features
+
+    effects = {e.id: e for e in generate_effects(count, seed=3).effects()}
+    effects = _near_duplicates(effects, duplicates)
+    probes = [effects[i] for i in range(count + 1, count + 1 + checks)]
+
+    index = SimilarityIndex()
+    limits = index.limits
+    features = [(effect_id, *effect_features(e)) for effect_id, e in effects.items()]
+    start = time.perf_counter()
+    linear = []
+    for probe in probes:
+        modes, values = effect_features(probe)
+        linear.append(min((effect_id for effect_id, m, v in features if m == modes and all(
+            abs(a - b) <= limit for a, b, limit in zip(values, v, limits))), default=None))
+    linear_time = (time.perf_counter() - start) / checks
+
+    start = time.perf_counter()
+    index = SimilarityIndex.from_effects(effects)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    found = [index.find(probe) for probe in probes]
+    lsh_time = (time.perf_counter() - start) / checks
+    # 每个探测效果都在库中，匹配到的是ID最小的近似重复(可能是它自己)
+    agree = sum(a == b for a, b in zip(linear, found))
+    print(f"save-time check @ {len(effects)} effects: linear scan {linear_time * 1000:8.3f} ms, "
+          f"LSH {lsh_time * 1000:6.3f} ms ({linear_time / lsh_time:5.0f}x), "
+          f"same answer {agree}/{checks}, index build {build:.1f} s")
+
+    table = EffectColumns.from_effects(effects)
+    start = time.perf_counter()
+    index = SimilarityIndex.from_columns(table)
+    column_build = time.perf_counter() - start
+    start = time.perf_counter()
+    column_found = [index.find(probe) for probe in probes]
+    column_time = (time.perf_counter() - start) / checks
+    print(f"index from columns: build {column_build:.2f} s, LSH {column_time * 1000:6.3f} ms, "
+          f"same answer {sum(a == b for a, b in zip(found, column_found))}/{checks}")
+    start = time.perf_counter()
+    vectorized = SimilarityIndex().duplicates_in(table)
+    vector_time = time.perf_counter() - start
+    start = time.perf_counter()
+    sequential = SimilarityIndex()._duplicates_sequential(table)
+    sequential_time = time.perf_counter() - start
+    same = sum(vectorized.get(effect_id) == kept for effect_id, kept in sequential.items())
+    print(f"library dedupe: sequential {sequential_time:6.2f} s ({len(sequential)} duplicates), "
+          f"vectorized {vector_time:6.2f} s ({len(vectorized)} duplicates, "
+          f"{same} identical decisions)")
+
+
+def _columns_library(path, table):
+    """EffectColumns 直接写成库文件，不逐个构造 FireworkEffect"""
+    import numpy as np
+    from effect_columns import COLUMNS
+    from effect_library import HEADER, LIBRARY_VERSION, MAGIC, RECORD
+
+    dtype = np.dtype([(name, '<' + code) for name, (code, _) in COLUMNS.items()] +
+                     [('timestamp', 'S32')])
+    assert dtype.itemsize == RECORD.size
+    records = np.zeros(len(table), dtype)
+    for name in COLUMNS:
+        records[name] = table.column(name)
+    records['timestamp'] = datetime.now().isoformat().encode()
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, LIBRARY_VERSION, len(table)))
+        f.write(table.column('id').astype('<q').tobytes())
+        f.write(records.tobytes())
+
+
+def bench_validate(count=1_000_000, json_count=200_000, workers=(1, 2, 4, 8), seed=1):
+    """按固件限制检查效果库: 不同进程数的耗时、各块 CPU 合计与串行部分"""
+    from effect_generator import generate_effects
+    from effect_validation import validate_library
+
+    # 范围放宽到超出固件限制，以便有问题可报
+    table = generate_effects(count, seed=seed, ranges={
+        'max_brightness': (0, 255), 'mirror_angle': (0, 180),
+        'explosion_led_count': (0, 280), 'speed_delay': (0, 300)})
+    with tempfile.TemporaryDirectory() as tmp:
+        lib_file = os.path.join(tmp, 'effects_data.lib')
+        _columns_library(lib_file, table)
+        json_file = os.path.join(tmp, 'effects_data.json')
+        EffectStore(tmp, background_backups=False).write_snapshot(
+            json_file, {e.id: e.to_json() for e in table.effects(0, json_count)})
+        print(f"cpu cores: {os.cpu_count()}")
+        for path, size in ((lib_file, count), (json_file, json_count)):
+            baseline = None
+            for n in workers:
+                report = validate_library(path, workers=n)
+                if baseline is None:
+                    baseline = report
+                    # 主进程规划分块、合并结果的部分不随进程数缩短
+                    serial = max(0.0, report['seconds'] - report['cpu_s']) / report['seconds']
+                assert report['issues'] == baseline['issues']
+                projected = 1 / (serial + (1 - serial) / n)
+                print(f"{os.path.basename(path):17} {size:>9} effects, {n} workers: "
+                      f"{report['seconds']:6.2f} s ({size / report['seconds'] / 1000:6.0f}k/s), "
+                      f"chunk cpu {report['cpu_s']:6.2f} s, {report['chunks']:3} chunks, "
+                      f"serial {serial * 100:4.1f}% -> {projected:4.2f}x on {n} cores")
+            print(f"  {baseline['errors']} with errors, {baseline['warnings']} with warnings: "
+                  f"{baseline['issues']}")
+
+
+def bench_session(modes=4, effects_per_mode=2, boot_time=1.6, duration=0.05, seed=1):
+    """菜单各模式的首个效果耗时: 每次重新打开串口(DTR 复位) vs 共用的 SerialSession"""
+    from effect_generator import generate_effects
+    from serial_sim import SimulatedArduino
+    from serial_session import SerialSession
+    from show_pipeline import play_blocking
+
+    effects = list(generate_effects(modes * effects_per_mode, seed=seed).effects())
+    batches = [effects[i:i + effects_per_mode] for i in range(0, len(effects), effects_per_mode)]
+
+    def play(ser, batch, protocol):
+        play_blocking(ser, batch, protocol, on_message=None)
+
+    def row(name, waits, sim):
+        print(f"{name:30}: first effect " + ' '.join(f"{w * 1000:7.1f}" for w in waits) +
+              f" ms, resets {sim.resets}, played {len(sim.played)}")
+
+    # 改动前: 每个模式新建 ArduinoController，打开串口复位固件，再握手
+    sim = SimulatedArduino(timeout=0.5, effect_duration=duration, boot_time=boot_time)
+    waits = []
+    for i, batch in enumerate(batches):
+        started = time.perf_counter()
+        if i:
+            sim.close()
+            sim.open()  # DTR 拉高
+        protocol, _ = wire_protocol.negotiate(sim)
+        waits.append(time.perf_counter() - started)
+        play(sim, batch, protocol)
+    row("reopen + negotiate per mode", waits, sim)
+    sim.close()
+
+    # v2/test.py: 打开后固定等待 2 秒
+    sim = SimulatedArduino(timeout=0.5, effect_duration=duration, boot_time=boot_time)
+    started = time.perf_counter()
+    time.sleep(2)
+    sim.reset_input_buffer()
+    waits = [time.perf_counter() - started]
+    play(sim, batches[0], wire_protocol.PROTOCOL_TEXT)
+    row("fixed 2 s sleep", waits, sim)
+    sim.close()
+
+    # 共用会话: 第一次等启动横幅，之后直接写
+    sim = SimulatedArduino(timeout=0.5, effect_duration=duration, boot_time=boot_time)
+    session = SerialSession(sim, timeout=0.5)
+    waits = []
+    for batch in batches:
+        session.begin()
+        play(session, batch, session.connect().protocol)
+        waits.append(session.last_first_effect[0])
+    row("shared session", waits, sim)
+
+    # 会话中途断开(不复位): 写失败的命令排队，重连后补发
+    real_write = sim.write
+    failures = []
+
+    def drop_once(data):
+        if not failures:
+            failures.append(time.perf_counter())
+            sim.close()
+            raise OSError("device disconnected")
+        return real_write(data)
+
+    sim.write = drop_once
+    session.begin()
+    played = len(sim.played)
+    play(session, batches[0], session.protocol)
+    print(f"{'shared session, port dropped':30}: first effect "
+          f"{session.last_first_effect[0] * 1000:7.1f} ms after reconnect, "
+          f"replayed {len(sim.played) - played}/{len(batches[0])}, {session.report()}")
+    session.close()
+
+
+BENCHMARKS = {
+    'save': bench_save,
+    'backup': bench_backup,
+    'wire': bench_wire,
+    'model': bench_model,
+    'columns': bench_columns,
+    'startup': bench_startup,
+    'sim': bench_sim,
+    'dispatch': bench_dispatch,
+    'pipeline': bench_pipeline,
+    'render': bench_render,
+    'render_cache': bench_render_cache,
+    'pool': bench_pool,
+    'batch': bench_batch,
+    'backpressure': bench_backpressure,
+    'metrics': bench_metrics,
+    'generate': bench_generate,
+    'play': bench_play,
+    'timeline': bench_timeline,
+    'telemetry': bench_telemetry,
+    'dedupe': bench_dedupe,
+    'validate': bench_validate,
+    'session': bench_session,
+}
+
+
+if __name__ == "__main__":
+    # 基准中故意制造的无效请求等不输出警告
+    logging.basicConfig(level=logging.ERROR)
+    names = sys.argv[1:] or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"Unknown benchmark: {', '.join(unknown)}\n"
+                 f"Available: {', '.join(BENCHMARKS)}")
+    for name in names:
+        print(f"=== {name} ===")
+        BENCHMARKS[name]()
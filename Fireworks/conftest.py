@@ -0,0 +1,2 @@
+# control_test.py 是连接真实 Arduino 的交互脚本，不是 pytest 测试
+collect_ignore = ['control_test.py']
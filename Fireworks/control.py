@@ -1,16 +1,34 @@
 import serial
-import json
 import time
 import os
+import asyncio
+import argparse
+import cProfile
+import logging
+import pstats
+import threading
 from datetime import datetime
-from shutil import copyfile
-from enum import IntEnum
+from collections import Counter, deque
+from serial_io import AsyncSerialTransport, LatencyStats
+from effect_library import MappedEffectStore
+from wire_protocol import (PROTOCOL_TEXT, BATCH_MIN_VERSION, MAX_BATCH_ITEMS, MAX_BATCH_GAP_MS,
+                           HELLO_INTERVAL, NEGOTIATE_TIMEOUT, hello_command)
+from show_pipeline import ShowPipeline
+from show_timeline import CATCH_UP, ShowRunner, compile_show
+from effect_columns import EffectColumns
+from effect_index import EffectIndex
+from telemetry import TelemetryStore
+from effect_similarity import (DUPLICATES_ALLOW, DUPLICATES_FLAG, DUPLICATES_MERGE,
+                               SimilarityIndex, find_duplicates)
+from effect_validation import validate_library
+from metrics import REGISTRY, write_metrics, serve_metrics
+from effect_model import FireworkEffect, EffectBatch
 
 # 添加存储相关常量
 DATA_DIR = "C:/Users/East/Desktop/fireworks-1/Fireworks"
 EFFECTS_FILE = os.path.join(DATA_DIR, "effects_data.json")
 BACKUP_DIR = os.path.join(DATA_DIR, "backups")
-MAX_BACKUPS = 5
+BACKUP_RETENTION = 7 * 24 * 3600  # 备份保留时长(秒)
 
 # 简化状态定义
 STATES = {
@@ -19,212 +37,541 @@ STATES = {
     'PREVIEW': 'PREVIEW MODE',
     'SAVE': 'SAVE MODE'
 }
+# 横幅整行 -> 状态
+BANNER_STATES = {banner: state for state, banner in STATES.items()}
+# 定期写出指标文件的间隔(秒)
+METRICS_INTERVAL = 10.0
+# 导出指标时每多少条消息抽样计时一条 (不导出时不计时)
+MESSAGE_SAMPLE_EVERY = 16
+# 烟花长河中每个烟花播完后额外停顿的秒数；0 为收到回执后立即播放下一个
+SEQUENCE_INTERVAL = 0.0
 
-# 添加与Arduino对应的枚举类
-class LaunchMode(IntEnum):
-    NORMAL_ASCEND = 0
-    STEP_ASCEND = 1
-    PENDULUM_ASCEND = 2
+log = logging.getLogger(__name__)
 
-class ExplodeMode(IntEnum):
-    NORMAL = 0
-    BLINK = 1
-    RANDOM = 2
-
-class GradientMode(IntEnum):
-    GRADIENT = 0
-    FADE = 1
-    SWITCH = 2
-
-class LaserColor(IntEnum):
-    LASER_NONE = 0
-    LASER_GREEN = 1
-    LASER_RED = 2
+MESSAGE_SECONDS = REGISTRY.histogram('fireworks_message_seconds',
+                                     '解析并处理一条固件消息的耗时(抽样)', labels=('command',))
+MESSAGE_LATENCY = REGISTRY.histogram('fireworks_message_latency_seconds',
+                                     '消息到达 -> 开始处理 的延迟(抽样)')
+# 以下按控制器分标签 (见 FireworkController.metrics_name)，控制器关闭时注销
+QUEUE_DEPTH = REGISTRY.gauge('fireworks_queue_depth', '等待中的命令数',
+                             labels=('controller', 'queue'))
+DUTY_CYCLE = REGISTRY.gauge('fireworks_strip_duty_cycle', '灯带播放时间占比',
+                            labels=('controller',))
+DURATION_SCALE = REGISTRY.gauge('fireworks_duration_scale', '实测时长 / 预测时长',
+                                labels=('controller',))
+SHOW_COMMANDS = REGISTRY.counter('fireworks_show_commands_total',
+                                 '播放流水线的命令计数', labels=('controller', 'result'))
 
 class FireworkController:
-    def __init__(self, port='COM9', baudrate=115200):
-        self.arduino = serial.Serial(port, baudrate)
+    def __init__(self, port='COM9', baudrate=115200, data_dir=DATA_DIR, render_cache_dir=None,
+                 duplicates=DUPLICATES_FLAG, sequence_interval=SEQUENCE_INTERVAL):
+        # 也接受 pyserial 的 URL (如 loop://) 或已打开的串口对象(如 SimulatedArduino)，便于无硬件测试
+        if hasattr(port, 'write'):
+            self.arduino = port
+        else:
+            self.arduino = serial.serial_for_url(port, baudrate)
+        self.data_dir = data_dir
         self.effects_data = {}
-        self.test_data = []
+        self.test_data = None  # 测试数据的环形缓冲区，见 setup_storage
         self.current_state = 'IDLE'
-        self.firework_queue = []  # 存储要播放的烟花序号
+        self.firework_queue = deque()  # 存储要播放的烟花序号
+        self.playlist = deque()  # 播放列表中还没送入流水线的效果或批量，见 feed_playlist
         self.is_sequence_playing = False  # 添加标志来追踪烟花长河状态
+        # 按完成回执发送下一个效果；sequence_interval 为回执之后可选的额外停顿
+        self.sequence_interval = sequence_interval
+        self.pipeline = ShowPipeline(self.send_effect, gap=sequence_interval)
+        self.transport = None  # run() 期间的异步串口收发
+        self.show_runner = None  # 正在按时间线播放的秀
+        self.show_stop = None
+        self.latency = LatencyStats()  # 消息到达 -> 处理 的延迟
+        self.protocol = PROTOCOL_TEXT  # 握手成功后切换为二进制帧
+        self.hello_deadline = None  # 握手未完成时的放弃时刻
+        self.next_hello_time = None
+        # 消息首字节 -> 处理函数，见 register_handler
+        self.handlers = {
+            'S': self.handle_save,
+            'R': self.handle_play_request,
+            'T': self.handle_test_data,
+            'H': self.handle_hello,
+            'D': self.handle_done,
+            'B': self.handle_batch_progress,
+            'O': self.handle_overrun,
+        }
+        self.message_counts = Counter()  # 各类消息的计数
+        # 每多少条消息计时一条，0 为不计时；run() 导出指标时打开 (见 enable_message_timing)
+        self.message_sample = 0
+        self.render_cache_dir = render_cache_dir  # 为 None 时渲染缓存只在内存中
+        self._render_cache = None
+        # 面板保存近似重复效果时的处理方式 (见 effect_similarity)
+        self.duplicates = duplicates
+        self.near_duplicates = {}  # 本次运行中保存的近似重复效果ID -> 已有的效果ID
+        self._similarity = None
+        self._similarity_build = None  # (线程, 结果列表)，见 start_similarity_build
+        self.register_metrics()
         self.setup_storage()
         self.load_from_file()
     
+    def register_metrics(self):
+        """队列深度等状态量注册为导出时求值的函数，读循环中没有额外开销
+
+        以串口名为 controller 标签(同名时加序号)，同一进程中的多个控制器互不覆盖。
+        """
+        name = str(getattr(self.arduino, 'port', None) or 'controller')
+        label, n = name, 1
+        while (label, 'pipeline') in QUEUE_DEPTH.functions:
+            n += 1
+            label = f"{name}-{n}"
+        self.metrics_name = label
+        pipeline = self.pipeline
+        self._metric_functions = [
+            (QUEUE_DEPTH, (label, 'pipeline'), lambda: len(pipeline.pending)),
+            (QUEUE_DEPTH, (label, 'sequence'), lambda: len(self.firework_queue)),
+            (QUEUE_DEPTH, (label, 'playlist'), lambda: len(self.playlist)),
+            (QUEUE_DEPTH, (label, 'serial_write'),
+             lambda: self.transport.write_queue.qsize() if self.transport else 0),
+            (DUTY_CYCLE, (label,), pipeline.duty_cycle),
+            (DURATION_SCALE, (label,), lambda: pipeline.scale),
+        ] + [(SHOW_COMMANDS, (label, result), lambda result=result: getattr(pipeline, result))
+             for result in ('sent', 'completed', 'timeouts', 'coalesced', 'dropped')]
+        for metric, labels, function in self._metric_functions:
+            metric.set_function(function, *labels)
+
+    def unregister_metrics(self):
+        """注销本控制器的指标函数，注册表不再引用它"""
+        for metric, labels, _ in self._metric_functions:
+            metric.remove_function(*labels)
+        self._metric_functions = []
+
+    def close(self):
+        """关闭存储与测试数据，注销指标"""
+        self.unregister_metrics()
+        self.store.close()
+        self.test_data.close()
+
     def setup_storage(self):
         """初始化存储目录结构"""
         # 创建数据目录
-        os.makedirs(DATA_DIR, exist_ok=True)
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-
-    def create_backup(self):
-        """创建数据文件的备份"""
-        if os.path.exists(EFFECTS_FILE):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = os.path.join(BACKUP_DIR, f"effects_data_{timestamp}.json")
-            copyfile(EFFECTS_FILE, backup_file)
-            
-            # 保持最大备份数量
-            backups = sorted(os.listdir(BACKUP_DIR))
-            while len(backups) > MAX_BACKUPS:
-                os.remove(os.path.join(BACKUP_DIR, backups[0]))
-                backups.pop(0)
+        backup_dir = os.path.join(self.data_dir, "backups")
+        os.makedirs(self.data_dir, exist_ok=True)
+        os.makedirs(backup_dir, exist_ok=True)
+        # 效果库文件按需映射解码，启动时不再整体读入
+        self.store = MappedEffectStore(self.data_dir, backup_dir, retention=BACKUP_RETENTION)
+        # 测试数据只保留最近的定长样本，后台写入轮换的分段文件
+        self.test_data = TelemetryStore(os.path.join(self.data_dir, "telemetry"))
+
+    def save_effect(self, effect_id, effect_data):
+        """追加保存单个效果；日志累计够多时压缩成新快照"""
+        try:
+            if self.store.append(effect_id, effect_data):
+                self.save_to_file()
+        except Exception as e:
+            log.error("Error saving effect %s: %s", effect_id, e)
 
     def save_to_file(self):
-        """保存效果数据到文件"""
+        """把全部效果压缩成新快照(旧快照轮转为备份)"""
         try:
-            # 创建备份
-            self.create_backup()
-            
-            # 保存当前数据
-            with open(EFFECTS_FILE, 'w') as f:
-                json.dump({
-                    'last_updated': datetime.now().isoformat(),
-                    'effects_count': len(self.effects_data),
-                    'effects': self.effects_data
-                }, f, indent=2)
-            print(f"Effects saved successfully. Total effects: {len(self.effects_data)}")
+            self.store.compact(self.effects_data, self.index.next_id)
+            log.info("Effects saved successfully. Total effects: %d", len(self.effects_data))
         except Exception as e:
-            print(f"Error saving effects: {e}")
+            log.error("Error saving effects: %s", e)
 
     def load_from_file(self):
-        """加载效果数据"""
+        """加载效果数据(快照 + 日志重放)
+
+        无法解码的单条记录由存储隔离并跳过；快照本身读不出来时直接抛出，
+        不能用空的效果库继续运行，否则下次压缩会覆盖原有快照、效果ID也从 1 重新分配。
+        """
         try:
-            if os.path.exists(EFFECTS_FILE):
-                with open(EFFECTS_FILE, 'r') as f:
-                    data = json.load(f)
-                    self.effects_data = data.get('effects', {})
-                print(f"Loaded {len(self.effects_data)} effects from storage")
-            else:
-                self.effects_data = {}
-                print("No existing effects data found")
+            self.effects_data = self.store.load()
         except Exception as e:
-            print(f"Error loading effects: {e}")
-            self.effects_data = {}
+            log.error("Error loading effects from %s: %s", self.data_dir, e)
+            raise
+        self._columns = None
+        self._similarity = None
+        self._similarity_build = None
+        self.index = EffectIndex.from_effects(self.effects_data, self.store.next_id)
+        if self.duplicates != DUPLICATES_ALLOW and self.effects_data:
+            self.start_similarity_build()
+        if self.store.quarantined:
+            log.warning("%d invalid effects moved to %s", self.store.quarantined,
+                        self.store.quarantine_file)
+        if self.effects_data:
+            log.info("Loaded %d effects from storage", len(self.effects_data))
+        else:
+            log.info("No existing effects data found")
+
+    def library_columns(self):
+        """效果库的列式副本: 映射库文件直接取列，否则逐个效果转换"""
+        if hasattr(self.effects_data, 'to_columns'):
+            return self.effects_data.to_columns()
+        return EffectColumns.from_effects(self.effects_data)
+
+    @property
+    def columns(self):
+        """列式副本，第一次统计时才建立"""
+        if self._columns is None:
+            self._columns = self.library_columns()
+        return self._columns
+
+    def start_similarity_build(self):
+        """后台线程由单独的列式副本建立近似重复索引，不占用读循环；第一次保存时等它完成"""
+        columns = self.library_columns()
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(SimilarityIndex.from_columns(columns)),
+            name='similarity-index', daemon=True)
+        thread.start()
+        self._similarity_build = (thread, result)
+
+    @property
+    def similarity(self):
+        """近似重复效果的索引: 优先用启动时后台建立的，没有时由列式副本建立"""
+        if self._similarity is None:
+            if self._similarity_build is not None:
+                thread, result = self._similarity_build
+                self._similarity_build = None
+                thread.join()
+                if result:
+                    self._similarity = result[0]
+            if self._similarity is None:
+                self._similarity = SimilarityIndex.from_columns(self.columns)
+        return self._similarity
+
+    def dedupe_library(self, apply=False):
+        """对整个效果库向量化去重，返回 {重复效果ID: 保留的效果ID}；apply 时删除重复并保存"""
+        duplicates = find_duplicates(self.columns)
+        if apply and duplicates:
+            for effect_id in duplicates:
+                self.delete_effect(effect_id, save=False)
+            self.save_to_file()
+            log.info("Removed %d near-duplicate effects", len(duplicates))
+        return duplicates
+
+    def delete_effect(self, effect_id, save=True):
+        """删除一个效果并同步各个索引；save 时压缩保存(日志中没有删除记录)"""
+        effect_id = int(effect_id)
+        effect = self.effects_data.get(effect_id)
+        if effect is None:
+            return False
+        self.index.remove(effect_id, effect)
+        if self._similarity is not None or self._similarity_build is not None:
+            self.similarity.remove(effect_id)
+        del self.effects_data[effect_id]
+        self._columns = None
+        self.near_duplicates.pop(effect_id, None)
+        if save:
+            self.save_to_file()
+        return True
+
+    def check_library(self, workers=None, durations=False):
+        """按固件限制多进程检查已保存的效果库(快照 + 日志)，返回 effect_validation 的报告"""
+        report = validate_library(self.store.snapshot_file, self.store.journal_file,
+                                  workers=workers, durations=durations)
+        if report['errors']:
+            log.warning("Library check: %d of %d effects exceed firmware limits: %s",
+                        report['errors'], report['effects'], report['issues'])
+        return report
+
+    @property
+    def render_cache(self):
+        """离线渲染的缓存，第一次预览时才创建(需要 NumPy)"""
+        if self._render_cache is None:
+            from render_cache import RenderCache
+            self._render_cache = RenderCache(cache_dir=self.render_cache_dir)
+        return self._render_cache
+
+    def preview_effect(self, effect_id):
+        """不经硬件渲染一个已保存的效果，返回 effect_render.Rendering"""
+        return self.render_cache.get(self.effects_data[effect_id])
+
+    def effect_metrics(self, effect_id):
+        """已保存效果的时长、峰值亮灯数与峰值电流"""
+        return self.render_cache.metrics(self.effects_data[effect_id])
 
     def process_message(self, msg):
-        # 1. 状态跟踪
-        if 'MODE' in msg:
-            for state, state_msg in STATES.items():
-                if state_msg in msg:
-                    prev_state = self.current_state
-                    self.current_state = state
-                    print(f"State changed from {prev_state} to {self.current_state}")
-                    
-                    if state == 'IDLE' and len(self.effects_data) > 0:
-                        self.start_firework_sequence()
-                    elif state == 'CUSTOMIZE':
-                        self.stop_firework_sequence()
-                    return
-
-        # 处理播放请求
-        if msg.startswith('R,'):  # R = Request to play
-            try:
-                effect_number = int(msg.split(',')[1])
-                print(f"Received request to play effect {effect_number}")
-                
-                # 检查是否存在此效果
-                if effect_number in self.effects_data:
-                    print(f"Playing requested effect {effect_number}")
-                    self.play_effect(effect_number)
-                else:
-                    print(f"Effect {effect_number} not found")
-                
-            except (IndexError, ValueError) as e:
-                print(f"Invalid play request: {e}")
-
-        # 2. 保存效果
-        if msg.startswith('S,'):
-            parts = msg.split(',')
-            if len(parts) >= 15:
-                # 生成唯一效果ID
-                effect_id = len(self.effects_data) + 1
-                
-                # 修改为与Arduino端对应的数据结构
-                effect_data = {
-                    'id': effect_id,
-                    'color1': {
-                        'r': int(parts[1]),
-                        'g': int(parts[2]),
-                        'b': int(parts[3])
-                    },
-                    'color2': {
-                        'r': int(parts[4]),
-                        'g': int(parts[5]),
-                        'b': int(parts[6])
-                    },
-                    'maxBrightness': int(parts[7]),
-                    'launchMode': LaunchMode(int(parts[8])),
-                    'gradientMode': GradientMode(int(parts[9])),
-                    'explodeMode': ExplodeMode(int(parts[10])),
-                    'laserColor': LaserColor(int(parts[11])),
-                    'mirrorAngle': int(parts[12]),
-                    'explosionLEDCount': int(parts[13]),
-                    'speedDelay': int(parts[14]),
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                self.effects_data[effect_id] = effect_data
-                self.save_to_file()
-                print(f"Effect {effect_id} saved with configuration:")
-                print(f"  Launch: {effect_data['launchMode'].name}")
-                print(f"  Explode: {effect_data['explodeMode'].name}")
-                print(f"  Gradient: {effect_data['gradientMode'].name}")
-                print(f"  Laser: {effect_data['laserColor'].name}")
-
-        elif msg.startswith('S,'):  # 测试数据
-            self.test_data.append({
-                'type': parts[1],
-                'name': parts[2],
-                'value': parts[3:],
-                'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            print(f"Test data received: {parts[1]} - {parts[2]}")
-    
+        """按消息首字节查表分发；字段只切分一次"""
+        command = msg[:1]
+        handler = self.handlers.get(command) if msg[1:2] == ',' else None
+        if handler is not None:
+            count = self.message_counts[command] + 1
+            self.message_counts[command] = count
+            if self.message_sample and not count % self.message_sample:
+                with MESSAGE_SECONDS.time(command):
+                    handler(msg.split(',')[1:])
+                return
+            handler(msg.split(',')[1:])
+            return
+
+        # 状态横幅整行查表
+        state = BANNER_STATES.get(msg)
+        if state is not None:
+            self.message_counts['MODE'] += 1
+            self.handle_state_change(state)
+            return
+
+        # 固件的调试输出等
+        self.message_counts['other'] += 1
+
+    def enable_message_timing(self, every=MESSAGE_SAMPLE_EVERY):
+        """每 every 条消息记录一次处理耗时与排队延迟；0 为关闭。计时只在导出指标时有用"""
+        self.message_sample = every
+
+    def register_handler(self, command, handler):
+        """注册/替换 "<command>,..." 消息的处理函数，handler 接收逗号后的字段列表"""
+        self.handlers[command] = handler
+
+    def handle_state_change(self, state):
+        prev_state = self.current_state
+        self.current_state = state
+        log.info("State changed from %s to %s", prev_state, self.current_state)
+
+        if state == 'IDLE' and len(self.effects_data) > 0:
+            self.start_firework_sequence()
+        elif state == 'CUSTOMIZE':
+            self.stop_firework_sequence()
+
+    def handle_hello(self, parts):
+        """协议握手回复 H,<版本>"""
+        try:
+            version = int(parts[0])
+        except (IndexError, ValueError):
+            log.warning("Invalid hello reply: %s", parts)
+            return
+        self.protocol = version
+        self.pipeline.protocol = version
+        self.next_hello_time = None
+        if self.show_runner is None:
+            # 秀播放期间流水线保持暂停，秀结束时(_show_ended)再恢复
+            self.pipeline.resume()
+        if version:
+            log.info("Using binary protocol v%d", version)
+        else:
+            log.info("Using text protocol")
+
+    def handle_play_request(self, parts):
+        """R,<效果序号>: 数字键盘点播"""
+        try:
+            effect_number = int(parts[0])
+        except (IndexError, ValueError) as e:
+            log.warning("Invalid play request: %s", e)
+            return
+        log.debug("Received request to play effect %d", effect_number)
+
+        # 检查是否存在此效果
+        if effect_number in self.effects_data:
+            log.info("Playing requested effect %d", effect_number)
+            # 点播插到烟花长河前面，当前效果播完后立即播放
+            self.play_effect(effect_number, urgent=True)
+        else:
+            log.warning("Effect %d not found", effect_number)
+
+    def handle_save(self, parts):
+        """S,<14 个字段>: 面板保存的效果，字段顺序与 P 命令一致"""
+        if len(parts) < 14:
+            log.warning("Invalid effect data: expected 14 fields, got %d", len(parts))
+            return
+        try:
+            fields = [int(p) for p in parts[:14]]
+            # 生成唯一效果ID (单调递增，重启后接着分配)
+            effect = FireworkEffect.from_fields(
+                fields,
+                id=self.index.next_id,
+                timestamp=datetime.now().isoformat())
+        except ValueError as e:
+            log.warning("Invalid effect data: %s", e)
+            return
+        duplicate = None
+        if self.duplicates != DUPLICATES_ALLOW:
+            duplicate = self.similarity.find(effect)
+            if duplicate is not None and self.duplicates == DUPLICATES_MERGE:
+                log.info("Effect not saved: near-duplicate of effect %d", duplicate)
+                return
+        effect_id = self.index.allocate_id()
+
+        self.effects_data[effect_id] = effect
+        if self._columns is not None:
+            self._columns.append(effect_id, effect)
+        self.index.add(effect_id, effect)
+        if self._similarity is not None and duplicate is None:
+            # 近似重复的不加入索引，否则同一桶随重复保存不断变大，查找越来越慢
+            self._similarity.add(effect_id, effect)
+        self.save_effect(effect_id, effect)
+        if duplicate is not None:
+            self.near_duplicates[effect_id] = duplicate
+            log.info("Effect %d saved, near-duplicate of effect %d", effect_id, duplicate)
+        else:
+            log.info("Effect %d saved", effect_id)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("  Launch: %s, Explode: %s, Gradient: %s, Laser: %s",
+                      effect.launch_mode.name, effect.explode_mode.name,
+                      effect.gradient_mode.name, effect.laser_color.name)
+
+    def handle_done(self, parts):
+        """D,<毫秒>: 固件播放完一个效果"""
+        try:
+            elapsed = int(parts[0]) / 1000
+        except (IndexError, ValueError):
+            elapsed = None
+        if self.pipeline.complete(elapsed):
+            self.update_sequence()
+
+    def handle_batch_progress(self, parts):
+        """B,<序号>,<毫秒>: 批量播放中的一个效果播完"""
+        try:
+            index = int(parts[0])
+        except (IndexError, ValueError):
+            log.warning("Invalid batch progress: %s", parts)
+            return
+        self.pipeline.progress(index)
+
+    def handle_overrun(self, parts):
+        """O,<字节数>: 固件丢弃了忙时到达的命令字节"""
+        try:
+            self.pipeline.overrun(int(parts[0]))
+        except (IndexError, ValueError):
+            log.warning("Invalid overrun report: %s", parts)
+
+    def handle_test_data(self, parts):
+        """T,<类型>,<名称>,<数值>...: 固件上报的测试数据"""
+        if len(parts) < 2:
+            log.warning("Invalid test data: %s", parts)
+            return
+        self.test_data.add(parts[0], parts[1], parts[2:])
+        log.debug("Test data received: %s - %s", parts[0], parts[1])
+
     def stop_firework_sequence(self):
         """停止烟花长河播放"""
         if self.is_sequence_playing:
-            print("Stopping firework sequence due to mode change")
+            log.info("Stopping firework sequence due to mode change")
             self.firework_queue.clear()
             self.is_sequence_playing = False
+        self.playlist.clear()
+        self.pipeline.clear()
+        self.stop_show()
+
+    def play_show(self, show, policy=CATCH_UP):
+        """按时间线播放一场秀 (秀文件路径、字典或 cue 列表，见 show_timeline)，返回 ShowRunner
 
-    def play_effect(self, index):
+        cue 在独立线程中按绝对时刻直接写串口，不经写队列；播放期间流水线暂停，播完后恢复。
+        """
+        show = compile_show(show, self.effects_data, self.protocol)
+        self.stop_show()
+        runner = self.show_runner = ShowRunner(show, self.arduino.write, policy)
+        stop = self.show_stop = threading.Event()
+        loop = self.transport.loop if self.transport is not None else None
+        self.pipeline.pause()
+        log.info("Starting show %r: %d cues, %.1f s", show.name, len(show), show.duration)
+
+        def run():
+            try:
+                runner.run(stop)
+            except Exception:
+                log.exception("Show %r failed", show.name)
+            log.info("Show %r ended: %s", show.name, runner.stats())
+            if loop is not None:
+                loop.call_soon_threadsafe(self._show_ended, runner)
+            else:
+                self._show_ended(runner)
+
+        threading.Thread(target=run, name='show', daemon=True).start()
+        return runner
+
+    def _show_ended(self, runner):
+        if self.show_runner is runner:
+            self.show_runner = self.show_stop = None
+            self.pipeline.resume()
+
+    def stop_show(self):
+        """停止正在播放的秀，剩下的 cue 不再发出"""
+        if self.show_stop is not None:
+            self.show_stop.set()
+
+    def play_effect(self, index, urgent=False):
+        """加入播放流水线，灯带空闲时立即发送"""
         if index in self.effects_data:
-            effect = self.effects_data[index]
-            # 构建与Arduino端对应的播放命令
-            msg = f"P,{effect['color1']['r']},{effect['color1']['g']},{effect['color1']['b']}," + \
-                  f"{effect['color2']['r']},{effect['color2']['g']},{effect['color2']['b']}," + \
-                  f"{effect['maxBrightness']},{int(effect['launchMode'])}," + \
-                  f"{int(effect['gradientMode'])},{int(effect['explodeMode'])}," + \
-                  f"{int(effect['laserColor'])},{effect['mirrorAngle']}," + \
-                  f"{effect['explosionLEDCount']},{effect['speedDelay']}\n"
-            
-            self.arduino.write(msg.encode())
-            print(f"Playing effect {index} with mode {effect['launchMode'].name}")
-    
+            self.pipeline.enqueue(self.effects_data[index], urgent)
+
+    def preview(self, effect):
+        """尽快播放一个未保存的效果；还没发出的旧预览被替换，只播最新的"""
+        self.pipeline.enqueue(effect, urgent=True, key='preview')
+
+    def play_playlist(self, effects, gaps=None):
+        """播放一组效果(库中的 ID 或 FireworkEffect)，gaps 为每个效果播完后的等待毫秒数
+
+        固件支持批量帧时整组上传、由固件本地连续播放；否则逐个经流水线发送(忽略 gaps，
+        每个效果之后按 sequence_interval 停顿)。gaps 默认都取 sequence_interval。
+
+        各项先进入 self.playlist，流水线空出来时才逐个送入(见 feed_playlist)，
+        再长的列表也不会超过流水线的队列上限而被丢弃。返回排队的项数。
+        """
+        effects = [e if isinstance(e, FireworkEffect) else self.effects_data[e] for e in effects]
+        if gaps is None and self.sequence_interval:
+            gaps = [min(round(self.sequence_interval * 1000), MAX_BATCH_GAP_MS)] * len(effects)
+        if self.protocol >= BATCH_MIN_VERSION:
+            items = EffectBatch.split(effects, gaps)
+        else:
+            items = effects
+        self.playlist.extend(items)
+        self.feed_playlist()
+        return len(items)
+
+    def feed_playlist(self):
+        """流水线中没有等待的命令时送入播放列表的下一项；被拒绝的留在列表中稍后再送"""
+        while self.playlist and not self.pipeline.pending:
+            if not self.pipeline.enqueue(self.playlist[0]):
+                log.warning("Pipeline full, %d playlist items waiting", len(self.playlist))
+                return
+            self.playlist.popleft()
+
+    def send_effect(self, effect):
+        # 已编码的播放命令由效果对象缓存
+        self.send_command(effect.wire(self.protocol))
+        if isinstance(effect, EffectBatch):
+            log.debug("Uploaded a batch of %d effects", len(effect))
+        else:
+            log.debug("Playing effect %s with mode %s", effect.id, effect.launch_mode.name)
+
+    def send_command(self, data):
+        """发送命令: run() 期间走异步写队列，否则直接写串口"""
+        if self.transport is not None:
+            self.transport.write(data)
+        else:
+            self.arduino.write(data)
+
     def start_firework_sequence(self):
         """开始烟花长河播放"""
-        print("Starting firework sequence...")
+        log.info("Starting firework sequence...")
         # 按保存顺序创建播放队列
-        self.firework_queue = list(self.effects_data.keys())
+        self.firework_queue = deque(self.effects_data.keys())
         self.is_sequence_playing = True
         self.play_next_firework()
 
     def play_next_firework(self):
-        """播放队列中的下一个烟花"""
+        """把烟花长河的下一个烟花送入流水线，上一个播完(收到回执)后立即发出
+
+        固件支持批量帧时一次取出最多 MAX_BATCH_ITEMS 个，整批上传后由固件本地连续播放。
+        """
         if not self.firework_queue or not self.is_sequence_playing:
             self.is_sequence_playing = False
-            print("Firework sequence stopped")
+            log.info("Firework sequence stopped")
             return
 
-        index = self.firework_queue.pop(0)
-        self.play_effect(index)
-        
-        # 设置下一个烟花的播放
-        if self.firework_queue and self.is_sequence_playing:
-            # 3秒后播放下一个
-            time.sleep(3)
+        if self.protocol >= BATCH_MIN_VERSION:
+            count = min(MAX_BATCH_ITEMS, len(self.firework_queue))
+            self.play_playlist([self.firework_queue.popleft() for _ in range(count)])
+        else:
+            index = self.firework_queue.popleft()
+            self.play_effect(index)
+
+        if not self.firework_queue:
+            self.is_sequence_playing = False
+            log.info("Firework sequence finished")
+
+    def update_sequence(self):
+        """在读循环中调用: 处理回执超时，并保证流水线里总有下一个烟花在等待"""
+        self.pipeline.poll()
+        self.feed_playlist()
+        if self.is_sequence_playing and not self.pipeline.pending and not self.playlist:
             self.play_next_firework()
 
     def get_effect_stats(self):
@@ -232,37 +579,147 @@ class FireworkController:
         if not self.effects_data:
             return "No effects stored"
             
+        # 统计基于列式副本，一次遍历完成
+        histograms = self.columns.mode_histograms()
         stats = {
             'total_effects': len(self.effects_data),
-            'last_effect_id': max(self.effects_data.keys()),
-            'storage_file': EFFECTS_FILE,
-            'backup_count': len(os.listdir(BACKUP_DIR)),
+            'last_effect_id': self.columns.last_effect_id(),
+            'storage_file': self.store.snapshot_file,
+            'backup_count': len(self.store.backup),
             'modes_used': {
-                'launch': set(e['launchMode'].name for e in self.effects_data.values()),
-                'explode': set(e['explodeMode'].name for e in self.effects_data.values()),
-                'gradient': set(e['gradientMode'].name for e in self.effects_data.values()),
-                'laser': set(e['laserColor'].name for e in self.effects_data.values())
-            }
+                kind: set(name for name, count in counts.items() if count)
+                for kind, counts in histograms.items()
+            },
+            'mode_counts': histograms,
+            'message_counts': dict(self.message_counts),
+            'show': self.pipeline.stats(),
+            'telemetry': self.test_data.stats(),
+            'near_duplicates': len(self.near_duplicates),
+            'render_cache': self._render_cache.stats() if self._render_cache else None
         }
         return stats
 
-    def run(self):
-        print("Firework Controller Started")
+    async def handle_message(self, msg, arrived):
+        """消息处理协程"""
+        waited = time.perf_counter() - arrived
+        self.latency.add(waited)
+        if self.message_sample and not len(self.latency) % self.message_sample:
+            MESSAGE_LATENCY.observe(waited)
+        self.process_message(msg)
+
+    def update_negotiation(self):
+        """握手未得到回复时定期重发(固件复位启动或正忙时会丢弃命令)"""
+        if self.next_hello_time is None or time.monotonic() < self.next_hello_time:
+            return
+        if self.show_runner is not None:
+            # 秀的线程正在直接写串口，握手会插进 cue 之间；秀结束后再继续协商
+            return
+        if not self.pipeline.idle:
+            # 固件播放完会清空接收缓冲区，播放期间发出的握手必然丢失
+            return
+        if time.monotonic() >= self.hello_deadline:
+            self.next_hello_time = None
+            log.warning("No handshake reply, using text protocol")
+            self.pipeline.resume()
+            return
+        self.send_command(hello_command())
+        self.next_hello_time = time.monotonic() + HELLO_INTERVAL
+
+    def time_until_next_event(self):
+        """距离下一个定时事件(回执超时 / 握手重发)的秒数"""
+        waits = [self.pipeline.time_until_deadline()]
+        if self.next_hello_time is not None and self.pipeline.idle and self.show_runner is None:
+            waits.append(max(0.0, self.next_hello_time - time.monotonic()))
+        waits = [w for w in waits if w is not None]
+        return min(waits) if waits else None
+
+    async def write_metrics_periodically(self, path, interval=METRICS_INTERVAL):
+        """每 interval 秒把指标写到 path (.json 为 JSON，否则为 Prometheus 文本)"""
         while True:
+            await asyncio.sleep(interval)
             try:
-                if self.arduino.in_waiting > 0:
-                    msg = self.arduino.readline().decode().strip()
-                    if msg:  # 只处理非空消息
-                        self.process_message(msg)
-                time.sleep(0.1)
-            except KeyboardInterrupt:
-                print("Controller stopped")
-                break
-            except Exception as e:
-                print(f"Error: {e}")
-                continue
+                write_metrics(path)
+            except OSError as e:
+                log.error("Error writing metrics: %s", e)
+
+    async def run_async(self, metrics_file=None, metrics_interval=METRICS_INTERVAL):
+        self.transport = AsyncSerialTransport(self.arduino)
+        await self.transport.start()
+        metrics_task = None
+        if metrics_file is not None:
+            metrics_task = asyncio.create_task(
+                self.write_metrics_periodically(metrics_file, metrics_interval))
+        # 连接时协商二进制协议；固件不回复则保持文本协议。
+        # 握手期间不发效果: 固件处理 H 后会清空接收缓冲区
+        self.pipeline.pause()
+        self.next_hello_time = time.monotonic()
+        self.hello_deadline = self.next_hello_time + NEGOTIATE_TIMEOUT
+        try:
+            while True:
+                # 有数据立即唤醒；回执超时或握手重发到点时也唤醒
+                item = await self.transport.readline(timeout=self.time_until_next_event())
+                if item is not None:
+                    try:
+                        await self.handle_message(*item)
+                    except Exception as e:
+                        log.exception("Error handling message: %s", e)
+                self.update_negotiation()
+                self.update_sequence()
+        finally:
+            if metrics_task is not None:
+                metrics_task.cancel()
+            await self.transport.close()
+            self.transport = None
+
+    def run(self, profile=None, metrics_file=None, metrics_port=None,
+            metrics_interval=METRICS_INTERVAL):
+        """运行读循环直到 Ctrl+C
+
+        profile: 用 cProfile 剖析整个运行过程，结束时把统计写到该文件(可用 pstats/snakeviz 查看)
+        metrics_file: 定期写出指标文件；metrics_port: 在本机该端口提供 /metrics 与 /metrics.json
+        """
+        server = serve_metrics(metrics_port) if metrics_port is not None else None
+        if metrics_file is not None or metrics_port is not None:
+            self.enable_message_timing()
+        profiler = cProfile.Profile() if profile is not None else None
+        log.info("Firework Controller Started")
+        if profiler is not None:
+            profiler.enable()
+        try:
+            asyncio.run(self.run_async(metrics_file, metrics_interval))
+        except KeyboardInterrupt:
+            log.info("Controller stopped")
+        except OSError as e:  # serial.SerialException 也是 OSError
+            log.error("Serial connection lost, controller stopped: %s", e)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile)
+                log.info("Profile written to %s", profile)
+                if log.isEnabledFor(logging.DEBUG):
+                    pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+            if server is not None:
+                server.shutdown()
+        if metrics_file is not None:
+            write_metrics(metrics_file)
+        log.info("Message latency: %s", self.latency.summary())
+        log.info("Strip duty cycle: %.1f%%", self.pipeline.duty_cycle() * 100)
+        self.close()
 
 if __name__ == "__main__":
-    controller = FireworkController()
-    print("Initial stats:", controller.get_effect_stats())
-    controller.run()
+    parser = argparse.ArgumentParser(description="Firework controller")
+    parser.add_argument('--port', default='COM9')
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--metrics-file', help="定期写出指标 (.json 为 JSON，否则为 Prometheus 文本)")
+    parser.add_argument('--metrics-port', type=int, help="在本机该端口提供 /metrics")
+    parser.add_argument('--profile', help="cProfile 统计输出文件")
+    parser.add_argument('--sequence-interval', type=float, default=SEQUENCE_INTERVAL,
+                        help="烟花长河中每个烟花播完后额外停顿的秒数")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(message)s')
+
+    controller = FireworkController(args.port, sequence_interval=args.sequence_interval)
+    log.info("Initial stats: %s", controller.get_effect_stats())
+    controller.run(profile=args.profile, metrics_file=args.metrics_file,
+                   metrics_port=args.metrics_port)
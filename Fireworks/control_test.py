@@ -1,44 +1,23 @@
 import serial
-import json
-import time
 import os
-import random
-from datetime import datetime
-from shutil import copyfile
+from contextlib import contextmanager
 from enum import IntEnum
-from dataclasses import dataclass
-from typing import Tuple
+from show_pipeline import play_blocking
+from show_timeline import CATCH_UP, ShowRunner, compile_show
+from effect_library import MappedEffectStore
+from serial_session import SerialSession
+from effect_model import FireworkEffect, LaunchMode, ExplodeMode, GradientMode, LaserColor
 
 # 全局配置
 DATA_DIR = "C:/Users/East/Desktop/fireworks-1/Fireworks"
 EFFECTS_FILE = os.path.join(DATA_DIR, "effects_data.json")
 BACKUP_DIR = os.path.join(DATA_DIR, "backups")
-MAX_BACKUPS = 5
+BACKUP_RETENTION = 7 * 24 * 3600  # 备份保留时长(秒)
 
 # 串口配置
 ARDUINO_PORT = 'COM8'
 ARDUINO_BAUDRATE = 115200
 
-class LaunchMode(IntEnum):
-    NORMAL_ASCEND = 0
-    STEP_ASCEND = 1
-    PENDULUM_ASCEND = 2
-
-class ExplodeMode(IntEnum):
-    NORMAL = 0
-    BLINK = 1
-    RANDOM = 2
-
-class GradientMode(IntEnum):
-    GRADIENT = 0
-    FADE = 1
-    SWITCH = 2
-
-class LaserColor(IntEnum):
-    LASER_NONE = 0
-    LASER_GREEN = 1
-    LASER_RED = 2
-
 class SystemState(IntEnum):
     STATE_IDLE = 0
     STATE_CUSTOMIZE = 1
@@ -46,42 +25,44 @@ class SystemState(IntEnum):
     STATE_SAVE = 3
     STATE_PLAY_SAVED = 4
 
-@dataclass
-class FireworkEffect:
-    color1: Tuple[int, int, int]
-    color2: Tuple[int, int, int]
-    max_brightness: int
-    launch_mode: LaunchMode
-    gradient_mode: GradientMode
-    explode_mode: ExplodeMode
-    laser_color: LaserColor
-    mirror_angle: int
-    explosion_led_count: int
-    speed_delay: int
-
-def generate_random_effect() -> FireworkEffect:
-    """生成随机烟花效果"""
-    def random_color() -> Tuple[int, int, int]:
-        return (random.randint(0, 255),
-                random.randint(0, 255),
-                random.randint(0, 255))
+_random_effects = {}  # no_repeat -> 批量生成器
 
-    return FireworkEffect(
-        color1=random_color(),
-        color2=random_color(),
-        max_brightness=random.randint(128, 255),
-        launch_mode=random.choice(list(LaunchMode)),
-        gradient_mode=random.choice(list(GradientMode)),
-        explode_mode=random.choice(list(ExplodeMode)),
-        laser_color=random.choice(list(LaserColor)),
-        mirror_angle=random.randint(0, 180),
-        explosion_led_count=random.randint(50, 200),
-        speed_delay=random.randint(10, 50)
-    )
+def generate_random_effect(no_repeat=()) -> FireworkEffect:
+    """生成随机烟花效果 (NumPy 按块批量抽取)
+
+    no_repeat: 与同一约束下的上一个效果不能相同的模式字段，如 ('launch_mode',)；默认不约束
+    """
+    generator = _random_effects.get(no_repeat)
+    if generator is None:
+        from effect_generator import EffectGenerator
+        generator = _random_effects[no_repeat] = iter(EffectGenerator(no_repeat=no_repeat))
+    return next(generator)
+
+def open_store(data_dir=DATA_DIR):
+    """与 control.py 相同的效果存储 (effects_data.lib 快照 + 日志 + 备份索引)
+
+    两个工具共用这些文件，必须用同样的格式读写，否则一方压缩时会清空另一方写入的日志。
+    """
+    return MappedEffectStore(data_dir, os.path.join(data_dir, "backups"),
+                             retention=BACKUP_RETENTION)
+
+@contextmanager
+def load_effects():
+    """with load_effects() as effects: 效果库 (ID -> FireworkEffect)，不打开串口
+
+    库文件按需映射解码，退出 with 时关闭。
+    """
+    store = open_store()
+    try:
+        yield store.load()
+    finally:
+        store.close()
 
 class FireworkController:
-    def __init__(self, port=ARDUINO_PORT, baudrate=ARDUINO_BAUDRATE):
-        self.arduino = serial.Serial(port, baudrate)
+    def __init__(self, port=ARDUINO_PORT, baudrate=ARDUINO_BAUDRATE, data_dir=DATA_DIR):
+        # 也接受已打开的串口对象(如 serial_sim.SimulatedArduino)
+        self.arduino = port if hasattr(port, 'write') else serial.Serial(port, baudrate)
+        self.data_dir = data_dir
         self.effects_data = {}
         self.test_data = []
         self.system_state = SystemState.STATE_IDLE
@@ -91,95 +72,100 @@ class FireworkController:
         self.load_from_file()
     
     def setup_storage(self):
-        """初始化存储目录结构"""
-        # 创建数据目录
-        os.makedirs(DATA_DIR, exist_ok=True)
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-
-    def create_backup(self):
-        """创建数据文件的备份"""
-        if os.path.exists(EFFECTS_FILE):
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_file = os.path.join(BACKUP_DIR, f"effects_data_{timestamp}.json")
-            copyfile(EFFECTS_FILE, backup_file)
-            
-            # 保持最大备份数量
-            backups = sorted(os.listdir(BACKUP_DIR))
-            while len(backups) > MAX_BACKUPS:
-                os.remove(os.path.join(BACKUP_DIR, backups[0]))
-                backups.pop(0)
+        """初始化存储目录结构；备份由后台线程按时间保留增量"""
+        self.store = open_store(self.data_dir)
 
     def save_to_file(self):
-        """保存效果数据到文件"""
+        """保存效果数据到文件(原子替换)，备份在后台完成"""
         try:
-            # 创建备份
-            self.create_backup()
-            
-            # 保存当前数据
-            with open(EFFECTS_FILE, 'w') as f:
-                json.dump({
-                    'last_updated': datetime.now().isoformat(),
-                    'effects_count': len(self.effects_data),
-                    'effects': self.effects_data
-                }, f, indent=2)
+            self.store.compact(self.effects_data, self.store.next_id)
             print(f"Effects saved successfully. Total effects: {len(self.effects_data)}")
         except Exception as e:
             print(f"Error saving effects: {e}")
 
     def load_from_file(self):
-        """加载效果数据"""
+        """加载效果数据；读不出来时抛出，不用空库覆盖 control.py 保存的效果"""
         try:
-            if os.path.exists(EFFECTS_FILE):
-                with open(EFFECTS_FILE, 'r') as f:
-                    data = json.load(f)
-                    self.effects_data = data.get('effects', {})
-                print(f"Loaded {len(self.effects_data)} effects from storage")
-            else:
-                self.effects_data = {}
-                print("No existing effects data found")
+            self.effects_data = self.store.load()
         except Exception as e:
             print(f"Error loading effects: {e}")
-            self.effects_data = {}
+            raise
+        if self.effects_data:
+            print(f"Loaded {len(self.effects_data)} effects from storage")
+        else:
+            print("No existing effects data found")
 
 class ArduinoController:
-    def __init__(self, port=ARDUINO_PORT, baudrate=ARDUINO_BAUDRATE):
-        """初始化串口连接"""
-        try:
-            self.ser = serial.Serial(port, baudrate, timeout=31)
-            if not self.ser.is_open:
-                self.ser.open()  # 打开串口连接
-            print(f"Connected to Arduino on {port}")
-        except serial.SerialException as e:
-            print(f"Failed to connect to Arduino: {e}")
-            raise
+    def __init__(self, port=ARDUINO_PORT, baudrate=ARDUINO_BAUDRATE, binary=True):
+        """port 为端口名、已打开的串口对象(如 serial_sim.SimulatedArduino)或 SerialSession
+
+        串口在第一次播放时才打开，并在 close() 之前一直保持，供多次播放共用。
+        """
+        if isinstance(port, SerialSession):
+            self.session = port
+        else:
+            self.session = SerialSession(port, baudrate, timeout=31, binary=binary)
+        self.ser = self.session
+
+    @property
+    def protocol(self):
+        """已协商的协议；还没有连接时先打开串口并等待固件就绪"""
+        if not self.session.connected:
+            try:
+                self.session.connect()
+            except serial.SerialException as e:
+                print(f"Failed to connect to Arduino: {e}")
+                raise
+            print(f"Connected to Arduino on {self.session.port}, protocol:",
+                  f"binary v{self.session.protocol}" if self.session.protocol else "text")
+        return self.session.protocol
+
+    def report_first_effect(self):
+        """打印本次操作从发起到第一个效果写出的耗时"""
+        if self.session.last_first_effect is not None:
+            elapsed, cold = self.session.last_first_effect
+            self.session.last_first_effect = None
+            print(f"Time to first effect: {elapsed * 1000:.1f} ms "
+                  f"({'cold session' if cold else 'warm session'})")
+
+    def write_effect(self, effect: FireworkEffect):
+        # 已编码的命令由效果对象缓存
+        print(f"Sending command: {effect.fields()}")
+        self.ser.write(effect.wire(self.protocol))
+        self.ser.flush()
+
+    def play_all(self, effects, stop=None):
+        """依次播放 effects，每个效果播完(收到完成回执)后立即发送下一个"""
+        self.session.begin()
+        pipeline = play_blocking(self.ser, effects, self.protocol, send=self.write_effect,
+                                 on_message=lambda line: print(f"Arduino response: {line}"),
+                                 stop=stop)
+        print(f"Played {pipeline.completed + pipeline.timeouts} effects, "
+              f"duty cycle {pipeline.duty_cycle():.1%}")
+        self.report_first_effect()
+        return pipeline
 
     def send_effect(self, effect: FireworkEffect):
-        """发送效果到Arduino"""
+        """发送效果到Arduino，并等待效果完成"""
         try:
-            # 构建命令字符串
-            cmd = f"P,{effect.color1[0]},{effect.color1[1]},{effect.color1[2]}," + \
-                  f"{effect.color2[0]},{effect.color2[1]},{effect.color2[2]}," + \
-                  f"{effect.max_brightness},{effect.launch_mode.value}," + \
-                  f"{effect.gradient_mode.value},{effect.explode_mode.value}," + \
-                  f"{effect.laser_color.value},{effect.mirror_angle}," + \
-                  f"{effect.explosion_led_count},{effect.speed_delay}\n"
-            
-            print(f"Sending command: {cmd.strip()}")
-            self.ser.write(cmd.encode('ascii'))
-            self.ser.flush()
-            time.sleep(0.1)
-            
-            # 等待效果完成
-            response = self.ser.readline().decode().strip()
-            print(f"Arduino response: {response}")
-        except Exception as e:            print(f"Error sending effect: {e}")
-        
-        raise
+            self.play_all([effect])
+        except Exception as e:
+            print(f"Error sending effect: {e}")
+            raise
+
+    def play_show(self, show, effects=None, policy=CATCH_UP, stop=None):
+        """按时间线播放一场秀 (见 show_timeline)，每个 cue 按开场后的绝对时刻写出"""
+        self.session.begin()
+        show = compile_show(show, effects, self.protocol)
+        print(f"Playing show {show.name!r}: {len(show)} cues, {show.duration:.1f} s")
+        runner = ShowRunner(show, self.ser.write, policy).run(stop)
+        print(f"Show finished: {runner.stats()}")
+        self.report_first_effect()
+        return runner
 
     def close(self):
         """关闭串口连接"""
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.close()
+        if self.session.close():
             print("Connection closed")
 
 def test_effects():
@@ -188,9 +174,7 @@ def test_effects():
     try:
         # 测试随机生成的效果
         random_effect = generate_random_effect()
-        print("Testing random effect:", vars(random_effect))
-        controller.send_effect(random_effect)
-        time.sleep(20)
+        print("Testing random effect:", random_effect)
 
         # 测试效果1：普通上升+渐变爆炸
         effect1 = FireworkEffect(
@@ -205,8 +189,6 @@ def test_effects():
             explosion_led_count=100,
             speed_delay=20
         )
-        controller.send_effect(effect1)
-        time.sleep(20)  # 等待效果完成
 
         # 测试效果2：断续上升+闪烁爆炸
         effect2 = FireworkEffect(
@@ -221,7 +203,9 @@ def test_effects():
             explosion_led_count=150,
             speed_delay=30
         )
-        controller.send_effect(effect2)
+
+        # 上一个效果播完即发送下一个
+        controller.play_all([random_effect, effect1, effect2])
         
     except Exception as e:
         print(f"Test failed: {e}")
@@ -283,9 +267,11 @@ def get_user_input_effect() -> FireworkEffect:
         speed_delay=speed_delay
     )
 
-def continuous_random_effects():
-    """持续生成随机效果直到用户停止"""
-    controller = ArduinoController()
+def continuous_random_effects(controller=None):
+    """持续生成随机效果直到用户停止；controller 为 None 时自建连接并在结束时关闭"""
+    own_controller = controller is None
+    if own_controller:
+        controller = ArduinoController()
     import threading
     import msvcrt
     
@@ -304,46 +290,62 @@ def continuous_random_effects():
     input_thread.daemon = True
     input_thread.start()
     
+    def random_effects():
+        while True:
+            # 连续播放时相邻烟花的发射方式不重复
+            effect = generate_random_effect(no_repeat=('launch_mode',))
+            print("\n生成新的随机效果:", effect)
+            yield effect
+
     print("开始生成随机效果 (按 'q' 停止)")
     try:
-        while not stop_flag.is_set():
-            effect = generate_random_effect()
-            print("\n生成新的随机效果:", vars(effect))
-            controller.send_effect(effect)
-            time.sleep(5)  # 等待效果完成
+        # 当前效果播放期间生成好下一个，播完立即发送
+        controller.play_all(random_effects(), stop=stop_flag)
     except Exception as e:
         print(f"Error: {e}")
     finally:
-        controller.close()
+        if own_controller:
+            controller.close()
         print("\n停止生成随机效果")
 
 def main_menu():
-    """主菜单"""
-    while True:
-        print("\n=== 烟花控制系统 ===")
-        print("1. 持续生成随机效果")
-        print("2. 自定义烟花效果")
-        print("3. 退出")
-        
-        choice = input("\n请选择操作: ")
-        
-        if choice == '1':
-            continuous_random_effects()
-        elif choice == '2':
-            controller = ArduinoController()
-            try:
-                effect = get_user_input_effect()
-                print("\n正在播放自定义效果...")
-                controller.send_effect(effect)
-            except Exception as e:
-                print(f"Error: {e}")
-            finally:
-                controller.close()
-        elif choice == '3':
-            print("退出程序")
-            break
-        else:
-            print("无效的选择，请重试")
+    """主菜单；各模式共用一个串口会话，第一次播放时才打开，退出时关闭"""
+    controller = ArduinoController()
+    try:
+        while True:
+            print("\n=== 烟花控制系统 ===")
+            print("1. 持续生成随机效果")
+            print("2. 自定义烟花效果")
+            print("3. 播放秀文件")
+            print("4. 退出")
+
+            choice = input("\n请选择操作: ")
+
+            if choice == '1':
+                continuous_random_effects(controller)
+            elif choice == '2':
+                try:
+                    effect = get_user_input_effect()
+                    print("\n正在播放自定义效果...")
+                    controller.send_effect(effect)
+                except Exception as e:
+                    print(f"Error: {e}")
+            elif choice == '3':
+                try:
+                    path = input("秀文件路径: ")
+                    # 秀中按ID引用的效果来自效果库
+                    with load_effects() as effects:
+                        controller.play_show(path, effects)
+                except Exception as e:
+                    print(f"Error: {e}")
+            elif choice == '4':
+                print(controller.session.report())
+                print("退出程序")
+                break
+            else:
+                print("无效的选择，请重试")
+    finally:
+        controller.close()
 
 if __name__ == "__main__":
     main_menu()
@@ -0,0 +1,273 @@
+"""一个上位机进程同时驱动多台 Arduino (灯带、镜子等)
+
+每个端点 ControllerUnit 有自己的串口会话(serial_session.SerialSession，负责打开串口与
+协议握手)、读线程、异步写队列与播放流水线；
+ControllerPool 在同一个事件循环里运行所有端点，支持:
+- play / broadcast: 指定端点或所有端点各自按完成回执排队播放，互不等待
+- cue: 同步起播。等所有目标端点播完在途效果后，按各自的 命令传输 + 解析
+  时间错开写出，使固件开始播放的时刻尽量对齐
+
+用法: python controller_pool.py COM6 COM8 COM9
+"""
+import asyncio
+import logging
+import sys
+import time
+from collections import Counter, deque
+
+from effect_model import FireworkEffect
+from effect_timing import command_latency
+from serial_io import AsyncSerialTransport, LatencyStats
+from serial_session import SerialSession
+from show_pipeline import ShowPipeline
+from wire_protocol import (PROTOCOL_TEXT, NEGOTIATE_TIMEOUT, parse_batch_progress, parse_done,
+                           parse_overrun)
+
+log = logging.getLogger(__name__)
+
+
+class ControllerUnit:
+    """池中的一个串口端点；on_message(名称, 消息) 接收回执与握手以外的消息"""
+
+    def __init__(self, name, port, baudrate=115200, on_message=None):
+        # 与 FireworkController 一样也接受 pyserial 的 URL 或已打开的串口对象；
+        # 握手与协议协商由会话完成 (SerialSession.wait_ready)
+        self.session = SerialSession(port, baudrate, ready_timeout=NEGOTIATE_TIMEOUT)
+        self.arduino = self.session
+        self.name = name
+        self.baudrate = baudrate
+        self.on_message = on_message
+        self.protocol = PROTOCOL_TEXT
+        self.transport = None
+        self.pipeline = ShowPipeline(self.send_effect)
+        self.ready = False   # 握手完成(或超时退回文本协议)
+        self.held = False    # 等待同步起播时暂停本端点的队列
+        self.latency = LatencyStats()
+        self.message_counts = Counter()
+
+    def send_effect(self, effect):
+        self.transport.write(effect.wire(self.protocol))
+
+    def write_now(self, effect):
+        """绕过写队列立即写出，用于同步起播；返回写出时刻"""
+        self.arduino.write(effect.wire(self.protocol))
+        now = time.monotonic()
+        self.pipeline.track(effect, now)
+        return now
+
+    def command_latency(self, effect):
+        """effect 写出到本端点固件开始播放的预计秒数"""
+        return command_latency(effect.wire(self.protocol), self.baudrate,
+                               text=self.protocol == PROTOCOL_TEXT)
+
+    def update_hold(self):
+        """握手未完成或等待同步起播时暂停队列"""
+        if self.ready and not self.held:
+            self.pipeline.resume()
+        else:
+            self.pipeline.pause()
+
+    def process_message(self, msg):
+        elapsed = parse_done(msg)
+        if elapsed is not None:
+            self.message_counts['D'] += 1
+            self.pipeline.complete(elapsed)
+            return
+        progress = parse_batch_progress(msg)
+        if progress is not None:
+            self.message_counts['B'] += 1
+            self.pipeline.progress(progress[0])
+            return
+        discarded = parse_overrun(msg)
+        if discarded is not None:
+            self.message_counts['O'] += 1
+            self.pipeline.overrun(discarded)
+            return
+        self.message_counts['other'] += 1
+        if self.on_message is not None:
+            self.on_message(self.name, msg)
+
+    async def connect(self):
+        """在线程中打开串口并握手 (不阻塞其他端点)，之后按协商的协议编码"""
+        self.ready = False
+        self.update_hold()
+        await asyncio.get_running_loop().run_in_executor(None, self.session.connect)
+        self.protocol = self.pipeline.protocol = self.session.protocol
+        if not self.session.negotiated:
+            log.warning("[%s] No handshake reply, using text protocol", self.name)
+        self.ready = True
+        self.update_hold()
+
+    async def run_async(self, on_idle=None):
+        """本端点的读循环；on_idle() 在每条消息/定时事件处理后调用"""
+        await self.connect()
+        self.transport = AsyncSerialTransport(self.arduino)
+        await self.transport.start()
+        if on_idle is not None:
+            on_idle()
+        try:
+            while True:
+                item = await self.transport.readline(timeout=self.pipeline.time_until_deadline())
+                if item is not None:
+                    msg, arrived = item
+                    self.latency.add(time.perf_counter() - arrived)
+                    try:
+                        self.process_message(msg)
+                    except Exception as e:
+                        log.exception("[%s] Error handling message: %s", self.name, e)
+                self.pipeline.poll()
+                if on_idle is not None:
+                    on_idle()
+        finally:
+            await self.transport.close()
+            self.transport = None
+
+    def stats(self):
+        return {
+            'protocol': self.protocol,
+            'ready': self.ready,
+            'message_counts': dict(self.message_counts),
+            'latency': self.latency.summary(),
+            'show': self.pipeline.stats(),
+        }
+
+
+class Cue:
+    """一次同步起播: 端点名称 -> 效果"""
+    __slots__ = ('effects', 'created')
+
+    def __init__(self, effects, created):
+        self.effects = effects
+        self.created = created
+
+
+class ControllerPool:
+    """多台控制器的连接池
+
+    ports 为 {名称: 端口} 或端口列表(名称为序号)；effects 为 ID -> FireworkEffect，
+    用于按 ID 播放(如 FireworkController.effects_data)。
+    """
+
+    def __init__(self, ports, baudrate=115200, effects=None, on_message=None):
+        if not isinstance(ports, dict):
+            ports = dict(enumerate(ports))
+        self.units = {name: ControllerUnit(name, port, baudrate, on_message)
+                      for name, port in ports.items()}
+        self.effects = effects if effects is not None else {}
+        self.cues = deque()
+        self.cues_fired = 0
+        self.cue_waits = LatencyStats()  # cue() -> 同步写出
+        self.write_spreads = LatencyStats()  # 同步起播中第一条到最后一条写出的间隔
+
+    def __len__(self):
+        return len(self.units)
+
+    @property
+    def ready(self):
+        return all(unit.ready for unit in self.units.values())
+
+    @property
+    def idle(self):
+        return not self.cues and all(
+            unit.pipeline.idle and not unit.pipeline.pending for unit in self.units.values())
+
+    def _effect(self, effect):
+        """效果对象或库中的 ID -> FireworkEffect"""
+        return effect if isinstance(effect, FireworkEffect) else self.effects[effect]
+
+    def play(self, effect, unit, urgent=False):
+        """在指定端点上排队播放"""
+        self.units[unit].pipeline.enqueue(self._effect(effect), urgent)
+
+    def broadcast(self, effect, urgent=False):
+        """所有端点各自排队播放同一个效果，不对齐起播时刻"""
+        effect = self._effect(effect)
+        for unit in self.units.values():
+            unit.pipeline.enqueue(effect, urgent)
+
+    def cue(self, effects, units=None):
+        """同步起播: effects 为 {名称: 效果}，或一个效果加目标端点(默认全部)
+
+        目标端点的在途效果播完后一起写出；cue 之后排队的效果等它起播后再继续。
+        """
+        if not isinstance(effects, dict):
+            names = self.units if units is None else units
+            effects = {name: effects for name in names}
+        cue = Cue({name: self._effect(effect) for name, effect in effects.items()},
+                  time.monotonic())
+        for name in cue.effects:
+            unit = self.units[name]
+            unit.held = True
+            unit.update_hold()
+        self.cues.append(cue)
+        self.check_cues()
+
+    def check_cues(self):
+        """队首的 cue 的所有目标端点都空闲时写出"""
+        while self.cues:
+            cue = self.cues[0]
+            targets = [self.units[name] for name in cue.effects]
+            if not all(unit.ready and unit.pipeline.idle for unit in targets):
+                return
+            self.cues.popleft()
+            self._fire(cue, targets)
+
+    def _fire(self, cue, targets):
+        # 传输 + 解析最慢的先写，其余按差值延后；差值只有几毫秒(文本与二进制帧之差)，
+        # 用忙等而不是 sleep 以免被调度粒度放大。sleep(0) 让出 GIL，读线程不会被饿住
+        plan = sorted(((unit.command_latency(cue.effects[unit.name]), unit) for unit in targets),
+                      key=lambda item: -item[0])
+        longest = plan[0][0]
+        start = time.perf_counter()
+        first = last = None
+        for latency, unit in plan:
+            target = start + longest - latency
+            while time.perf_counter() < target:
+                time.sleep(0)
+            sent = unit.write_now(cue.effects[unit.name])
+            first = sent if first is None else first
+            last = sent
+        self.cue_waits.add(first - cue.created)
+        self.write_spreads.add(last - first)
+        self.cues_fired += 1
+        held = set().union(*(c.effects for c in self.cues))
+        for unit in targets:
+            unit.held = unit.name in held
+            unit.update_hold()
+
+    async def run_async(self, stop=None):
+        """运行所有端点的读循环，直到 stop (asyncio.Event) 被设置或被取消"""
+        tasks = [asyncio.create_task(unit.run_async(self.check_cues))
+                 for unit in self.units.values()]
+        try:
+            if stop is None:
+                await asyncio.gather(*tasks)
+            else:
+                await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self):
+        log.info("Controller pool started with %d units", len(self.units))
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            log.info("Controller pool stopped")
+        log.info("Pool stats: %s", self.stats())
+
+    def stats(self):
+        return {
+            'cues_fired': self.cues_fired,
+            'cues_waiting': len(self.cues),
+            'cue_wait': self.cue_waits.summary(),
+            'write_spread': self.write_spreads.summary(),
+            'units': {name: unit.stats() for name, unit in self.units.items()},
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    ControllerPool(sys.argv[1:] or ['COM9'],
+                   on_message=lambda name, msg: print(f"[{name}] {msg}")).run()
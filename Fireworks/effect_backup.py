@@ -0,0 +1,316 @@
+"""效果库的后台增量备份
+
+压缩出新快照后，EffectStore 只给快照建一个硬链接作为待备份文件就返回；
+后台线程在保存停歇 debounce 秒后才处理，一串连续保存只产生一个备份。
+
+备份文件为 gzip 压缩:
+    头部    : 一行 JSON {"kind": "full"|"delta", "time": 秒, "count": 记录数, "removed": [ID...]}
+    记录区  : 若干条 效果ID(q) | 长度(I) | 原始记录字节
+full 含全部记录；delta 只含相对上一个备份新增/修改的记录与被删除的 ID。
+一个 full 加其后的 delta 构成一条链，恢复时从链首依次重放。
+
+保留按时间: 某条链之后的链在保留期之前就已开始时，整条链删除，保留期内的
+任意时刻都能恢复。备份列表记录在索引文件中，启动时不再扫描备份目录。
+"""
+import gzip
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from shutil import copyfile
+
+from metrics import REGISTRY
+
+# 最后一次保存之后等待多久才备份(秒)
+BACKUP_DEBOUNCE = 2.0
+# 连续保存不停时最多推迟多久(秒)
+BACKUP_MAX_DELAY = 60.0
+# 备份保留时长(秒)
+BACKUP_RETENTION = 7 * 24 * 3600
+# 每条链最多多少个 delta，之后写新的 full
+FULL_EVERY = 50
+
+ITEM = struct.Struct('<qI')
+
+log = logging.getLogger(__name__)
+
+BACKUP_SECONDS = REGISTRY.histogram('fireworks_backup_seconds', '后台生成一个备份的耗时')
+BACKUP_BYTES = REGISTRY.counter('fireworks_backup_bytes_total', '写出的压缩备份字节数',
+                                labels=('kind',))
+
+
+def write_backup(path, kind, records, removed=()):
+    """把 {ID: 原始记录字节} 写成压缩备份文件(先写临时文件再原子替换)"""
+    header = {'kind': kind, 'time': time.time(), 'count': len(records),
+              'removed': sorted(removed)}
+    tmp_file = path + '.tmp'
+    with gzip.open(tmp_file, 'wb', compresslevel=6) as f:
+        f.write(json.dumps(header, separators=(',', ':')).encode() + b'\n')
+        for effect_id, raw in records.items():
+            f.write(ITEM.pack(effect_id, len(raw)))
+            f.write(raw)
+    os.replace(tmp_file, path)
+    return header
+
+
+def read_header(path):
+    with gzip.open(path, 'rb') as f:
+        return json.loads(f.readline())
+
+
+def read_backup(path):
+    """返回 (头部, {ID: 原始记录字节})"""
+    with gzip.open(path, 'rb') as f:
+        header = json.loads(f.readline())
+        data = f.read()
+    records = {}
+    offset = 0
+    while offset < len(data):
+        effect_id, size = ITEM.unpack_from(data, offset)
+        offset += ITEM.size
+        records[effect_id] = data[offset:offset + size]
+        offset += size
+    return header, records
+
+
+def diff_records(previous, current):
+    """返回 (新增或修改的记录, 被删除的 ID)"""
+    changed = {effect_id: raw for effect_id, raw in current.items()
+               if previous.get(effect_id) != raw}
+    removed = previous.keys() - current.keys()
+    return changed, removed
+
+
+def _link(source, target):
+    """硬链接 source -> target (已存在则替换)；不支持硬链接时复制"""
+    tmp_file = target + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    try:
+        os.link(source, tmp_file)
+    except OSError:
+        copyfile(source, tmp_file)
+    os.replace(tmp_file, target)
+
+
+class BackupWorker:
+    """store 的备份: schedule() 在压缩后调用，其余工作在后台线程完成
+
+    store 需要提供 snapshot_file、name、SNAPSHOT_EXT 与 read_records(路径)。
+    background 为 False 时 schedule() 直接同步备份(用于对比测试)。
+    """
+
+    def __init__(self, store, backup_dir, retention=BACKUP_RETENTION, debounce=BACKUP_DEBOUNCE,
+                 max_delay=BACKUP_MAX_DELAY, full_every=FULL_EVERY, background=True):
+        self.store = store
+        self.backup_dir = backup_dir
+        self.retention = retention
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.full_every = full_every
+        self.background = background
+        name, ext = store.name, store.SNAPSHOT_EXT
+        self.index_file = os.path.join(backup_dir, f"{name}.index.json")
+        # 待备份的快照 / 正在备份的快照 / 上一个备份对应的快照(计算 delta 的基准)
+        self.pending_file = os.path.join(backup_dir, f"{name}.pending{ext}")
+        self.working_file = os.path.join(backup_dir, f"{name}.working{ext}")
+        self.previous_file = os.path.join(backup_dir, f"{name}.previous{ext}")
+        self.entries = self._load_index()
+        self.scheduled = 0
+        self.written = 0
+        self._cond = threading.Condition()
+        # 备份本身(working/previous 文件与 entries)一次只由一个线程进行:
+        # 后台线程与调用 flush()/restore() 的线程之间互斥
+        self._backup_lock = threading.Lock()
+        self._due = None
+        self._first_pending = None
+        self._thread = None
+        self._closing = False
+        if os.path.exists(self.pending_file):
+            # 上次退出前没来得及备份
+            self._due = self._first_pending = time.monotonic()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def backups(self):
+        """按时间排序的备份文件名"""
+        return [entry['file'] for entry in self.entries]
+
+    def _load_index(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return self._rebuild_index()
+
+    def _rebuild_index(self):
+        """索引文件缺失或损坏时扫描一次备份目录"""
+        entries = []
+        prefix = self.store.name + '_'
+        for file in sorted(os.listdir(self.backup_dir)):
+            if not (file.startswith(prefix) and file.endswith('.gz')):
+                continue
+            try:
+                header = read_header(os.path.join(self.backup_dir, file))
+            except (OSError, ValueError, EOFError):
+                continue
+            entries.append({'file': file, 'kind': header['kind'], 'time': header['time'],
+                            'bytes': os.path.getsize(os.path.join(self.backup_dir, file))})
+        return entries
+
+    def _save_index(self):
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_file, self.index_file)
+
+    def schedule(self):
+        """记下当前快照待备份；连续调用只推迟备份时刻"""
+        if not os.path.exists(self.store.snapshot_file):
+            return
+        self.scheduled += 1
+        if not self.background:
+            _link(self.store.snapshot_file, self.pending_file)
+            self._run_pending()
+            return
+        with self._cond:
+            _link(self.store.snapshot_file, self.pending_file)
+            now = time.monotonic()
+            if self._first_pending is None:
+                self._first_pending = now
+            self._due = min(now + self.debounce, self._first_pending + self.max_delay)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='effect-backup',
+                                                daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._closing and (
+                        self._due is None or time.monotonic() < self._due):
+                    timeout = None if self._due is None else self._due - time.monotonic()
+                    self._cond.wait(timeout)
+                if self._due is None:
+                    return
+            try:
+                self._run_pending()
+            except Exception:
+                log.exception("Backup failed")
+            with self._cond:
+                if self._closing and self._due is None:
+                    return
+
+    def _run_pending(self):
+        """取出待备份的快照并备份；处理期间到来的新快照等下一轮"""
+        with self._backup_lock:
+            with self._cond:
+                if not os.path.exists(self.pending_file):
+                    self._due = self._first_pending = None
+                    return
+                os.replace(self.pending_file, self.working_file)
+                self._due = self._first_pending = None
+            with BACKUP_SECONDS.time():
+                self._backup(self.working_file)
+
+    def _backup(self, snapshot):
+        records = self.store.read_records(snapshot)
+        kind = 'full'
+        if os.path.exists(self.previous_file) and self.entries:
+            chain = 0
+            for entry in reversed(self.entries):
+                if entry['kind'] == 'full':
+                    break
+                chain += 1
+            if chain < self.full_every:
+                kind = 'delta'
+        if kind == 'delta':
+            changed, removed = diff_records(self.store.read_records(self.previous_file), records)
+            if not changed and not removed:
+                os.replace(snapshot, self.previous_file)
+                return
+        else:
+            changed, removed = records, ()
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        file = f"{self.store.name}_{timestamp}.{kind}.gz"
+        path = os.path.join(self.backup_dir, file)
+        header = write_backup(path, kind, changed, removed)
+        size = os.path.getsize(path)
+        BACKUP_BYTES.inc(kind, amount=size)
+        os.replace(snapshot, self.previous_file)
+        self.entries.append({'file': file, 'kind': kind, 'time': header['time'], 'bytes': size})
+        self.written += 1
+        self.expire()
+        self._save_index()
+
+    def expire(self, now=None):
+        """删除整条都已不需要的链: 下一条链在保留期之前就已开始"""
+        cutoff = (time.time() if now is None else now) - self.retention
+        starts = [i for i, entry in enumerate(self.entries) if entry['kind'] == 'full']
+        keep_from = 0
+        for start in starts[1:]:
+            if self.entries[start]['time'] <= cutoff:
+                keep_from = start
+        if not keep_from:
+            return
+        for entry in self.entries[:keep_from]:
+            try:
+                os.remove(os.path.join(self.backup_dir, entry['file']))
+            except FileNotFoundError:
+                pass
+        del self.entries[:keep_from]
+
+    def flush(self):
+        """立即处理待备份的快照；后台线程正在备份时等它完成"""
+        if self._due is not None or os.path.exists(self.pending_file):
+            self._run_pending()
+
+    def close(self):
+        """退出前把待备份的快照备份完"""
+        thread = self._thread
+        if thread is not None:
+            with self._cond:
+                self._closing = True
+                if self._due is not None:
+                    self._due = time.monotonic()
+                self._cond.notify()
+            thread.join()
+            self._thread = None
+            self._closing = False
+        self.flush()
+
+    def restore(self, file=None):
+        """某个备份(默认最新)时刻的 {ID: 原始记录字节}"""
+        with self._backup_lock:
+            return self._restore(file)
+
+    def _restore(self, file):
+        if not self.entries:
+            return {}
+        files = self.backups
+        end = files.index(file) if file is not None else len(files) - 1
+        start = end
+        while self.entries[start]['kind'] != 'full':
+            start -= 1
+        records = {}
+        for entry in self.entries[start:end + 1]:
+            header, changed = read_backup(os.path.join(self.backup_dir, entry['file']))
+            for effect_id in header['removed']:
+                records.pop(effect_id, None)
+            records.update(changed)
+        return records
+
+    def stats(self):
+        return {
+            'backups': len(self.entries),
+            'bytes': sum(entry['bytes'] for entry in self.entries),
+            'scheduled': self.scheduled,
+            'written': self.written,
+        }
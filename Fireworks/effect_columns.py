@@ -0,0 +1,155 @@
+"""列式效果库: 每个字段一列 array.array，统计/筛选一次遍历完成
+
+装有 NumPy 时通过 np.frombuffer 零拷贝地向量化计算，否则退回纯 Python。
+"""
+from array import array
+
+from effect_model import FireworkEffect, LaunchMode, ExplodeMode, GradientMode, LaserColor
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+# 列名 -> (array 类型码, 从 FireworkEffect 取值的函数)
+COLUMNS = {
+    'r1': ('B', lambda e: e.color1[0]),
+    'g1': ('B', lambda e: e.color1[1]),
+    'b1': ('B', lambda e: e.color1[2]),
+    'r2': ('B', lambda e: e.color2[0]),
+    'g2': ('B', lambda e: e.color2[1]),
+    'b2': ('B', lambda e: e.color2[2]),
+    'max_brightness': ('B', lambda e: e.max_brightness),
+    'launch_mode': ('B', lambda e: e.launch_mode),
+    'gradient_mode': ('B', lambda e: e.gradient_mode),
+    'explode_mode': ('B', lambda e: e.explode_mode),
+    'laser_color': ('B', lambda e: e.laser_color),
+    'mirror_angle': ('h', lambda e: e.mirror_angle),
+    'explosion_led_count': ('H', lambda e: e.explosion_led_count),
+    'speed_delay': ('H', lambda e: e.speed_delay),
+}
+
+# 需要做直方图的模式列
+MODE_COLUMNS = {
+    'launch': ('launch_mode', LaunchMode),
+    'explode': ('explode_mode', ExplodeMode),
+    'gradient': ('gradient_mode', GradientMode),
+    'laser': ('laser_color', LaserColor),
+}
+
+
+class EffectColumns:
+    """与 effects_data 同步维护的列式副本"""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.columns = {name: array(code) for name, (code, _) in COLUMNS.items()}
+        self.rows = {}  # 效果ID -> 行号；为 None 时在第一次 append 时才建立
+
+    @classmethod
+    def from_effects(cls, effects):
+        table = cls()
+        for effect_id, effect in effects.items():
+            table.append(effect_id, effect)
+        return table
+
+    @classmethod
+    def from_arrays(cls, columns, ids):
+        """由等长的整列数据(如 NumPy 数组)直接建表，不逐行转换"""
+        table = cls()
+        table.ids = array('q', bytes(np.ascontiguousarray(ids, dtype='q')) if np is not None
+                          else ids)
+        for name, (code, _) in COLUMNS.items():
+            col = columns[name]
+            if np is not None:
+                table.columns[name] = array(code, bytes(np.ascontiguousarray(col, dtype=code)))
+            else:
+                table.columns[name] = array(code, col)
+            if len(table.columns[name]) != len(table.ids):
+                raise ValueError(f"column {name} has {len(table.columns[name])} rows, "
+                                 f"expected {len(table.ids)}")
+        table.rows = None
+        return table
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, effect_id, effect):
+        """追加一行；同一ID再次出现时覆盖原行"""
+        effect_id = int(effect_id)
+        if self.rows is None:
+            self.rows = dict(zip(self.ids, range(len(self.ids))))
+        row = self.rows.get(effect_id)
+        if row is None:
+            self.rows[effect_id] = len(self.ids)
+            self.ids.append(effect_id)
+            for name, (_, getter) in COLUMNS.items():
+                self.columns[name].append(getter(effect))
+        else:
+            for name, (_, getter) in COLUMNS.items():
+                self.columns[name][row] = getter(effect)
+
+    def column(self, name):
+        """返回一列: 有 NumPy 时为零拷贝的 ndarray 视图，否则为 array.array
+
+        视图存在期间该列不能再追加，调用者不要长期持有。
+        """
+        col = self.ids if name == 'id' else self.columns[name]
+        if np is not None:
+            return np.frombuffer(col, dtype=col.typecode) if len(col) else np.empty(0, col.typecode)
+        return col
+
+    def effect(self, row):
+        """第 row 行 -> FireworkEffect"""
+        return FireworkEffect.from_fields((self.columns[name][row] for name in COLUMNS),
+                                          id=self.ids[row])
+
+    def effects(self, start=0, stop=None):
+        """按行序逐个产出 FireworkEffect，用于播放或分批上传"""
+        stop = len(self.ids) if stop is None else min(stop, len(self.ids))
+        cols = [self.columns[name] for name in COLUMNS]
+        for row in range(start, stop):
+            yield FireworkEffect.from_fields((col[row] for col in cols), id=self.ids[row])
+
+    def last_effect_id(self):
+        if not self.ids:
+            return None
+        if np is not None:
+            return int(self.column('id').max())
+        return max(self.ids)
+
+    def histogram(self, name, size):
+        """某个取值范围为 0..size-1 的列的计数"""
+        if np is not None:
+            return np.bincount(self.column(name), minlength=size)[:size].tolist()
+        counts = [0] * size
+        for value in self.columns[name]:
+            if value < size:
+                counts[value] += 1
+        return counts
+
+    def mode_histograms(self):
+        """各模式的使用次数 {'launch': {'NORMAL_ASCEND': n, ...}, ...}"""
+        result = {}
+        for key, (name, enum) in MODE_COLUMNS.items():
+            counts = self.histogram(name, len(enum))
+            result[key] = {member.name: counts[member] for member in enum}
+        return result
+
+    def select(self, **conditions):
+        """按列取值筛选，返回满足全部条件的效果ID列表
+
+        例: select(launch_mode=LaunchMode.PENDULUM_ASCEND, laser_color=LaserColor.LASER_RED)
+        """
+        if np is not None:
+            mask = np.ones(len(self.ids), dtype=bool)
+            for name, value in conditions.items():
+                mask &= self.column(name) == int(value)
+            return self.column('id')[mask].tolist()
+        checks = [(self.columns[name], int(value)) for name, value in conditions.items()]
+        return [effect_id for row, effect_id in enumerate(self.ids)
+                if all(col[row] == value for col, value in checks)]
+
+    def nbytes(self):
+        """列数据占用的字节数(不含ID->行号字典)"""
+        return sum(col.itemsize * len(col) for col in (self.ids, *self.columns.values()))
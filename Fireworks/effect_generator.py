@@ -0,0 +1,202 @@
+"""用 NumPy 批量随机生成烟花效果
+
+一次为 N 个效果抽取全部字段，输出 EffectColumns 列式表，可直接统计、筛选，
+播放/上传时再用 columns.effects() 逐个取出 FireworkEffect。同一 seed 结果可复现。
+
+    generator = EffectGenerator(seed=1, no_repeat=('launch_mode',),
+                                palette=[(255, 0, 0), (255, 160, 0), (255, 255, 255)])
+    show = generator.generate(1_000_000)
+    controller.play_playlist(show.effects(0, 64))
+
+也可以当作无穷迭代器，按块生成后逐个产出 (见 control_test.py 的随机效果模式)。
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from effect_columns import COLUMNS, EffectColumns
+from effect_model import FIELD_RANGES, LaunchMode, ExplodeMode, GradientMode, LaserColor
+
+# 数值字段的抽取范围(含两端)，与 control_test.generate_random_effect 相同
+DEFAULT_RANGES = {
+    'max_brightness': (128, 255),
+    'mirror_angle': (0, 180),
+    'explosion_led_count': (50, 200),
+    'speed_delay': (10, 50),
+}
+# v2/test.py 使用的范围: 短小、快速的效果
+QUICK_RANGES = {
+    'max_brightness': (100, 255),
+    'mirror_angle': (0, 30),
+    'explosion_led_count': (10, 50),
+    'speed_delay': (3, 8),
+}
+MODE_FIELDS = {
+    'launch_mode': LaunchMode,
+    'gradient_mode': GradientMode,
+    'explode_mode': ExplodeMode,
+    'laser_color': LaserColor,
+}
+# 作为迭代器使用时每次生成的效果数
+CHUNK = 256
+
+
+def _probabilities(weights, size, name):
+    p = np.asarray(weights, dtype=np.float64)
+    if p.shape != (size,) or (p < 0).any() or p.sum() <= 0:
+        raise ValueError(f"{name}: expected {size} non-negative weights, got {weights}")
+    return p / p.sum()
+
+
+@lru_cache(maxsize=None)
+def _composition(size):
+    """取值 0..size-1 上所有函数的编码 (f[v] * size**v 之和) 与组合表 comp[a, b] = a∘b"""
+    powers = size ** np.arange(size)
+    functions = (np.arange(size ** size)[:, None] // powers) % size
+    composed = functions[np.arange(size ** size)[:, None, None], functions[None, :, :]]
+    return powers, (composed * powers).sum(axis=-1).astype(np.uint8)
+
+
+def resolve_repeats(candidates, alternatives, size, previous=None, block=16):
+    """逐个取 candidates[i]，与前一个结果相同时改取 alternatives[i] (须与 candidates[i] 不同)
+
+    等价于顺序执行，但没有 Python 循环: 第 i 个位置是 前一个结果 -> 本位置结果 的函数
+    (只有 size**size 种，编码为整数)，分块倍增求出前缀组合后一次取值。
+    previous 为这一批之前的最后一个结果，None 表示第一个直接取 candidates[0]。
+    """
+    count = len(candidates)
+    powers, comp = _composition(size)
+    c = candidates.astype(np.int64)
+    codes = c * powers.sum() + (alternatives.astype(np.int64) - c) * powers[c]
+    if previous is None:
+        codes[0] = c[0] * powers.sum()  # 常函数
+    identity = int(powers @ np.arange(size))
+    pad = -count % block
+    table = np.concatenate([codes.astype(np.uint8), np.full(pad, identity, np.uint8)])
+    table = table.reshape(-1, block)
+    # 块内前缀组合
+    shift = 1
+    while shift < block:
+        table[:, shift:] = comp[table[:, shift:], table[:, :-shift]]
+        shift *= 2
+    # 各块整体的前缀组合，得到进入每一块时的结果
+    totals = table[:, -1].copy()
+    shift = 1
+    while shift < len(totals):
+        totals[shift:] = comp[totals[shift:], totals[:-shift]]
+        shift *= 2
+    first = 0 if previous is None else previous
+    entering = np.empty(len(totals), np.int64)
+    entering[0] = first
+    entering[1:] = (totals[:-1] // powers[first]) % size
+    values = (table // powers[entering][:, None]) % size
+    return values.astype(np.uint8).ravel()[:count]
+
+
+class EffectGenerator:
+    """随机效果的批量生成器
+
+    ranges: 字段 -> (最小值, 最大值)，未给出的字段用 DEFAULT_RANGES
+    weights: 模式字段 -> 每个取值的权重，如 {'laser_color': [2, 1, 1]}
+    no_repeat: 相邻两个效果不能取相同值的模式字段，如 ('launch_mode',)
+    palette: 颜色列表，给出时 color1/color2 只从中选取；palette_weights 为其权重
+    """
+
+    def __init__(self, seed=None, ranges=None, weights=None, no_repeat=(), palette=None,
+                 palette_weights=None):
+        self.rng = np.random.default_rng(seed)
+        self.ranges = dict(DEFAULT_RANGES, **(ranges or {}))
+        for name, (low, high) in self.ranges.items():
+            limit_low, limit_high = FIELD_RANGES[name]
+            if not limit_low <= low <= high <= limit_high:
+                raise ValueError(f"{name} range out of bounds: {(low, high)}")
+        self.weights = {name: _probabilities(w, len(MODE_FIELDS[name]), name)
+                        for name, w in (weights or {}).items()}
+        self.no_repeat = tuple(no_repeat)
+        for name in self.no_repeat:
+            p = self.weights.get(name)
+            choices = len(MODE_FIELDS[name]) if p is None else int((p > 0).sum())
+            if choices < 2:
+                raise ValueError(f"{name} needs at least two possible values to avoid repeats")
+        self.palette = None
+        if palette is not None:
+            self.palette = np.asarray(palette, dtype=np.int64).reshape(-1, 3)
+            if not len(self.palette) or self.palette.min() < 0 or self.palette.max() > 255:
+                raise ValueError(f"invalid palette: {palette}")
+            self.palette = self.palette.astype(np.uint8)
+        self.palette_weights = None if palette_weights is None else \
+            _probabilities(palette_weights, len(self.palette), 'palette')
+        self.last = {}  # 上一批最后一个效果的取值，保证跨批次也不重复
+        self.next_id = 1
+
+    def _modes(self, name, count):
+        size = len(MODE_FIELDS[name])
+        p = self.weights.get(name)
+        values = self._draw(size, p, count)
+        if name in self.no_repeat and count:
+            # 与前一个相同时改用按 去掉该取值后的权重 另抽的备选值
+            if p is None:
+                offsets = self.rng.integers(1, size, count, dtype=np.uint8)
+                alternatives = ((values + offsets) % size).astype(np.uint8)
+            else:
+                alternatives = np.empty(count, np.uint8)
+                u = self.rng.random(count)
+                for value in range(size):
+                    excluded = p.copy()
+                    excluded[value] = 0.0
+                    cdf = np.cumsum(excluded) / excluded.sum()
+                    mask = values == value
+                    alternatives[mask] = np.searchsorted(cdf, u[mask], side='right')
+            values = resolve_repeats(values, alternatives, size, self.last.get(name))
+            self.last[name] = int(values[-1])
+        return values
+
+    def _draw(self, size, p, count):
+        if p is None:
+            return self.rng.integers(0, size, count, dtype=np.uint8)
+        return self.rng.choice(size, count, p=p).astype(np.uint8)
+
+    def _colors(self, count):
+        if self.palette is None:
+            return self.rng.integers(0, 256, (count, 3), dtype=np.uint8)
+        picks = self.rng.choice(len(self.palette), count, p=self.palette_weights)
+        return self.palette[picks]
+
+    def columns(self, count):
+        """抽取 count 个效果，返回 列名 -> ndarray"""
+        columns = {}
+        for prefix in ('1', '2'):
+            colors = self._colors(count)
+            for channel, name in enumerate(('r', 'g', 'b')):
+                columns[name + prefix] = colors[:, channel]
+        for name, (low, high) in self.ranges.items():
+            columns[name] = self.rng.integers(low, high + 1, count).astype(COLUMNS[name][0])
+        for name in MODE_FIELDS:
+            columns[name] = self._modes(name, count)
+        return columns
+
+    def generate(self, count):
+        """生成 count 个效果的列式表，效果ID从上一批之后接着分配"""
+        ids = np.arange(self.next_id, self.next_id + count, dtype=np.int64)
+        self.next_id += count
+        return EffectColumns.from_arrays(self.columns(count), ids)
+
+    def __iter__(self):
+        while True:
+            yield from self.generate(CHUNK).effects()
+
+
+def generate_effects(count, seed=None, **options):
+    """generate() 的简写: generate_effects(1000, seed=1, no_repeat=('launch_mode',))"""
+    return EffectGenerator(seed, **options).generate(count)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    start = time.perf_counter()
+    show = generate_effects(count, seed=0, no_repeat=('launch_mode',))
+    print(f"{len(show)} effects in {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(show.mode_histograms())
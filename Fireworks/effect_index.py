@@ -0,0 +1,97 @@
+"""效果ID分配与二级索引 (按模式、按保存时间)"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+
+from effect_store import max_effect_id
+
+# 建立二级索引的模式字段
+INDEXED_MODES = ('launch_mode', 'gradient_mode', 'explode_mode', 'laser_color')
+
+
+class EffectIndex:
+    """维护单调递增的效果ID，以及 模式 -> ID集合、保存时间 -> ID 的索引
+
+    主索引(ID -> 效果)就是 FireworkController.effects_data，键统一为 int。
+    二级索引在第一次查询时才建立，大型效果库启动时不必逐个解码效果。
+    """
+
+    def __init__(self, effects=None, next_id=1):
+        """next_id 为持久化的ID高水位(见 EffectStore.next_id)，已删除的最大ID不会再分配"""
+        self.effects = effects if effects is not None else {}
+        self.next_id = max(next_id, max_effect_id(self.effects) + 1)
+        self.by_mode = None
+        self._times = None  # 按保存时间排序的 (timestamp, id)
+
+    @classmethod
+    def from_effects(cls, effects, next_id=1):
+        return cls(effects, next_id)
+
+    def _build(self):
+        self.by_mode = {name: defaultdict(set) for name in INDEXED_MODES}
+        for effect_id, effect in self.effects.items():
+            for name in INDEXED_MODES:
+                self.by_mode[name][getattr(effect, name)].add(effect_id)
+        self._times = sorted((effect.timestamp, effect_id)
+                             for effect_id, effect in self.effects.items())
+
+    def allocate_id(self):
+        """分配新的效果ID；ID只增不减，删除效果后也不会复用"""
+        effect_id = self.next_id
+        self.next_id += 1
+        return effect_id
+
+    def add(self, effect_id, effect):
+        """effects 中新增效果后调用"""
+        effect_id = int(effect_id)
+        self.next_id = max(self.next_id, effect_id + 1)
+        if self.by_mode is not None:
+            self._add_secondary(effect_id, effect)
+
+    def _add_secondary(self, effect_id, effect):
+        for name in INDEXED_MODES:
+            self.by_mode[name][getattr(effect, name)].add(effect_id)
+        entry = (effect.timestamp, effect_id)
+        # 新保存的效果时间最晚，通常直接追加
+        if not self._times or self._times[-1] <= entry:
+            self._times.append(entry)
+        else:
+            self._times.insert(bisect_left(self._times, entry), entry)
+
+    def remove(self, effect_id, effect=None):
+        """effects 中删除效果时调用 (effect 为被删的效果，省略时从 effects 中取)
+
+        已建立的二级索引同步去掉该ID；next_id 不变，删除的ID不会再分配。
+        """
+        effect_id = int(effect_id)
+        if self.by_mode is None:
+            return
+        if effect is None:
+            effect = self.effects.get(effect_id)
+            if effect is None:
+                return
+        for name in INDEXED_MODES:
+            ids = self.by_mode[name].get(getattr(effect, name))
+            if ids is not None:
+                ids.discard(effect_id)
+        entry = (effect.timestamp, effect_id)
+        i = bisect_left(self._times, entry)
+        if i < len(self._times) and self._times[i] == entry:
+            del self._times[i]
+
+    def ids_with(self, **modes):
+        """满足全部模式条件的效果ID，例: ids_with(launch_mode=LaunchMode.STEP_ASCEND)"""
+        if self.by_mode is None:
+            self._build()
+        sets = sorted((self.by_mode[name].get(value, set()) for name, value in modes.items()),
+                      key=len)
+        if not sets:
+            return set()
+        return set(sets[0]).intersection(*sets[1:])
+
+    def ids_between(self, start, end):
+        """保存时间在 [start, end] 之间的效果ID (ISO 格式时间字符串)，按时间排序"""
+        if self._times is None:
+            self._build()
+        lo = bisect_left(self._times, (start,))
+        hi = bisect_right(self._times, (end, float('inf')))
+        return [effect_id for _, effect_id in self._times[lo:hi]]
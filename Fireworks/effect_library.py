@@ -0,0 +1,319 @@
+"""内存映射的效果库文件，效果在首次访问时才解码
+
+文件格式 (小端):
+    文件头  : 魔数 b'FWLB' | 版本(H) | 效果数 N(I)
+    ID 索引 : N 个升序的 int64 效果ID
+    记录区  : N 条定长记录，与 ID 索引一一对应
+              P 命令的 14 个字段 | 保存时间(32 字节 ASCII)
+
+ID 索引就是偏移索引: 第 i 个ID 的记录位于 记录区起点 + i * 记录长度。
+"""
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import ItemsView, MutableMapping, ValuesView
+
+from effect_columns import COLUMNS, EffectColumns
+from effect_model import FireworkEffect
+from effect_store import EffectStore
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+MAGIC = b'FWLB'
+LIBRARY_VERSION = 1
+HEADER = struct.Struct('<4sHI')
+RECORD = struct.Struct('<11BhHH32s')
+# 记录的 NumPy 结构化类型，字段名与 effect_columns.COLUMNS 相同
+RECORD_DTYPE = np.dtype([(name, '<' + code) for name, (code, _) in COLUMNS.items()] +
+                        [('timestamp', 'S32')]) if np is not None else None
+# 默认最多缓存的已解码效果数
+CACHE_SIZE = 4096
+# 最多保留多少个效果的已编码播放命令(解码的效果被淘汰后仍保留，每个约 100 字节)
+WIRE_CACHE_SIZE = 65536
+
+
+def write_library(path, effects):
+    """把 {效果ID: FireworkEffect} 写成库文件"""
+    ids = sorted(effects)
+    pack = RECORD.pack
+    # 来自库文件且未修改的效果直接复制原始记录，不必解码
+    raw_record = getattr(effects, 'raw_record', lambda effect_id: None)
+
+    def record(effect_id):
+        raw = raw_record(effect_id)
+        if raw is None:
+            effect = effects[effect_id]
+            raw = pack(*effect.fields(), effect.timestamp.encode())
+        return raw
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, LIBRARY_VERSION, len(ids)))
+        f.write(array('q', ids).tobytes())
+        f.write(b''.join(record(i) for i in ids))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_records(path):
+    """库文件 -> {效果ID: 原始记录字节}，不解码"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != LIBRARY_VERSION:
+        raise ValueError(f"Not an effect library: {path}")
+    ids = array('q')
+    ids.frombytes(data[HEADER.size:HEADER.size + count * 8])
+    offset = HEADER.size + count * 8
+    size = RECORD.size
+    return {effect_id: data[offset + i * size:offset + (i + 1) * size]
+            for i, effect_id in enumerate(ids)}
+
+
+def decode_record(effect_id, buffer, offset=0):
+    """一条原始记录 -> FireworkEffect"""
+    *fields, timestamp = RECORD.unpack_from(buffer, offset)
+    return FireworkEffect.from_fields(
+        fields, id=effect_id, timestamp=timestamp.rstrip(b'\0').decode())
+
+
+class _ItemsView(ItemsView):
+    def __iter__(self):
+        for key in self._mapping:
+            try:
+                yield key, self._mapping[key]
+            except KeyError:
+                continue  # 解码失败，已被隔离
+
+
+class _ValuesView(ValuesView):
+    def __iter__(self):
+        for _, value in _ItemsView(self._mapping):
+            yield value
+
+
+class LazyEffectLibrary(MutableMapping):
+    """{效果ID: FireworkEffect} 映射，基底是内存映射的库文件
+
+    读取时按需解码并放入有界 LRU；新增/修改的效果放在内存中的覆盖层，
+    下次压缩时一起写回库文件。已编码的播放命令按ID另外缓存在更大的 LRU 中，
+    烟花长河反复播放整个库时，重新解码的效果不必再编码。
+
+    解码失败的记录交给 on_invalid(效果ID, 原始记录, 异常) 隔离，之后视为已删除。
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE, wire_cache_size=WIRE_CACHE_SIZE,
+                 on_invalid=None):
+        self.cache_size = cache_size
+        self.wire_cache_size = wire_cache_size
+        self.on_invalid = on_invalid
+        self._file = None
+        self._mm = None
+        self._ids = array('q')
+        self._records_offset = 0
+        self._overlay = {}
+        self._deleted = set()
+        self._cache = OrderedDict()
+        self._wire = OrderedDict()  # 效果ID -> 该效果的编码缓存
+
+    def open(self, path):
+        """映射库文件；之前的覆盖层与缓存被清空(内容已在文件中)"""
+        self.close()
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._mm)
+        if magic != MAGIC or version != LIBRARY_VERSION:
+            self.close()
+            raise ValueError(f"Not an effect library: {path}")
+        ids_end = HEADER.size + count * 8
+        self._ids = array('q')
+        self._ids.frombytes(self._mm[HEADER.size:ids_end])
+        self._records_offset = ids_end
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._file.close()
+        self._mm = None
+        self._file = None
+        self._ids = array('q')
+        self._overlay.clear()
+        self._deleted.clear()
+        self._cache.clear()
+        self._wire.clear()
+
+    def _position(self, effect_id):
+        pos = bisect_left(self._ids, effect_id)
+        if pos < len(self._ids) and self._ids[pos] == effect_id:
+            return pos
+        return None
+
+    def _decode(self, effect_id, pos):
+        return decode_record(effect_id, self._mm, self._records_offset + pos * RECORD.size)
+
+    def raw_record(self, effect_id):
+        """库文件中未被覆盖的原始记录字节；否则返回 None"""
+        if effect_id in self._overlay or effect_id in self._deleted:
+            return None
+        pos = self._position(effect_id)
+        if pos is None:
+            return None
+        start = self._records_offset + pos * RECORD.size
+        return self._mm[start:start + RECORD.size]
+
+    def __getitem__(self, effect_id):
+        if effect_id in self._overlay:
+            return self._overlay[effect_id]
+        effect = self._cache.get(effect_id)
+        if effect is not None:
+            self._cache.move_to_end(effect_id)
+            return effect
+        pos = self._position(effect_id) if effect_id not in self._deleted else None
+        if pos is None:
+            raise KeyError(effect_id)
+        try:
+            effect = self._decode(effect_id, pos)
+        except ValueError as e:
+            if self.on_invalid is not None:
+                self.on_invalid(effect_id, self.raw_record(effect_id), e)
+            self._deleted.add(effect_id)
+            raise KeyError(effect_id) from e
+        wire = self._wire.get(effect_id)
+        if wire is not None:
+            effect.share_wire_cache(wire)
+            self._wire.move_to_end(effect_id)
+        else:
+            self._wire[effect_id] = effect.share_wire_cache()
+            if len(self._wire) > self.wire_cache_size:
+                self._wire.popitem(last=False)
+        self._cache[effect_id] = effect
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return effect
+
+    def __contains__(self, effect_id):
+        if effect_id in self._overlay:
+            return True
+        return effect_id not in self._deleted and self._position(effect_id) is not None
+
+    def __setitem__(self, effect_id, effect):
+        self._overlay[effect_id] = effect
+        self._deleted.discard(effect_id)
+        self._cache.pop(effect_id, None)
+        self._wire.pop(effect_id, None)
+
+    def __delitem__(self, effect_id):
+        if effect_id not in self:
+            raise KeyError(effect_id)
+        self._overlay.pop(effect_id, None)
+        self._cache.pop(effect_id, None)
+        self._wire.pop(effect_id, None)
+        if self._position(effect_id) is not None:
+            self._deleted.add(effect_id)
+
+    def __iter__(self):
+        for effect_id in self._ids:
+            if effect_id not in self._deleted:
+                yield effect_id
+        for effect_id in self._overlay:
+            if self._position(effect_id) is None:
+                yield effect_id
+
+    def __len__(self):
+        extra = sum(1 for effect_id in self._overlay if self._position(effect_id) is None)
+        return len(self._ids) - len(self._deleted) + extra
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def max_id(self):
+        return max(self._ids[-1] if self._ids else 0, max(self._overlay, default=0))
+
+    def to_columns(self):
+        """列式副本 EffectColumns，直接从映射的记录区取列，不逐个解码效果
+
+        记录的字段顺序与 effect_columns.COLUMNS 相同；覆盖层中的效果另行追加。
+        """
+        skip = self._deleted | self._overlay.keys()
+        count = len(self._ids)
+        if np is not None:
+            ids = np.frombuffer(self._ids, dtype=np.int64) if count else np.empty(0, np.int64)
+            keep = ~np.isin(ids, np.fromiter(skip, np.int64, len(skip))) if skip else slice(None)
+            records = np.frombuffer(self._mm, RECORD_DTYPE, count, self._records_offset) \
+                if count else np.empty(0, RECORD_DTYPE)
+            table = EffectColumns.from_arrays(
+                {name: records[name][keep] for name in COLUMNS}, ids[keep])
+            del records  # 释放对映射的引用，之后才能关闭或替换库文件
+        else:
+            columns = {name: array(code) for name, (code, _) in COLUMNS.items()}
+            ids = array('q')
+            names = tuple(COLUMNS)
+            end = self._records_offset + count * RECORD.size
+            records = RECORD.iter_unpack(self._mm[self._records_offset:end]) if count else ()
+            for effect_id, record in zip(self._ids, records):
+                if effect_id in skip:
+                    continue
+                ids.append(effect_id)
+                for name, value in zip(names, record):
+                    columns[name].append(value)
+            table = EffectColumns.from_arrays(columns, ids)
+        for effect_id, effect in self._overlay.items():
+            table.append(effect_id, effect)
+        return table
+
+
+class MappedEffectStore(EffectStore):
+    """快照使用内存映射库文件的 EffectStore，日志与备份逻辑不变(备份按定长记录比较)
+
+    库文件不存在而旧版 effects_data.json 存在时，读取后立即转换为库文件。
+    """
+    SNAPSHOT_EXT = '.lib'
+
+    def __init__(self, data_dir, backup_dir=None, cache_size=CACHE_SIZE, **kwargs):
+        kwargs.setdefault('encode', FireworkEffect.to_json)
+        kwargs.setdefault('decode', FireworkEffect.from_json)
+        super().__init__(data_dir, backup_dir, **kwargs)
+        self.library = LazyEffectLibrary(cache_size, on_invalid=self.quarantine)
+
+    def read_snapshot(self):
+        if not os.path.exists(self.snapshot_file):
+            legacy_file = os.path.join(self.data_dir, self.name + EffectStore.SNAPSHOT_EXT)
+            legacy = self.read_json_snapshot(legacy_file)
+            if not legacy:
+                self.library.close()
+                return self.library
+            # 旧文件保留不动，作为迁移前的备份
+            tmp_file = self.snapshot_file + '.tmp'
+            self.write_snapshot(tmp_file, legacy)
+            os.replace(tmp_file, self.snapshot_file)
+        self.library.open(self.snapshot_file)
+        return self.library
+
+    def write_snapshot(self, path, effects):
+        write_library(path, effects)
+
+    def read_records(self, path):
+        return read_records(path)
+
+    def decode_record(self, effect_id, raw):
+        return decode_record(effect_id, raw)
+
+    def replace_snapshot(self, tmp_file):
+        # Windows 上被映射的文件不能替换，先解除映射
+        self.library.close()
+        os.replace(tmp_file, self.snapshot_file)
+        self.library.open(self.snapshot_file)
+
+    def close(self):
+        super().close()
+        self.library.close()
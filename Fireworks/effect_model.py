@@ -0,0 +1,201 @@
+"""烟花效果的统一数据模型 (control.py / control_test.py / v2/test.py 共用)"""
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Tuple
+
+from wire_protocol import PROTOCOL_TEXT, MAX_BATCH_ITEMS, encode_batch, encode_play
+
+# 与 Arduino 端 A_GLOBAL.h 一致
+TOTAL_LED_COUNT = 280
+
+
+# 添加与Arduino对应的枚举类
+class LaunchMode(IntEnum):
+    NORMAL_ASCEND = 0
+    STEP_ASCEND = 1
+    PENDULUM_ASCEND = 2
+
+class ExplodeMode(IntEnum):
+    NORMAL = 0
+    BLINK = 1
+    RANDOM = 2
+
+class GradientMode(IntEnum):
+    GRADIENT = 0
+    FADE = 1
+    SWITCH = 2
+
+class LaserColor(IntEnum):
+    LASER_NONE = 0
+    LASER_GREEN = 1
+    LASER_RED = 2
+
+
+# 数值字段的合法范围(含两端)，即串口协议能表达的范围
+FIELD_RANGES = {
+    'max_brightness': (0, 255),
+    'mirror_angle': (0, 180),
+    'explosion_led_count': (0, TOTAL_LED_COUNT),
+    'speed_delay': (0, 0xFFFF),
+}
+_RANGE_CHECKS = tuple((name, low, high) for name, (low, high) in FIELD_RANGES.items())
+# 模式字段 -> {取值: 枚举成员}，查表比调用枚举类快得多(解码大型效果库时每个效果 4 次)
+_MODE_FIELDS = tuple((name, {int(member): member for member in enum}, enum) for name, enum in (
+    ('launch_mode', LaunchMode), ('gradient_mode', GradientMode),
+    ('explode_mode', ExplodeMode), ('laser_color', LaserColor)))
+
+
+@dataclass(frozen=True, slots=True)
+class FireworkEffect:
+    color1: Tuple[int, int, int]
+    color2: Tuple[int, int, int]
+    max_brightness: int
+    launch_mode: LaunchMode
+    gradient_mode: GradientMode
+    explode_mode: ExplodeMode
+    laser_color: LaserColor
+    mirror_angle: int
+    explosion_led_count: int
+    speed_delay: int
+    # 库中的元数据，不参与比较
+    id: int = field(default=0, compare=False)
+    timestamp: str = field(default='', compare=False)
+    # 按协议版本缓存的已编码 P 命令
+    _wire: dict = field(default=None, init=False, repr=False, compare=False)
+    # 缓存的预测播放秒数
+    _duration: float = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        set_attr = object.__setattr__
+        color1 = tuple(map(int, self.color1))
+        color2 = tuple(map(int, self.color2))
+        if len(color1) != 3 or len(color2) != 3 or \
+                min(color1 + color2) < 0 or max(color1 + color2) > 255:
+            raise ValueError(f"color out of range: {color1}, {color2}")
+        set_attr(self, 'color1', color1)
+        set_attr(self, 'color2', color2)
+        for name, members, enum in _MODE_FIELDS:
+            value = getattr(self, name)
+            member = members.get(value)
+            set_attr(self, name, member if member is not None else enum(value))
+        for name, low, high in _RANGE_CHECKS:
+            value = int(getattr(self, name))
+            if value < low or value > high:
+                raise ValueError(f"{name} out of range: {value}")
+            set_attr(self, name, value)
+        set_attr(self, '_wire', {})
+
+    def fields(self):
+        """P 命令中的 14 个字段"""
+        return (*self.color1, *self.color2, self.max_brightness,
+                int(self.launch_mode), int(self.gradient_mode),
+                int(self.explode_mode), int(self.laser_color),
+                self.mirror_angle, self.explosion_led_count, self.speed_delay)
+
+    @classmethod
+    def from_fields(cls, fields, **meta):
+        f = tuple(fields)
+        return cls(f[0:3], f[3:6], f[6], f[7], f[8], f[9], f[10], f[11], f[12], f[13], **meta)
+
+    def wire(self, version=PROTOCOL_TEXT):
+        """已编码的 P 命令，每个效果每种协议只编码一次"""
+        data = self._wire.get(version)
+        if data is None:
+            data = self._wire[version] = encode_play(self.fields(), version)
+        return data
+
+    def share_wire_cache(self, cache=None):
+        """改用外部的编码缓存 dict 并返回它；效果库按ID保存，效果对象被淘汰后已编码的命令仍在
+
+        cache 为 None 时返回本效果当前的缓存。缓存只能在同一ID、未修改的效果之间共用。
+        """
+        if cache is not None:
+            object.__setattr__(self, '_wire', cache)
+        return self._wire
+
+    def duration(self):
+        """预测的播放秒数 (effect_timing.predict_duration)，每个效果只计算一次"""
+        duration = self._duration
+        if duration is None:
+            from effect_timing import predict_duration  # effect_timing 依赖本模块
+            duration = predict_duration(self)
+            object.__setattr__(self, '_duration', duration)
+        return duration
+
+    def to_json(self):
+        """转为 effects_data.json 中的字典格式"""
+        c1, c2 = self.color1, self.color2
+        return {
+            'id': self.id,
+            'color1': {'r': c1[0], 'g': c1[1], 'b': c1[2]},
+            'color2': {'r': c2[0], 'g': c2[1], 'b': c2[2]},
+            'maxBrightness': self.max_brightness,
+            'launchMode': int(self.launch_mode),
+            'gradientMode': int(self.gradient_mode),
+            'explodeMode': int(self.explode_mode),
+            'laserColor': int(self.laser_color),
+            'mirrorAngle': self.mirror_angle,
+            'explosionLEDCount': self.explosion_led_count,
+            'speedDelay': self.speed_delay,
+            'timestamp': self.timestamp,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """由 effects_data.json 中的字典还原"""
+        c1, c2 = data['color1'], data['color2']
+        return cls(
+            (c1['r'], c1['g'], c1['b']),
+            (c2['r'], c2['g'], c2['b']),
+            data['maxBrightness'],
+            data['launchMode'],
+            data['gradientMode'],
+            data['explodeMode'],
+            data['laserColor'],
+            data['mirrorAngle'],
+            data['explosionLEDCount'],
+            data['speedDelay'],
+            id=int(data.get('id', 0)),
+            timestamp=data.get('timestamp', ''),
+        )
+
+
+class EffectBatch:
+    """一次上传、由固件在本地连续播放的一组效果 (协议版本 2 起)
+
+    gaps[i] 为第 i 个效果播完后到下一个开始前的等待毫秒数。
+    """
+
+    def __init__(self, effects, gaps=None):
+        self.effects = list(effects)
+        self.gaps = [0] * len(self.effects) if gaps is None else [int(g) for g in gaps]
+        if len(self.gaps) != len(self.effects):
+            raise ValueError("gaps must match effects")
+        self._wire = {}
+        self._duration = None
+
+    def __len__(self):
+        return len(self.effects)
+
+    def wire(self, version):
+        """已编码的批量帧，每种协议只编码一次"""
+        data = self._wire.get(version)
+        if data is None:
+            data = encode_batch([(effect.fields(), gap)
+                                 for effect, gap in zip(self.effects, self.gaps)], version)
+            self._wire[version] = data
+        return data
+
+    def duration(self):
+        """整批的预测播放秒数(含效果之间的等待，不含最后一个之后的)"""
+        if self._duration is None:
+            self._duration = sum(effect.duration() for effect in self.effects) + \
+                sum(self.gaps[:-1]) / 1000
+        return self._duration
+
+    @classmethod
+    def split(cls, effects, gaps=None, size=MAX_BATCH_ITEMS):
+        """把任意长的播放列表切成固件缓冲区放得下的若干批"""
+        effects = list(effects)
+        gaps = [0] * len(effects) if gaps is None else list(gaps)
+        return [cls(effects[i:i + size], gaps[i:i + size]) for i in range(0, len(effects), size)]
@@ -0,0 +1,231 @@
+"""离线渲染 v2 固件的灯带动画，不需要硬件即可预览/校验/计时
+
+按 v2/B_ASCEND_EFFECTS.ino 与 v2/B_EXPLOSION_EFFECTS.ino 逐帧复现 leds[] 的内容，
+每一阶段的所有帧一次性向量化计算。颜色运算与 FastLED 一致:
+nscale8 为 (c * (scale + 1)) >> 8，blend 为 blend8，浮点按 AVR 的 32 位 float 截断。
+
+与硬件的差别:
+- random(0, 100) 用 NumPy 的随机数代替，同一 seed 结果可复现
+- millis() 取 start_ms + 帧的开始时间，闪烁/换色的相位取决于 start_ms
+- 输出的是 leds[] 中的值，未乘 FastLED.setBrightness 的全局亮度
+
+用法: python effect_render.py <数据目录>   列出库中每个效果的帧数与时长
+"""
+import sys
+
+import numpy as np
+
+from effect_model import TOTAL_LED_COUNT, LaunchMode, ExplodeMode, GradientMode
+from effect_timing import (SHOW_TIME, DRAW_TIME, PLAY_OVERHEAD, ASCEND_STRIP_LEN,
+                           PENDULUM_PAUSE, pendulum_positions)
+
+# 见 B_EXPLOSION_EFFECTS.ino
+BLINK_INTERVAL = 50   # 定时闪烁的亮/灭时长(毫秒)
+SWITCH_INTERVAL = 500  # 颜色切换的间隔(毫秒)
+# 多段上升 (见 Z_Utils.ino launchFirework)
+BAR_COUNT = 5
+BAR_LEN = 10
+BAR_GAP = 5
+
+WHITE = np.array([255, 255, 255], dtype=np.uint16)
+
+
+def scale8(color, scale):
+    """CRGB::nscale8: 每个通道 (c * (scale + 1)) >> 8"""
+    return ((color.astype(np.uint16) * (np.asarray(scale, np.uint16)[..., None] + 1)) >> 8)
+
+
+def blend(color1, color2, amount):
+    """FastLED blend(): 每个通道 blend8(a, b, amount)"""
+    a = np.asarray(color1, np.int32)
+    b = np.asarray(color2, np.int32)
+    amount = np.asarray(amount, np.int32)[..., None]
+    return (a * 256 + b + (b - a) * amount) >> 8
+
+
+def ratio8(numerator, denominator, scale=255):
+    """uint8_t(float(n) / float(d) * scale)；0/0 按 0 处理"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.float32(numerator) / np.float32(denominator)
+    ratio = np.nan_to_num(ratio, nan=0.0, posinf=0.0, neginf=0.0).astype(np.float32)
+    return (ratio * np.float32(scale)).astype(np.uint8)
+
+
+class Rendering:
+    """渲染结果: frames 为 (帧数, 280, 3) uint8，times 为每帧 FastLED.show() 的时刻(秒)"""
+
+    def __init__(self, frames, times, duration):
+        self.frames = frames
+        self.times = times
+        self.duration = duration
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame_at(self, t):
+        """t 秒时灯带上显示的帧"""
+        index = np.searchsorted(self.times, t, side='right') - 1
+        if index < 0:
+            return np.zeros((TOTAL_LED_COUNT, 3), np.uint8)
+        return self.frames[index]
+
+
+class _Timeline:
+    """按固件的执行顺序累计时间，记录每一阶段的帧"""
+
+    def __init__(self, delay, start_ms):
+        self.delay = delay
+        self.start_ms = start_ms
+        self.t = PLAY_OVERHEAD
+        self.frames = []
+        self.times = []
+
+    def millis(self, count):
+        """接下来 count 帧开始绘制时的 millis()"""
+        starts = self.t + np.arange(count) * (DRAW_TIME + SHOW_TIME + self.delay)
+        return self.start_ms + (starts * 1000).astype(np.int64)
+
+    def steps(self, frames):
+        """绘制 + show + delay 的若干帧"""
+        count = len(frames)
+        step = DRAW_TIME + SHOW_TIME + self.delay
+        self.frames.append(frames)
+        self.times.append(self.t + DRAW_TIME + SHOW_TIME + np.arange(count) * step)
+        self.t += count * step
+
+    def clear(self, pause=0.0):
+        """fill_solid(Black) + show，之后可再 delay"""
+        self.frames.append(np.zeros((1, TOTAL_LED_COUNT, 3), np.uint8))
+        self.times.append(np.array([self.t + SHOW_TIME]))
+        self.t += SHOW_TIME + pause
+
+    def result(self):
+        frames = np.concatenate(self.frames) if self.frames else \
+            np.zeros((0, TOTAL_LED_COUNT, 3), np.uint8)
+        times = np.concatenate(self.times) if self.times else np.zeros(0)
+        return Rendering(frames, times, self.t)
+
+
+def _paint(count, index, colors, mask=None):
+    """生成 count 帧: 第 f 帧的 leds[index[f, j]] = colors[f, j]，越界或 mask 为 False 的跳过"""
+    frames = np.zeros((count, TOTAL_LED_COUNT, 3), np.uint8)
+    index = np.broadcast_to(index, (count, index.shape[-1]))
+    valid = (index >= 0) & (index < TOTAL_LED_COUNT)
+    if mask is not None:
+        valid = valid & mask
+    rows = np.broadcast_to(np.arange(count)[:, None], index.shape)
+    colors = np.broadcast_to(colors, index.shape + (3,))
+    frames[rows[valid], index[valid]] = colors[valid]
+    return frames
+
+
+def _ascend_strip(positions, max_brightness, strip_len=ASCEND_STRIP_LEN):
+    """drawAscendFrame: [pos, pos+stripLen-1] 尾暗头亮的白色条带"""
+    positions = np.asarray(positions)
+    offsets = np.arange(strip_len)
+    brightness = (np.float32(max_brightness) *
+                  (offsets.astype(np.float32) / np.float32(strip_len - 1))).astype(np.uint8)
+    return _paint(len(positions), positions[:, None] + offsets, scale8(WHITE, brightness))
+
+
+def _ascend_bars(max_brightness):
+    """multipleShortBarsWithGapsAscend: 5 段尾暗头亮的短条带一起上升"""
+    total = BAR_COUNT * BAR_LEN + (BAR_COUNT - 1) * BAR_GAP
+    positions = np.arange(TOTAL_LED_COUNT - total + 1)
+    i = np.tile(np.arange(BAR_LEN), BAR_COUNT)
+    offsets = np.repeat(np.arange(BAR_COUNT) * (BAR_LEN + BAR_GAP), BAR_LEN) + i
+    brightness = (np.float32(max_brightness) *
+                  (i.astype(np.float32) / np.float32(BAR_LEN - 1))).astype(np.uint8)
+    return _paint(len(positions), positions[:, None] + offsets, scale8(WHITE, brightness))
+
+
+def render_launch(effect, timeline):
+    top_limit = TOTAL_LED_COUNT - ASCEND_STRIP_LEN
+    if effect.launch_mode == LaunchMode.NORMAL_ASCEND:
+        timeline.steps(_ascend_strip(np.arange(top_limit + 1), effect.max_brightness))
+    elif effect.launch_mode == LaunchMode.STEP_ASCEND:
+        timeline.steps(_ascend_bars(effect.max_brightness))
+    else:
+        timeline.steps(_ascend_strip(pendulum_positions(top_limit), effect.max_brightness))
+        timeline.clear(PENDULUM_PAUSE)
+
+
+def render_explosion(effect, timeline, rng):
+    """explodeFirework: 先从顶端延长条带，再整体向下移动 volume 步"""
+    strip_len = effect.explosion_led_count
+    volume = effect.mirror_angle  # 固件把镜子角度当作移动范围
+    start = TOTAL_LED_COUNT - 1
+    end = TOTAL_LED_COUNT - volume
+    explode, gradient = effect.explode_mode, effect.gradient_mode
+    c1 = np.array(effect.color1)
+    c2 = np.array(effect.color2)
+    i = np.arange(strip_len)
+
+    if gradient == GradientMode.GRADIENT:
+        # 条带内部 color1 -> color2
+        strip_colors = blend(c1, c2, ratio8(i, strip_len - 1))
+    elif gradient == GradientMode.FADE:
+        # 头亮尾暗，颜色随移动进度整体渐变
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fade = np.float32(1.0) - i.astype(np.float32) / np.float32(strip_len - 1)
+        fade = (np.nan_to_num(fade, nan=0.0, neginf=0.0) * np.float32(255)).astype(np.uint8)
+
+    def colors(count, progress=None):
+        """每帧每个像素的颜色 (count, strip_len, 3)"""
+        if gradient == GradientMode.GRADIENT:
+            return np.broadcast_to(strip_colors, (count, strip_len, 3))
+        if gradient == GradientMode.FADE:
+            base = blend(c1, c2, progress if progress is not None else np.zeros(count, np.uint8))
+            return scale8(base[:, None, :], np.broadcast_to(fade, (count, strip_len)))
+        millis = timeline.millis(count)
+        switch = ((millis // SWITCH_INTERVAL) % 2 == 0)[:, None]
+        return np.broadcast_to(np.where(switch, c1, c2)[:, None, :], (count, strip_len, 3))
+
+    def blink_mask(count):
+        return ((timeline.millis(count) % (BLINK_INTERVAL * 2)) < BLINK_INTERVAL)[:, None]
+
+    # 1. 条带逐步延长 (随机闪烁没有这一阶段)
+    if explode != ExplodeMode.RANDOM and strip_len > 0:
+        grow = np.arange(1, strip_len + 1)
+        mask = i[None, :] < grow[:, None]
+        if explode == ExplodeMode.BLINK:
+            mask = mask & blink_mask(strip_len)
+        timeline.steps(_paint(strip_len, start - i, colors(strip_len), mask))
+
+    # 2. 固定长度的条带从顶端向下移动；普通移动不含 endPos 这一步
+    last = end + 1 if explode == ExplodeMode.NORMAL else end
+    positions = np.arange(start, last - 1, -1)
+    count = len(positions)
+    if count:
+        progress = ratio8(start - positions, start - end)
+        if explode == ExplodeMode.RANDOM:
+            mask = rng.random((count, strip_len)) < 0.5
+        elif explode == ExplodeMode.BLINK:
+            mask = blink_mask(count)
+        else:
+            mask = None
+        timeline.steps(_paint(count, positions[:, None] - i, colors(count, progress), mask))
+
+    # explosionFadeRandom 结束时不清屏
+    if not (explode == ExplodeMode.RANDOM and gradient == GradientMode.FADE):
+        timeline.clear()
+
+
+def render(effect, seed=None, start_ms=0):
+    """渲染 playEffect(effect) 的完整动画 (发射 + 爆炸)"""
+    # 固件的 speedDelay 参数是 uint8_t
+    timeline = _Timeline((effect.speed_delay & 0xFF) / 1000, start_ms)
+    render_launch(effect, timeline)
+    render_explosion(effect, timeline, np.random.default_rng(seed))
+    return timeline.result()
+
+
+if __name__ == "__main__":
+    from effect_library import MappedEffectStore
+
+    store = MappedEffectStore(sys.argv[1])
+    effects = store.load()
+    for effect_id in effects:
+        rendering = render(effects[effect_id])
+        print(f"{effect_id:6}: {len(rendering):5} frames, {rendering.duration:7.3f} s")
+    store.close()
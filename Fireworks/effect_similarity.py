@@ -0,0 +1,303 @@
+"""近似重复效果的检测
+
+面板上保存的效果常常与库中已有的几乎一样。两个效果"近似重复"指四个模式完全相同，
+且每个数值特征(两个颜色的 RGB、亮度、镜子角度、爆炸 LED 数、延迟)之差都不超过
+TOLERANCES 中的容差。
+
+查找用 LSH: 每张哈希表取模式加 SUBSET_SIZE 个数值特征，按 2 倍容差的网格(每张表
+随机平移)量化成桶键；容差内的两个效果在每个特征上至少有一半概率落入同一格，
+TABLES 张表中任一张同桶即为候选，再逐个精确校验。一次查找只看几个桶，与库大小无关。
+
+from_columns() 由列式副本整列计算桶键，已有的库存成每张表按桶键排序的数组(查找时二分)，
+不必逐个解码效果、逐个放进字典；之后 add() 的效果放在字典桶中。
+
+find_duplicates() 对整个库做一次去重: 有 NumPy 时对列式副本整列计算桶键、排序分组，
+同桶的每一对都向量化校验，结果与按ID顺序逐个保存、遇到重复就跳过相同。
+大量效果挤在少数桶里时(平均每个效果的同桶候选对超过 MAX_PAIRS_PER_EFFECT)成对校验
+比逐个查找还慢，这时改为逐个查找，结果不变。
+"""
+import logging
+import random
+from collections import defaultdict
+
+from effect_columns import EffectColumns
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+# 模式字段，近似重复要求完全相同；每个取值 0..3，各占 2 位
+MODE_FEATURES = ('launch_mode', 'gradient_mode', 'explode_mode', 'laser_color')
+# 数值特征 -> 容差(含)
+TOLERANCES = {
+    'r1': 24, 'g1': 24, 'b1': 24,
+    'r2': 24, 'g2': 24, 'b2': 24,
+    'max_brightness': 24,
+    'mirror_angle': 10,
+    'explosion_led_count': 10,
+    'speed_delay': 3,
+}
+# 保存时遇到近似重复: 照常保存 / 保存并记录 / 不保存(并入已有效果)
+DUPLICATES_ALLOW = 'allow'
+DUPLICATES_FLAG = 'flag'
+DUPLICATES_MERGE = 'merge'
+# 哈希表数与每张表使用的数值特征数
+TABLES = 12
+SUBSET_SIZE = 3
+# 批量去重时平均每个效果(各表合计)的同桶候选对上限，超过时改为逐个查找
+MAX_PAIRS_PER_EFFECT = 128
+SEED = 0x5EED
+
+log = logging.getLogger(__name__)
+
+
+def effect_features(effect):
+    """FireworkEffect -> (模式元组, 数值特征元组)"""
+    c1, c2 = effect.color1, effect.color2
+    return ((int(effect.launch_mode), int(effect.gradient_mode),
+             int(effect.explode_mode), int(effect.laser_color)),
+            (c1[0], c1[1], c1[2], c2[0], c2[1], c2[2], effect.max_brightness,
+             effect.mirror_angle, effect.explosion_led_count, effect.speed_delay))
+
+
+class SimilarityIndex:
+    """近似重复效果的 LSH 索引: add() 加入已保存的效果，find() 查找与之近似重复的效果"""
+
+    def __init__(self, tolerances=None, tables=TABLES, subset_size=SUBSET_SIZE, seed=SEED):
+        self.tolerances = dict(TOLERANCES, **(tolerances or {}))
+        self.options = {'tables': tables, 'subset_size': subset_size, 'seed': seed}
+        self.names = tuple(TOLERANCES)
+        self.limits = tuple(self.tolerances[name] for name in self.names)
+        rng = random.Random(seed)
+        dims = range(len(self.names))
+        # 每张表: [(特征序号, 网格宽度, 平移量), ...]
+        self.hashes = []
+        for _ in range(tables):
+            subset = sorted(rng.sample(dims, subset_size))
+            self.hashes.append(tuple(
+                (d, 2 * self.limits[d] + 1, rng.randrange(2 * self.limits[d] + 1))
+                for d in subset))
+        self.buckets = [defaultdict(list) for _ in range(tables)]
+        self.features = {}  # 效果ID -> (模式, 数值特征)
+        # from_columns 建立的基底: 每张表 (排序的桶键, 对应的效果ID)，与按ID排序的数值特征
+        self.base_tables = []
+        self.base_ids = None
+        self.base_values = None
+        self.base_removed = set()  # 基底中已删除或被 add() 覆盖的ID
+
+    def __len__(self):
+        base = 0 if self.base_ids is None else len(self.base_ids) - len(self.base_removed)
+        return len(self.features) + base
+
+    @classmethod
+    def from_effects(cls, effects, **kwargs):
+        index = cls(**kwargs)
+        for effect_id, effect in effects.items():
+            index.add(effect_id, effect)
+        return index
+
+    @classmethod
+    def from_columns(cls, columns, **kwargs):
+        """由 EffectColumns 整列建立索引 (没有 NumPy 时逐个加入)"""
+        index = cls(**kwargs)
+        if np is None:
+            for effect in columns.effects():
+                index.add(effect.id, effect)
+            return index
+        ids = columns.column('id').astype(np.int64)
+        keys, values = index._column_keys(columns)
+        for key in keys:
+            order = np.argsort(key, kind='stable')
+            index.base_tables.append((key[order], ids[order]))
+        by_id = np.argsort(ids, kind='stable')
+        index.base_ids = ids[by_id]
+        index.base_values = np.stack(values, axis=1)[by_id]
+        return index
+
+    def _base_row(self, effect_id):
+        """基底中 effect_id 所在的行；不在基底或已删除时返回 None"""
+        if self.base_ids is None or effect_id in self.base_removed:
+            return None
+        row = int(np.searchsorted(self.base_ids, effect_id))
+        if row < len(self.base_ids) and self.base_ids[row] == effect_id:
+            return row
+        return None
+
+    def _keys(self, modes, values):
+        mode_key = modes[0] | modes[1] << 2 | modes[2] << 4 | modes[3] << 6
+        keys = []
+        for spec in self.hashes:
+            key = mode_key
+            for d, width, shift in spec:
+                key = key << 16 | (values[d] + shift) // width
+            keys.append(key)
+        return keys
+
+    def add(self, effect_id, effect):
+        effect_id = int(effect_id)
+        self.remove(effect_id)
+        modes, values = effect_features(effect)
+        self.features[effect_id] = (modes, values)
+        for buckets, key in zip(self.buckets, self._keys(modes, values)):
+            buckets[key].append(effect_id)
+
+    def remove(self, effect_id):
+        effect_id = int(effect_id)
+        entry = self.features.pop(effect_id, None)
+        if entry is None:
+            if self._base_row(effect_id) is not None:
+                self.base_removed.add(effect_id)
+            return
+        for buckets, key in zip(self.buckets, self._keys(*entry)):
+            bucket = buckets[key]
+            bucket.remove(effect_id)
+            if not bucket:
+                del buckets[key]
+
+    def similar(self, modes, values, other):
+        return modes == other[0] and all(
+            abs(a - b) <= limit for a, b, limit in zip(values, other[1], self.limits))
+
+    def find_all(self, effect):
+        """与 effect 近似重复的全部已加入效果的ID，按ID排序"""
+        modes, values = effect_features(effect)
+        keys = self._keys(modes, values)
+        candidates = set()
+        for buckets, key in zip(self.buckets, keys):
+            bucket = buckets.get(key)
+            if bucket:
+                candidates.update(bucket)
+        features = self.features
+        matches = [effect_id for effect_id in candidates
+                   if self.similar(modes, values, features[effect_id])]
+        if self.base_tables:
+            matches.extend(self._find_base(keys, values))
+        return sorted(matches)
+
+    def _find_base(self, keys, values):
+        """基底中与之近似重复的ID (同桶即模式相同，只校验数值特征)"""
+        found = []
+        for (sorted_key, key_ids), key in zip(self.base_tables, keys):
+            lo = sorted_key.searchsorted(key, 'left')
+            hi = sorted_key.searchsorted(key, 'right')
+            if lo < hi:
+                found.append(key_ids[lo:hi])
+        if not found:
+            return []
+        candidates = np.unique(np.concatenate(found))
+        rows = np.searchsorted(self.base_ids, candidates)
+        ok = (np.abs(self.base_values[rows] - np.asarray(values)) <=
+              np.asarray(self.limits)).all(axis=1)
+        return [effect_id for effect_id in candidates[ok].tolist()
+                if effect_id not in self.base_removed]
+
+    def find(self, effect):
+        """ID最小的近似重复效果；没有时返回 None"""
+        matches = self.find_all(effect)
+        return matches[0] if matches else None
+
+    # ---------- 批量去重 ----------
+
+    def _column_keys(self, columns):
+        """整列计算各表的桶键 (int64 数组)"""
+        modes = [columns.column(name).astype(np.int64) for name in MODE_FEATURES]
+        mode_key = modes[0] | modes[1] << 2 | modes[2] << 4 | modes[3] << 6
+        values = [columns.column(name).astype(np.int32) for name in self.names]
+        keys = []
+        for spec in self.hashes:
+            key = mode_key.copy()
+            for d, width, shift in spec:
+                key = key << 16 | (values[d] + shift) // width
+            keys.append(key)
+        return keys, values
+
+    @staticmethod
+    def _buckets(key):
+        """按桶键排序: (排序后的行号, 每个位置在桶内的序号, 每个位置所在桶的大小)"""
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+        sizes = np.diff(np.r_[starts, len(order)])
+        position = np.arange(len(order)) - np.repeat(starts, sizes)
+        return order, position, np.repeat(sizes, sizes)
+
+    def _similar_pairs(self, buckets, values):
+        """各表中同桶且确实近似重复的 (行, 行) 对；同桶的每一对都校验，逐批进行不整体保留
+
+        桶键含全部模式，同桶即模式相同，只需校验数值特征。
+        """
+        found_lo, found_hi = [], []
+        for order, position, size in buckets:
+            # 第 shift 轮把每个位置与桶内其后第 shift 个比较，桶内没有那么多的位置退出
+            live = np.flatnonzero(size - position > 1)
+            shift = 1
+            while len(live):
+                a, b = order[live], order[live + shift]
+                # 逐列筛掉，随机的候选对大多在第一列就被排除
+                for col, limit in zip(values, self.limits):
+                    ok = np.abs(col[a] - col[b]) <= limit
+                    a, b = a[ok], b[ok]
+                found_lo.append(a)
+                found_hi.append(b)
+                shift += 1
+                live = live[size[live] - position[live] > shift]
+        return np.concatenate(found_lo), np.concatenate(found_hi)
+
+    def duplicates_in(self, columns):
+        """对 EffectColumns 去重，返回 {重复效果ID: 保留的效果ID}"""
+        if np is None:
+            return self._duplicates_sequential(columns)
+        ids = columns.column('id').astype(np.int64)
+        if not len(ids):
+            return {}
+        keys, values = self._column_keys(columns)
+        buckets = [self._buckets(key) for key in keys]
+        candidates = sum(int(position.sum()) for _, position, _ in buckets)
+        if candidates > MAX_PAIRS_PER_EFFECT * len(ids):
+            log.info("%d candidate pairs in crowded buckets, deduplicating one by one",
+                     candidates)
+            return self._duplicates_sequential(columns)
+        lo, hi = self._similar_pairs(buckets, values)
+        # 每对按ID排成 lo 在前并去掉各表重复找到的
+        swap = ids[lo] > ids[hi]
+        lo, hi = np.where(swap, hi, lo), np.where(swap, lo, hi)
+        pairs = np.unique(lo * len(ids) + hi)
+        lo, hi = pairs // len(ids), pairs % len(ids)
+
+        # 按ID顺序贪心: 有已保留的更小ID邻居即为重复，否则保留；每轮至少决定一批
+        UNDECIDED, KEPT, DUPLICATE = 0, 1, 2
+        state = np.zeros(len(ids), dtype=np.int8)
+        while True:
+            undecided = state == UNDECIDED
+            if not undecided.any():
+                break
+            has_kept = np.zeros(len(ids), dtype=bool)
+            has_kept[hi[state[lo] == KEPT]] = True
+            state[undecided & has_kept] = DUPLICATE
+            blocked = np.zeros(len(ids), dtype=bool)
+            blocked[hi[state[lo] == UNDECIDED]] = True
+            state[(state == UNDECIDED) & ~blocked] = KEPT
+        kept_edge = (state[lo] == KEPT) & (state[hi] == DUPLICATE)
+        representative = np.full(len(ids), np.iinfo(np.int64).max)
+        np.minimum.at(representative, hi[kept_edge], ids[lo[kept_edge]])
+        rows = np.flatnonzero(state == DUPLICATE)
+        return dict(zip(ids[rows].tolist(), representative[rows].tolist()))
+
+    def _duplicates_sequential(self, columns):
+        """没有 NumPy 时按ID顺序逐个查找、加入"""
+        index = SimilarityIndex(self.tolerances, **self.options)
+        duplicates = {}
+        for effect in sorted(columns.effects(), key=lambda e: e.id):
+            match = index.find(effect)
+            if match is None:
+                index.add(effect.id, effect)
+            else:
+                duplicates[effect.id] = match
+        return duplicates
+
+
+def find_duplicates(effects, **kwargs):
+    """效果库 (ID -> FireworkEffect 或 EffectColumns) 中的近似重复: {重复效果ID: 保留的效果ID}"""
+    columns = effects if isinstance(effects, EffectColumns) else EffectColumns.from_effects(effects)
+    return SimilarityIndex(**kwargs).duplicates_in(columns)
@@ -0,0 +1,213 @@
+import json
+import logging
+import os
+from datetime import datetime
+
+from effect_backup import BACKUP_RETENTION, BackupWorker
+from metrics import REGISTRY
+
+# 日志累计多少条记录后压缩成新快照
+COMPACT_EVERY = 200
+
+SAVE_SECONDS = REGISTRY.histogram('fireworks_save_seconds', '追加保存一个效果(写日志 + fsync)的耗时')
+COMPACT_SECONDS = REGISTRY.histogram('fireworks_compact_seconds', '压缩成新快照的耗时(不含后台备份)')
+
+log = logging.getLogger(__name__)
+
+
+def max_effect_id(effects):
+    """效果字典中的最大ID(空时为 0)；LazyEffectLibrary 不必遍历"""
+    max_id = getattr(effects, 'max_id', None)
+    return max_id() if max_id else max(effects, default=0)
+
+
+class EffectStore:
+    """效果数据的 快照 + 追加日志 存储
+
+    - 快照: effects_data.json，格式与旧版 save_to_file 相同，整体原子替换
+    - 日志: effects_data.journal，每保存一个效果追加一行 JSON 并 fsync；压缩后的日志以
+      {"next_id": N} 开头，记下分配过的最大ID，删除的效果ID重启后也不会复用
+    - 备份: 压缩后交给后台的 BackupWorker，按时间保留压缩的增量备份 (见 effect_backup)
+    - 隔离: 解码失败(如字段超出范围)的记录逐条跳过，原样追加到 effects_data.quarantine，
+      一条坏记录不会让整个效果库加载失败
+
+    子类可覆盖 read_snapshot / write_snapshot / replace_snapshot 换用其他快照格式，
+    并覆盖 read_records / decode_record 供备份逐条比较与恢复。
+    """
+    SNAPSHOT_EXT = '.json'
+
+    def __init__(self, data_dir, backup_dir=None, retention=BACKUP_RETENTION,
+                 compact_every=COMPACT_EVERY, name='effects_data',
+                 encode=None, decode=None, background_backups=True):
+        self.data_dir = data_dir
+        self.backup_dir = backup_dir or os.path.join(data_dir, 'backups')
+        self.snapshot_file = os.path.join(data_dir, name + self.SNAPSHOT_EXT)
+        self.journal_file = os.path.join(data_dir, f"{name}.journal")
+        self.quarantine_file = os.path.join(data_dir, f"{name}.quarantine")
+        self.name = name
+        self.compact_every = compact_every
+        self.journal_records = 0
+        self.quarantined = 0
+        self.next_id = 1  # 效果ID 的高水位: 下一个可分配的ID
+        self._journal = None
+        # 效果对象 <-> JSON 字典 的转换，默认原样存取
+        self.encode = encode or (lambda effect: effect)
+        self.decode = decode or (lambda data: data)
+        os.makedirs(self.data_dir, exist_ok=True)
+        os.makedirs(self.backup_dir, exist_ok=True)
+        # 备份列表来自备份目录中的索引文件，不再扫描目录
+        self.backup = BackupWorker(self, self.backup_dir, retention=retention,
+                                   background=background_backups)
+
+    def read_json_snapshot(self, path):
+        """读取 JSON 快照，返回 {效果ID(int): 效果} 字典"""
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            records = json.load(f).get('effects', {})
+        effects = {}
+        for k, v in records.items():
+            # JSON 的键总是字符串，统一还原为 int 效果ID
+            effect = self.decode_checked(int(k), v)
+            if effect is not None:
+                effects[int(k)] = effect
+        return effects
+
+    def read_snapshot(self):
+        return self.read_json_snapshot(self.snapshot_file)
+
+    def read_records(self, path):
+        """快照文件 -> {效果ID: 原始记录字节}，供备份比较；记录字节相同即效果相同"""
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return {int(k): json.dumps(v, separators=(',', ':'), sort_keys=True).encode()
+                    for k, v in json.load(f).get('effects', {}).items()}
+
+    def decode_record(self, effect_id, raw):
+        return self.decode(json.loads(raw))
+
+    def decode_checked(self, effect_id, data):
+        """解码一条记录；失败时隔离该记录并返回 None"""
+        try:
+            return self.decode(data)
+        except (ValueError, KeyError, TypeError) as e:
+            self.quarantine(effect_id, data, e)
+            return None
+
+    def quarantine(self, effect_id, data, error):
+        """把无法解码的记录追加到隔离文件(库文件的原始记录存为十六进制)"""
+        self.quarantined += 1
+        log.warning("Quarantined invalid effect %s: %s", effect_id, error)
+        if isinstance(data, bytes):
+            data = data.hex()
+        with open(self.quarantine_file, 'a') as f:
+            f.write(json.dumps({'id': effect_id, 'error': str(error), 'record': data},
+                               separators=(',', ':')) + '\n')
+
+    def restore_backup(self, file=None):
+        """某个备份(默认最新)时刻的 {效果ID: 效果}"""
+        self.backup.flush()
+        return {effect_id: self.decode_record(effect_id, raw)
+                for effect_id, raw in self.backup.restore(file).items()}
+
+    def write_snapshot(self, path, effects):
+        with open(path, 'w') as f:
+            json.dump({
+                'last_updated': datetime.now().isoformat(),
+                'effects_count': len(effects),
+                'effects': {k: self.encode(v) for k, v in effects.items()}
+            }, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replace_snapshot(self, tmp_file):
+        os.replace(tmp_file, self.snapshot_file)
+
+    def load(self):
+        """读取快照并重放日志，返回 {效果ID(int): 效果} 映射"""
+        effects = self.read_snapshot()
+        self.journal_records = 0
+        self.next_id = 1
+        if os.path.exists(self.journal_file):
+            for effect_id, data in self.replay_journal():
+                self.journal_records += 1
+                self.next_id = max(self.next_id, effect_id + 1)
+                effect = self.decode_checked(effect_id, data)
+                if effect is not None:
+                    effects[effect_id] = effect
+        self.next_id = max(self.next_id, max_effect_id(effects) + 1)
+        return effects
+
+    def replay_journal(self):
+        """逐行读取日志，产出 (效果ID, 效果字典)
+
+        中间损坏的行跳过并记录警告；崩溃时最后一行可能只写了一半(没有换行)，
+        把日志截断到最后一个完整行的末尾，之后的追加从新的一行开始。
+        """
+        good_end = 0
+        with open(self.journal_file, 'rb+') as f:
+            for lineno, line in enumerate(f, 1):
+                complete = line.endswith(b'\n')
+                try:
+                    record = json.loads(line)
+                    if 'next_id' in record:
+                        self.next_id = max(self.next_id, int(record['next_id']))
+                        effect_id = None
+                    else:
+                        effect_id, data = int(record['id']), record['effect']
+                except (ValueError, KeyError, TypeError):
+                    if complete:
+                        log.warning("Skipping corrupt line %d in %s", lineno, self.journal_file)
+                        good_end += len(line)
+                        continue
+                    log.warning("Truncating torn last line (%d bytes) of %s",
+                                len(line), self.journal_file)
+                    f.truncate(good_end)
+                    break
+                if not complete:
+                    # 记录完整、只差换行: 补上换行，免得下一条追加接在同一行
+                    f.write(b'\n')
+                good_end += len(line) + (not complete)
+                if effect_id is not None:
+                    yield effect_id, data
+
+    def append(self, effect_id, effect):
+        """追加一条效果记录并落盘，返回是否需要压缩"""
+        with SAVE_SECONDS.time():
+            if self._journal is None:
+                self._journal = open(self.journal_file, 'a')
+            self._journal.write(json.dumps({'id': effect_id, 'effect': self.encode(effect)},
+                                           separators=(',', ':')) + '\n')
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+        self.journal_records += 1
+        self.next_id = max(self.next_id, effect_id + 1)
+        return self.journal_records >= self.compact_every
+
+    def compact(self, effects, next_id=None):
+        """把全部效果写成新快照(原子替换)并清空日志；新快照交给后台备份
+
+        清空后的日志只有一行ID高水位 (next_id 为调用方已分配到的ID，取两者较大者)。
+        """
+        with COMPACT_SECONDS.time():
+            tmp_file = self.snapshot_file + '.tmp'
+            self.write_snapshot(tmp_file, effects)
+            self.replace_snapshot(tmp_file)
+            self.backup.schedule()
+
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self.next_id = max(self.next_id, next_id or 1, max_effect_id(effects) + 1)
+        with open(self.journal_file, 'w') as f:
+            f.write(json.dumps({'next_id': self.next_id}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_records = 0
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self.backup.close()
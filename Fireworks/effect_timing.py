@@ -0,0 +1,91 @@
+"""根据效果参数预测 v2 固件播放一个效果的时长
+
+帧数按 v2/B_ASCEND_EFFECTS.ino 与 v2/B_EXPLOSION_EFFECTS.ino 中的循环计算，
+每帧 = 绘制 + FastLED.show() + delay(speedDelay)。
+"""
+from effect_model import TOTAL_LED_COUNT, LaunchMode, ExplodeMode, GradientMode
+
+# WS2812: 每颗 LED 24 bit，每 bit 1.25 us，另加 50 us 复位
+SHOW_TIME = TOTAL_LED_COUNT * 24 * 1.25e-6 + 50e-6
+# 每帧绘制的计算开销(秒)，粗略估计；实际偏差由 ShowPipeline 按回执校正
+DRAW_TIME = 0.0005
+# 解析命令与打印调试信息的固定开销(秒)
+PLAY_OVERHEAD = 0.02
+# 文本 P 命令中 Serial.parseInt 每个字段的处理开销(秒)
+PARSE_TIME_PER_FIELD = 0.0002
+
+# 上升效果的固定参数 (见 Z_Utils.ino launchFirework)
+ASCEND_STRIP_LEN = 30
+BARS_TOTAL_LEN = 5 * 10 + 4 * 5
+PENDULUM_FORWARD = 50
+PENDULUM_BACKWARD = 10
+PENDULUM_PAUSE = 2.0
+
+
+def pendulum_positions(top_limit):
+    """pendulumAscend 每帧的条带位置: 前进 50 步、后退 10 步，直到顶端"""
+    positions = []
+    pos = 0
+    while pos < top_limit:
+        target = min(pos + PENDULUM_FORWARD, top_limit)
+        positions.extend(range(pos, target + 1))
+        pos = target
+        if pos >= top_limit:
+            break
+        target = max(pos - PENDULUM_BACKWARD, 0)
+        positions.extend(range(pos, target - 1, -1))
+        pos = target
+    return positions
+
+
+# 发射模式 -> 带 delay 的帧数
+LAUNCH_FRAMES = {
+    LaunchMode.NORMAL_ASCEND: TOTAL_LED_COUNT - ASCEND_STRIP_LEN + 1,
+    LaunchMode.STEP_ASCEND: TOTAL_LED_COUNT - BARS_TOTAL_LEN + 1,
+    LaunchMode.PENDULUM_ASCEND: len(pendulum_positions(TOTAL_LED_COUNT - ASCEND_STRIP_LEN)),
+}
+
+
+def explosion_frames(explode_mode, gradient_mode, strip_len, volume):
+    """爆炸阶段 (带 delay 的帧数, 末尾不带 delay 的清屏次数)
+
+    固件把镜子角度当作条带移动范围 volume 传入，条带长度为爆炸 LED 数。
+    """
+    grow = max(0, strip_len)
+    if explode_mode == ExplodeMode.NORMAL:
+        # for (pos = startPos; pos > endPos; pos--)
+        return grow + max(0, volume - 1), 1
+    if explode_mode == ExplodeMode.RANDOM:
+        # 没有条带延长阶段；explosionFadeRandom 结束时不清屏
+        return max(0, volume), 0 if gradient_mode == GradientMode.FADE else 1
+    return grow + max(0, volume), 1
+
+
+def predict_duration(effect):
+    """预测播放 effect 所需的秒数"""
+    return predict_fields_duration(effect.launch_mode, effect.gradient_mode, effect.explode_mode,
+                                   effect.mirror_angle, effect.explosion_led_count,
+                                   effect.speed_delay)
+
+
+def predict_fields_duration(launch_mode, gradient_mode, explode_mode, mirror_angle,
+                            explosion_led_count, speed_delay):
+    """按 P 命令的字段(整数)预测播放秒数，不必先构造 FireworkEffect"""
+    # 固件的 speedDelay 参数是 uint8_t
+    delay = (speed_delay & 0xFF) / 1000
+    frame = delay + SHOW_TIME + DRAW_TIME
+    frames, clears = explosion_frames(explode_mode, gradient_mode,
+                                      explosion_led_count, mirror_angle)
+    frames += LAUNCH_FRAMES[launch_mode]
+    duration = PLAY_OVERHEAD + frames * frame + clears * SHOW_TIME
+    if launch_mode == LaunchMode.PENDULUM_ASCEND:
+        duration += SHOW_TIME + PENDULUM_PAUSE
+    return duration
+
+
+def command_latency(data, baudrate, text=True):
+    """P 命令开始写出到固件开始播放的秒数: 线路上每字节 10 bit，文本命令另加逐字段解析"""
+    latency = len(data) * 10 / baudrate
+    if text:
+        latency += PARSE_TIME_PER_FIELD * data.count(b',')
+    return latency
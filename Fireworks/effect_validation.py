@@ -0,0 +1,437 @@
+"""按固件的实际限制批量检查效果库，并预测每个效果的播放时长
+
+检查项见 ISSUES，依据 v2 固件:
+    - ExplosionParams / AscendParams 的 speedDelay、maxBrightness 是 uint8_t，超出部分被截断
+    - 镜子角度即爆炸条带的移动范围(舵机 0..180)，爆炸 LED 数即条带长度(不超过 TOTAL_LED_COUNT)
+    - 条带长度为 1 时 float(i) / float(stripLen - 1) 是 0/0；FADE 模式的 RANDOM/BLINK 爆炸
+      移动范围为 1 时 colorProgress 也是 0/0，NaN 转 uint8_t 的颜色未定义
+    - 模式取值不在枚举内时 FireworkEffect 解码出错，固件的 switch 什么也不播
+
+库文件按块分给 ProcessPoolExecutor 的各个进程: .lib 库文件按记录序号切分，各进程自己
+映射文件读取；effects_data.json 按字节切分在记录边界上，各进程自己解析自己那一段。
+主进程只规划分块、合并各块的计数与时长直方图，几乎没有串行部分，耗时随核数近线性下降。
+
+    python effect_validation.py data/ --workers 8 --json report.json
+"""
+import json
+import mmap
+import operator
+import os
+import re
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from heapq import nlargest
+
+from effect_library import HEADER, LIBRARY_VERSION, MAGIC, RECORD
+from effect_model import TOTAL_LED_COUNT, ExplodeMode, GradientMode, LaunchMode, LaserColor
+from effect_store import EffectStore
+from effect_timing import predict_fields_duration
+
+ERROR = 'error'
+WARNING = 'warning'
+# 问题代号 -> (级别, 说明)
+ISSUES = {
+    'malformed': (ERROR, "记录缺少字段或字段不是整数"),
+    'unknown_mode': (ERROR, "模式取值不在枚举内，解码出错且固件不播放"),
+    'color_range': (ERROR, "颜色分量超出 0..255"),
+    'brightness_range': (ERROR, "maxBrightness 超出 uint8_t"),
+    'speed_delay_range': (ERROR, "speedDelay 超出 uint8_t，固件只取低 8 位"),
+    'mirror_angle_range': (ERROR, "镜子角度超出舵机范围 0..180"),
+    'led_count_range': (ERROR, f"爆炸 LED 数超出 0..{TOTAL_LED_COUNT}"),
+    'zero_division': (ERROR, "固件中出现 0/0，颜色未定义"),
+    'dark_launch': (WARNING, "maxBrightness 为 0，上升阶段看不见"),
+    'empty_explosion': (WARNING, "爆炸阶段不点亮任何 LED"),
+}
+MIRROR_ANGLE_RANGE = (0, 180)
+# 每块的记录数上限；效果少时按 进程数 * CHUNKS_PER_WORKER 均分，便于负载均衡
+CHUNK_RECORDS = 65536
+CHUNKS_PER_WORKER = 4
+# JSON 快照中每条记录的大致字节数，用于按字节切块
+JSON_RECORD_BYTES = 260
+# 时长直方图的分桶宽度(秒)，分位数按桶上沿给出
+DURATION_BIN = 0.1
+# 报告中列出的最长效果数与每种问题的示例ID数
+LONGEST = 10
+EXAMPLES = 20
+
+_MODES = tuple(frozenset(map(int, enum)) for enum in (LaunchMode, GradientMode, ExplodeMode,
+                                                      LaserColor))
+# 随机/定时闪烁爆炸的循环条件为 pos >= endPos
+_INCLUSIVE_EXPLOSIONS = frozenset((ExplodeMode.RANDOM, ExplodeMode.BLINK))
+_DIVIDING_GRADIENTS = frozenset((GradientMode.GRADIENT, GradientMode.FADE))
+_EFFECTS_START = re.compile(rb'"effects"\s*:\s*\{')
+# 效果记录的开头: 纯数字的键，值为对象 (效果内部的键都不是数字)
+_RECORD_START = re.compile(rb'[{,]\s*("-?\d+"\s*:\s*\{)')
+_RECORD_KEY = re.compile(r'\s*"(-?\d+)"\s*:\s*')
+_SEPARATOR = re.compile(r'\s*(,?)\s*')
+
+
+def effect_issues(fields):
+    """P 命令的 14 个整数字段 -> 问题代号列表"""
+    r1, g1, b1, r2, g2, b2, brightness, launch, gradient, explode, laser, \
+        angle, led_count, speed_delay = fields
+    issues = []
+    if not (launch in _MODES[0] and gradient in _MODES[1] and explode in _MODES[2]
+            and laser in _MODES[3]):
+        issues.append('unknown_mode')
+    if min(r1, g1, b1, r2, g2, b2) < 0 or max(r1, g1, b1, r2, g2, b2) > 255:
+        issues.append('color_range')
+    if not 0 <= brightness <= 255:
+        issues.append('brightness_range')
+    elif brightness == 0:
+        issues.append('dark_launch')
+    if not 0 <= speed_delay <= 255:
+        issues.append('speed_delay_range')
+    if not MIRROR_ANGLE_RANGE[0] <= angle <= MIRROR_ANGLE_RANGE[1]:
+        issues.append('mirror_angle_range')
+    if not 0 <= led_count <= TOTAL_LED_COUNT:
+        issues.append('led_count_range')
+    if (led_count == 1 and gradient in _DIVIDING_GRADIENTS) or \
+            (angle == 1 and gradient == GradientMode.FADE and explode in _INCLUSIVE_EXPLOSIONS):
+        issues.append('zero_division')
+    if led_count == 0 or (angle <= 0 and explode == ExplodeMode.RANDOM):
+        issues.append('empty_explosion')
+    return issues
+
+
+def _json_fields(data):
+    c1, c2 = data['color1'], data['color2']
+    return tuple(map(operator.index, (
+        c1['r'], c1['g'], c1['b'], c2['r'], c2['g'], c2['b'], data['maxBrightness'],
+        data['launchMode'], data['gradientMode'], data['explodeMode'], data['laserColor'],
+        data['mirrorAngle'], data['explosionLEDCount'], data['speedDelay'])))
+
+
+class _ChunkResult:
+    """一块记录的检查结果，可跨进程传递并逐个合并"""
+
+    def __init__(self, keep_durations=False):
+        self.effects = 0
+        self.errors = 0
+        self.warnings = 0
+        self.flagged = {}     # 问题代号 -> array('q') 效果ID
+        self.histogram = {}   # 时长分桶 -> 效果数
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.longest = []     # [(秒, 效果ID)]
+        self.ids = array('q') if keep_durations else None
+        self.durations = array('d') if keep_durations else None
+        self.cpu = 0.0        # 各块读取与检查的 CPU 秒数之和
+
+    def check(self, records):
+        """records: (效果ID, 14 个字段 或 None 表示无法解码) 的序列"""
+        flagged, histogram = self.flagged, self.histogram
+        levels = {code: level for code, (level, _) in ISSUES.items()}
+        durations = []
+        for effect_id, fields in records:
+            self.effects += 1
+            issues = ['malformed'] if fields is None else effect_issues(fields)
+            if issues:
+                error = False
+                for code in issues:
+                    ids = flagged.get(code)
+                    if ids is None:
+                        ids = flagged[code] = array('q')
+                    ids.append(effect_id)
+                    error = error or levels[code] == ERROR
+                if error:
+                    self.errors += 1
+                else:
+                    self.warnings += 1
+                if 'malformed' in issues or 'unknown_mode' in issues:
+                    continue
+            seconds = predict_fields_duration(*fields[7:10], *fields[11:])
+            durations.append((seconds, effect_id))
+            bucket = int(seconds / DURATION_BIN)
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        if durations:
+            seconds = [d for d, _ in durations]
+            self.total += sum(seconds)
+            low, high = min(seconds), max(seconds)
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+            self.longest = nlargest(LONGEST, self.longest + nlargest(LONGEST, durations))
+            if self.ids is not None:
+                self.ids.extend(effect_id for _, effect_id in durations)
+                self.durations.extend(seconds)
+        return self
+
+    def merge(self, other):
+        self.effects += other.effects
+        self.errors += other.errors
+        self.warnings += other.warnings
+        for code, ids in other.flagged.items():
+            self.flagged.setdefault(code, array('q')).extend(ids)
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+        self.total += other.total
+        self.cpu += other.cpu
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        self.longest = nlargest(LONGEST, self.longest + other.longest)
+        if self.ids is not None:
+            self.ids.extend(other.ids)
+            self.durations.extend(other.durations)
+        return self
+
+
+# ---------- 各进程执行的分块任务 ----------
+
+def _library_records(path, start, stop, exclude):
+    """库文件第 start..stop 条记录 -> (效果ID, 字段)"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        _, _, count = HEADER.unpack_from(data)
+        ids = array('q')
+        ids.frombytes(data[HEADER.size + start * 8:HEADER.size + stop * 8])
+        base = HEADER.size + count * 8
+        raw = data[base + start * RECORD.size:base + stop * RECORD.size]
+    records = []
+    for effect_id, (*fields, _) in zip(ids, RECORD.iter_unpack(raw)):
+        if effect_id not in exclude:
+            records.append((effect_id, fields))
+    return records
+
+
+def _json_records(path, start, stop, exclude):
+    """JSON 快照中 [start, stop) 字节内的完整记录 -> (效果ID, 字段或 None)"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(stop - start).decode('utf-8')
+    decode = json.JSONDecoder().raw_decode
+    records = []
+    pos = 0
+    while True:
+        match = _RECORD_KEY.match(text, pos)
+        if match is None:
+            break
+        effect_id = int(match.group(1))
+        data, pos = decode(text, match.end())
+        if effect_id not in exclude:
+            try:
+                fields = _json_fields(data)
+            except (KeyError, TypeError):
+                fields = None
+            records.append((effect_id, fields))
+        separator = _SEPARATOR.match(text, pos)
+        pos = separator.end()
+        if not separator.group(1):
+            break  # effects 对象的 '}'
+    return records
+
+
+_READERS = {'lib': _library_records, 'json': _json_records}
+
+# 日志中另有记录、快照中应跳过的效果ID；由进程池的 initializer 在每个进程中设置一次，
+# 不随每个分块任务重复序列化
+_exclude = frozenset()
+
+
+def _set_exclude(exclude):
+    global _exclude
+    _exclude = exclude
+
+
+def _check_chunk(task):
+    kind, path, start, stop, keep_durations = task
+    started = time.process_time()
+    result = _ChunkResult(keep_durations).check(_READERS[kind](path, start, stop, _exclude))
+    result.cpu = time.process_time() - started
+    return result
+
+
+# ---------- 主进程 ----------
+
+def _library_chunks(path, size):
+    with open(path, 'rb') as f:
+        magic, version, count = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != LIBRARY_VERSION:
+        raise ValueError(f"Not an effect library: {path}")
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _json_chunks(path, size):
+    """按约 size 条记录的字节数切分，每个切点后移到下一条记录的开头"""
+    if os.path.getsize(path) == 0:
+        return []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        opening = _EFFECTS_START.search(data)
+        if opening is None:
+            return []
+        first = _RECORD_START.search(data, opening.end() - 1)
+        if first is None:
+            return []
+        step = size * JSON_RECORD_BYTES
+        bounds = [first.start(1)]
+        while True:
+            match = _RECORD_START.search(data, bounds[-1] + step)
+            if match is None:
+                break
+            bounds.append(match.start(1))
+        bounds.append(len(data))
+    return list(zip(bounds, bounds[1:]))
+
+
+def _count_records(path, kind):
+    if kind == 'lib':
+        with open(path, 'rb') as f:
+            return HEADER.unpack(f.read(HEADER.size))[2]
+    return os.path.getsize(path) // JSON_RECORD_BYTES
+
+
+def read_journal(path):
+    """日志中的 {效果ID: 字段或 None}，同一ID以最后一条为准(与 EffectStore.load 相同)"""
+    records = {}
+    if path is None or not os.path.exists(path):
+        return records
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 损坏的行或崩溃时写了一半的最后一行，与 EffectStore.load 一样跳过
+            if 'next_id' in record:
+                continue  # 压缩后写入的ID高水位，不是效果
+            try:
+                records[int(record['id'])] = _json_fields(record['effect'])
+            except (KeyError, TypeError):
+                records[int(record['id'])] = None
+    return records
+
+
+def library_files(data_dir, name='effects_data'):
+    """数据目录中的 (快照文件, 日志文件)；与 MappedEffectStore 一样优先使用 .lib 库文件"""
+    library = os.path.join(data_dir, name + '.lib')
+    snapshot = library if os.path.exists(library) else \
+        os.path.join(data_dir, name + EffectStore.SNAPSHOT_EXT)
+    return snapshot, os.path.join(data_dir, f"{name}.journal")
+
+
+def validate_library(path, journal=None, workers=None, chunk_records=CHUNK_RECORDS,
+                     durations=False):
+    """检查快照文件(.lib 或 .json)及其日志中的全部效果，返回报告字典
+
+    workers 为进程数，默认 os.cpu_count()；为 1 时在本进程内逐块检查。
+    durations 为 True 时报告中另含 'durations': {效果ID: 预测秒数}。
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    overlay = read_journal(journal)
+    exclude = frozenset(overlay)
+    tasks = []
+    if os.path.exists(path):
+        kind = 'lib' if path.endswith('.lib') else 'json'
+        size = max(1, min(chunk_records,
+                          -(-_count_records(path, kind) // (workers * CHUNKS_PER_WORKER))))
+        chunks = _library_chunks(path, size) if kind == 'lib' else _json_chunks(path, size)
+        tasks = [(kind, path, start, stop, durations) for start, stop in chunks]
+
+    result = _ChunkResult(durations)
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks)), initializer=_set_exclude,
+                                 initargs=(exclude,)) as pool:
+            for chunk in pool.map(_check_chunk, tasks):
+                result.merge(chunk)
+    else:
+        _set_exclude(exclude)
+        try:
+            for task in tasks:
+                result.merge(_check_chunk(task))
+        finally:
+            _set_exclude(frozenset())
+    result.merge(_ChunkResult(durations).check(sorted(overlay.items())))
+    report = _report(result)
+    report.update(path=path, workers=workers, chunks=len(tasks),
+                  seconds=time.perf_counter() - started)
+    return report
+
+
+def validate_data_dir(data_dir, name='effects_data', **kwargs):
+    """检查数据目录中的效果库(快照 + 日志)"""
+    return validate_library(*library_files(data_dir, name), **kwargs)
+
+
+def _percentile(histogram, count, fraction):
+    target = fraction * count
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= target:
+            return (bucket + 1) * DURATION_BIN
+    return None
+
+
+def _report(result):
+    timed = sum(result.histogram.values())
+    issues = {code: len(result.flagged[code]) for code in ISSUES if code in result.flagged}
+    report = {
+        'effects': result.effects,
+        'valid': result.effects - result.errors - result.warnings,
+        'errors': result.errors,
+        'warnings': result.warnings,
+        'issues': issues,
+        'flagged': {code: result.flagged[code].tolist() for code in issues},
+        'cpu_s': result.cpu,
+        'duration': {
+            'effects': timed,
+            'total_s': result.total,
+            'mean_s': result.total / timed if timed else None,
+            'min_s': result.min,
+            'max_s': result.max,
+            'p50_s': _percentile(result.histogram, timed, 0.50),
+            'p90_s': _percentile(result.histogram, timed, 0.90),
+            'p99_s': _percentile(result.histogram, timed, 0.99),
+            'longest': [{'id': effect_id, 'seconds': seconds}
+                        for seconds, effect_id in result.longest],
+        },
+    }
+    if result.ids is not None:
+        report['durations'] = dict(zip(result.ids.tolist(), result.durations.tolist()))
+    return report
+
+
+def format_report(report, examples=EXAMPLES):
+    """报告字典 -> 供打印的文本"""
+    lines = [f"{report['path']}: {report['effects']} effects, {report['valid']} valid, "
+             f"{report['errors']} with errors, {report['warnings']} with warnings "
+             f"({report['seconds']:.2f} s, {report['workers']} workers, "
+             f"{report['chunks']} chunks)"]
+    for code, count in report['issues'].items():
+        level, description = ISSUES[code]
+        ids = report['flagged'][code]
+        more = ', ...' if len(ids) > examples else ''
+        lines.append(f"  {level:7} {code:18} {count:8}  {description}")
+        lines.append(f"          ids: {', '.join(map(str, ids[:examples]))}{more}")
+    duration = report['duration']
+    if duration['effects']:
+        lines.append(f"  duration: total {duration['total_s'] / 3600:.1f} h, "
+                     f"mean {duration['mean_s']:.2f} s, min {duration['min_s']:.2f} s, "
+                     f"p50 {duration['p50_s']:.1f} s, p90 {duration['p90_s']:.1f} s, "
+                     f"p99 {duration['p99_s']:.1f} s, max {duration['max_s']:.2f} s")
+        lines.append("  longest: " + ', '.join(f"{item['id']} ({item['seconds']:.1f} s)"
+                                              for item in duration['longest']))
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="按固件限制检查效果库并预测播放时长")
+    parser.add_argument('library', help="数据目录，或 .lib / .json 快照文件")
+    parser.add_argument('--workers', type=int, help="进程数，默认为 CPU 核数")
+    parser.add_argument('--json', help="把完整报告(含全部问题ID)写成 JSON 文件")
+    parser.add_argument('--durations', action='store_true', help="JSON 报告中包含每个效果的时长")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.library):
+        result = validate_data_dir(args.library, workers=args.workers, durations=args.durations)
+    else:
+        result = validate_library(args.library, workers=args.workers, durations=args.durations)
+    print(format_report(result))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, separators=(',', ':'))
+    sys.exit(1 if result['errors'] else 0)
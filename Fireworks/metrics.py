@@ -0,0 +1,264 @@
+"""运行时指标: 计数器、直方图与仪表，导出为 Prometheus 文本或 JSON
+
+热路径上只做一次 perf_counter 与一次二分查桶；格式化只在导出时进行。
+各模块在导入时向默认的 REGISTRY 注册自己的指标:
+
+    SAVE_SECONDS = REGISTRY.histogram('fireworks_save_seconds', '追加保存一个效果的耗时')
+    with SAVE_SECONDS.time():
+        ...
+
+导出: REGISTRY.to_prometheus() / to_json()，write_metrics(路径) 写文件，
+serve_metrics(端口) 在本机启动 HTTP 端点 (/metrics 与 /metrics.json)。
+"""
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 默认的耗时分桶(秒)，从 50 微秒到 10 秒
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class _Timer:
+    __slots__ = ('metric', 'labels', 'start')
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Metric(ABC):
+    """带可选标签的指标；标签值按位置传入，如 observe(0.1, 'S')
+
+    子类实现 _new_child() 返回一组标签值对应的可变存储 (如 [0])。
+    """
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.children = {}
+        self._lock = threading.Lock()
+
+    def _child(self, labels):
+        child = self.children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self.children.setdefault(labels, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """一组新标签值的初始存储"""
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class _Value(Metric):
+    """单个数值的指标；set_function 注册的函数在导出时才求值，热路径上没有开销"""
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self.functions = {}
+
+    def _new_child(self):
+        return [0]
+
+    def set_function(self, function, *labels):
+        self.functions[labels] = function
+
+    def remove_function(self, *labels):
+        """注销 set_function 注册的函数(如所属对象关闭时)，注册表不再引用它"""
+        self.functions.pop(labels, None)
+
+    def value(self, *labels):
+        function = self.functions.get(labels)
+        if function is not None:
+            return function()
+        child = self.children.get(labels)
+        return child[0] if child else 0
+
+    def samples(self):
+        keys = list(self.children) + [k for k in self.functions if k not in self.children]
+        return [(self.name, labels, self.value(*labels)) for labels in keys]
+
+
+class Counter(_Value):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self._child(labels)[0] += amount
+
+
+class Gauge(_Value):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        self._child(labels)[0] = value
+
+
+class Histogram(Metric):
+    """累计分桶的直方图；每个子项为 [各桶计数..., +Inf 计数, 总和]"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return [0] * (len(self.buckets) + 2)
+
+    def observe(self, value, *labels):
+        child = self._child(labels)
+        child[bisect_left(self.buckets, value)] += 1
+        child[-1] += value
+
+    def time(self, *labels):
+        """with HISTOGRAM.time(): ... 记录代码块的耗时"""
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        child = self.children.get(labels)
+        return sum(child[:-1]) if child else 0
+
+    def summary(self, *labels):
+        """次数、总和与按桶上界估计的 p50/p99"""
+        child = self.children.get(labels)
+        if not child:
+            return {'count': 0, 'sum': 0.0, 'p50': None, 'p99': None}
+        total = sum(child[:-1])
+        return {'count': total, 'sum': child[-1],
+                'p50': self._quantile(child, total, 0.5),
+                'p99': self._quantile(child, total, 0.99)}
+
+    def _quantile(self, child, total, q):
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), child[:-1]):
+            seen += count
+            if seen >= q * total:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        rows = []
+        for labels, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                rows.append((self.name + '_bucket', labels, cumulative, (('le', le),)))
+            rows.append((self.name + '_count', labels, cumulative))
+            rows.append((self.name + '_sum', labels, child[-1]))
+        return rows
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"Metric {name} already registered as {metric.kind}")
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labels, buckets)
+
+    def to_prometheus(self):
+        """Prometheus 文本格式 (version 0.0.4)"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.header())
+            for row in metric.samples():
+                name, labels, value = row[:3]
+                extra = row[3] if len(row) > 3 else ()
+                lines.append(f"{name}{_label_text(metric.label_names, labels, extra)} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        """{指标名: {标签文本: 值或直方图摘要}}"""
+        data = {}
+        for metric in self.metrics.values():
+            values = {}
+            keys = set(metric.children) | set(getattr(metric, 'functions', ()))
+            for labels in keys:
+                key = ','.join(f"{k}={v}" for k, v in zip(metric.label_names, labels))
+                if isinstance(metric, Histogram):
+                    values[key] = metric.summary(*labels)
+                else:
+                    values[key] = metric.value(*labels)
+            data[metric.name] = values
+        return data
+
+
+REGISTRY = Registry()
+
+
+def write_metrics(path, registry=REGISTRY):
+    """原子地写出指标文件；.json 结尾写 JSON，否则写 Prometheus 文本"""
+    if path.endswith('.json'):
+        text = json.dumps(registry.to_json(), indent=2)
+    else:
+        text = registry.to_prometheus()
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_file, path)
+
+
+def serve_metrics(port, host='127.0.0.1', registry=REGISTRY):
+    """在后台线程启动 HTTP 端点，返回 server (调用 shutdown() 停止)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = registry.to_prometheus().encode()
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body = json.dumps(registry.to_json()).encode()
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
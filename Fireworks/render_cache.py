@@ -0,0 +1,143 @@
+"""按效果参数寻址的渲染结果缓存
+
+键是影响画面的字段(激光不影响灯带，speedDelay 只取固件使用的低 8 位)加上随机种子
+的 SHA-1，参数相同的效果无论 ID、保存时间都共用一份渲染结果。
+
+两级: 内存中按字节数限制的 LRU；可选的磁盘目录，每个键一个压缩的 .npz 文件。
+派生指标(时长、峰值亮灯数、峰值电流)很小，单独缓存，帧被淘汰后仍保留。
+"""
+import hashlib
+import os
+import struct
+from collections import OrderedDict
+
+import numpy as np
+
+from effect_render import Rendering, render
+
+# 内存中渲染帧的默认上限(字节)
+MAX_BYTES = 64 * 1024 * 1024
+# 最多缓存的指标条数
+MAX_METRICS = 65536
+# WS2812 每个通道满亮度时的电流(毫安)
+CHANNEL_CURRENT_MA = 20
+
+_KEY = struct.Struct('<10BhHBq')
+
+
+def render_key(effect, seed=0):
+    """效果参数 -> 缓存键 (十六进制字符串)"""
+    packed = _KEY.pack(*effect.color1, *effect.color2, effect.max_brightness,
+                       effect.launch_mode, effect.gradient_mode, effect.explode_mode,
+                       effect.mirror_angle, effect.explosion_led_count,
+                       effect.speed_delay & 0xFF, seed)
+    return hashlib.sha1(packed).hexdigest()
+
+
+def compute_metrics(rendering):
+    frames = rendering.frames
+    if not len(frames):
+        return {'frames': 0, 'duration': rendering.duration, 'peak_lit': 0, 'peak_current_ma': 0.0}
+    lit = frames.any(axis=2).sum(axis=1)
+    channel_sum = frames.sum(axis=(1, 2), dtype=np.int64)
+    return {
+        'frames': len(frames),
+        'duration': rendering.duration,
+        'peak_lit': int(lit.max()),
+        'peak_current_ma': round(float(channel_sum.max()) / 255 * CHANNEL_CURRENT_MA, 1),
+    }
+
+
+class RenderCache:
+    """render() 的缓存；cache_dir 为 None 时只用内存"""
+
+    def __init__(self, max_bytes=MAX_BYTES, cache_dir=None, seed=0):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.seed = seed
+        self._frames = OrderedDict()  # 键 -> Rendering
+        self._metrics = OrderedDict()  # 键 -> 指标
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _remember(self, key, rendering):
+        size = rendering.frames.nbytes + rendering.times.nbytes
+        if size > self.max_bytes:
+            return
+        self._frames[key] = rendering
+        self.memory_bytes += size
+        while self.memory_bytes > self.max_bytes:
+            _, old = self._frames.popitem(last=False)
+            self.memory_bytes -= old.frames.nbytes + old.times.nbytes
+
+    def _load(self, key):
+        try:
+            with np.load(self._path(key)) as data:
+                return Rendering(data['frames'], data['times'], float(data['duration']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _store(self, key, rendering):
+        tmp_file = self._path(key) + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez_compressed(f, frames=rendering.frames, times=rendering.times,
+                                duration=rendering.duration)
+        os.replace(tmp_file, self._path(key))
+
+    def get(self, effect):
+        """effect 的渲染结果: 内存 -> 磁盘 -> 重新渲染"""
+        key = render_key(effect, self.seed)
+        rendering = self._frames.get(key)
+        if rendering is not None:
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return rendering
+        if self.cache_dir is not None:
+            rendering = self._load(key)
+            if rendering is not None:
+                self.disk_hits += 1
+                self._remember(key, rendering)
+                return rendering
+        self.misses += 1
+        rendering = render(effect, seed=self.seed)
+        self._remember(key, rendering)
+        if self.cache_dir is not None:
+            self._store(key, rendering)
+        return rendering
+
+    def metrics(self, effect):
+        """effect 的派生指标；只在第一次需要渲染"""
+        key = render_key(effect, self.seed)
+        metrics = self._metrics.get(key)
+        if metrics is not None:
+            self._metrics.move_to_end(key)
+            self.hits += 1
+            return metrics
+        metrics = compute_metrics(self.get(effect))
+        self._metrics[key] = metrics
+        if len(self._metrics) > MAX_METRICS:
+            self._metrics.popitem(last=False)
+        return metrics
+
+    def clear(self):
+        self._frames.clear()
+        self._metrics.clear()
+        self.memory_bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            'entries': len(self._frames),
+            'memory_bytes': self.memory_bytes,
+        }
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+from metrics import REGISTRY
+
+log = logging.getLogger(__name__)
+
+# 读线程阻塞等待的超时(秒)，仅用于检查停止标志，不影响消息延迟
+READ_TIMEOUT = 0.5
+# 延迟统计保留的样本数
+LATENCY_SAMPLES = 10000
+
+WRITE_SECONDS = REGISTRY.histogram('fireworks_serial_write_seconds',
+                                   '命令进入写队列到写入串口完成的耗时')
+
+
+class LatencyStats:
+    """记录 消息到达 -> 处理函数开始 的延迟(秒)"""
+
+    def __init__(self, maxlen=LATENCY_SAMPLES):
+        self.samples = deque(maxlen=maxlen)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        k = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+        return ordered[k]
+
+    def summary(self):
+        """返回 p50/p99 (毫秒) 及样本数"""
+        p50 = self.percentile(50)
+        p99 = self.percentile(99)
+        return {
+            'count': len(self.samples),
+            'p50_ms': None if p50 is None else p50 * 1000,
+            'p99_ms': None if p99 is None else p99 * 1000,
+        }
+
+
+class AsyncSerialTransport:
+    """基于 asyncio 的串口收发
+
+    读线程在 serial.read 上阻塞，有数据即返回(不再轮询 + sleep)，
+    按 '\\n' 增量分帧后把 (消息, 到达时间) 投递到事件循环的队列中；
+    写操作进入异步写队列，由写协程依次写入串口。
+
+    读串口出错(如拔掉设备)时读线程退出，并把异常投递到同一队列，
+    readline() 取到时抛出，读循环不会一直等下去。
+    """
+
+    def __init__(self, ser):
+        self.ser = ser
+        self.loop = None
+        self.lines = None
+        self.write_queue = None
+        self._buffer = bytearray()
+        self._running = threading.Event()
+        self._reader_thread = None
+        self._writer_task = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.lines = asyncio.Queue()
+        self.write_queue = asyncio.Queue()
+        self.ser.timeout = READ_TIMEOUT
+        self._running.set()
+        self._reader_thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader_thread.start()
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    def _read_loop(self):
+        """读线程: 阻塞读取，增量分帧"""
+        while self._running.is_set():
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                log.error("Serial read error: %s", e)
+                self.loop.call_soon_threadsafe(self.lines.put_nowait, e)
+                break
+            if not data:
+                continue
+            arrived = time.perf_counter()
+            self._buffer += data
+            while True:
+                end = self._buffer.find(b'\n')
+                if end < 0:
+                    break
+                line = self._buffer[:end].decode(errors='replace').strip()
+                del self._buffer[:end + 1]
+                if line:  # 只投递非空消息
+                    self.loop.call_soon_threadsafe(self.lines.put_nowait, (line, arrived))
+
+    async def _write_loop(self):
+        """写协程: 依次写出写队列中的命令"""
+        while True:
+            data, queued = await self.write_queue.get()
+            try:
+                self.ser.write(data)
+            except Exception as e:
+                log.error("Serial write error: %s", e)
+            WRITE_SECONDS.observe(time.perf_counter() - queued)
+
+    def write(self, data):
+        """把命令放入异步写队列"""
+        self.write_queue.put_nowait((data, time.perf_counter()))
+
+    async def readline(self, timeout=None):
+        """等待下一条完整消息，返回 (消息, 到达时间)；超时返回 None，读线程出错时抛出其异常"""
+        if not self.lines.empty():
+            return self._received(self.lines.get_nowait())
+        # 不用 asyncio.wait_for: 它在 timeout 为 0 时不取已到达的消息，
+        # 且消息恰好到达时会吞掉外部的取消
+        getter = asyncio.ensure_future(self.lines.get())
+        try:
+            await asyncio.wait((getter,), timeout=timeout)
+        finally:
+            if not getter.done():
+                getter.cancel()
+        if not getter.done() or getter.cancelled():
+            return None
+        return self._received(getter.result())
+
+    @staticmethod
+    def _received(item):
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def close(self):
+        self._running.clear()
+        if self._writer_task is not None:
+            # 先写完已排队的命令
+            while not self.write_queue.empty():
+                await asyncio.sleep(0)
+            self._writer_task.cancel()
+        if self._reader_thread is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self._reader_thread.join)
@@ -0,0 +1,284 @@
+"""长期保持的串口会话: 多个操作共用一个连接，不再每次都打开串口
+
+打开 serial.Serial 会拉高 DTR，多数 Arduino 因此复位: 先在 bootloader 中停留约 2 秒，
+固件状态也随之丢失。SerialSession:
+- 第一次读写时才打开串口；打开时不拉 DTR/RTS，固件已在运行时不会复位
+- 不固定 sleep: 收到固件的启动横幅(刚复位)或握手回复(没有复位)即就绪
+- 读写出错(拔插、驱动异常)时关闭并重新打开；没能写出的命令留在队列中，重连后按序整条补发
+- 记录每次操作从发起到第一个效果写出的耗时，区分冷启动(需先打开串口)与热会话
+
+接口与 serial.Serial 兼容 (write / readline / timeout / is_open ...)，可直接交给
+play_blocking、ShowRunner 等使用。
+"""
+import logging
+import time
+from collections import deque
+
+import serial
+
+from serial_io import LatencyStats
+from wire_protocol import (PROTOCOL_TEXT, PROTOCOL_VERSION, HELLO_INTERVAL, hello_command,
+                           parse_hello)
+
+# v2 固件 setup() 最后打印的启动横幅
+BOOT_BANNER = 'System Idle'
+# 等待启动横幅或握手回复的最长秒数 (bootloader 约 2 秒)
+READY_TIMEOUT = 4.0
+# 收到启动横幅后再等握手回复的秒数，超时说明固件不支持握手
+BANNER_HELLO_WAIT = 2 * HELLO_INTERVAL
+# 重连时反复尝试打开串口的最长秒数(USB 重新枚举需要时间)与间隔
+RECONNECT_TIMEOUT = 10.0
+RECONNECT_INTERVAL = 0.2
+
+log = logging.getLogger(__name__)
+
+
+class SerialSession:
+    """一个可以反复使用的串口连接
+
+    port 为端口名 / pyserial URL，或已打开的串口对象(如 serial_sim.SimulatedArduino)。
+    reset 为 True 时打开串口照常拉 DTR 复位固件。
+    """
+
+    def __init__(self, port, baudrate=115200, timeout=None, binary=True, reset=False,
+                 ready_timeout=READY_TIMEOUT):
+        self.port = port
+        self.baudrate = baudrate
+        self.binary = binary
+        self.reset = reset
+        self.ready_timeout = ready_timeout
+        self.ser = None
+        self.ready = False
+        self.protocol = PROTOCOL_TEXT
+        self.negotiated = False
+        self._booted = False
+        self._timeout = timeout
+        self.pending = deque()  # 写出失败、等待重连后补发的命令
+        self.backlog = deque()  # 等待就绪期间收到的其他消息，之后由 readline() 依次返回
+        self.opens = 0
+        self.reconnects = 0
+        self.resets = 0         # 打开后看到启动横幅(固件复位、状态丢失)的次数
+        self.ready_times = LatencyStats()
+        self.first_effect = {'cold': LatencyStats(), 'warm': LatencyStats()}
+        self.last_first_effect = None  # (秒, 是否冷启动)
+        self._request = None
+
+    # ---------- 连接 ----------
+
+    @property
+    def connected(self):
+        return self.ready and self.ser is not None and self.ser.is_open
+
+    def _open(self):
+        if hasattr(self.port, 'write'):
+            ser = self.port
+            if not ser.is_open:
+                ser.dtr = self.reset
+                ser.open()
+            return ser
+        ser = serial.serial_for_url(self.port, self.baudrate, timeout=self._timeout,
+                                    do_not_open=True)
+        # 打开前设置，避免打开时的复位脉冲 (Linux 上 HUPCL 仍可能复位，由启动横幅识别)
+        ser.dtr = self.reset
+        ser.rts = self.reset
+        ser.open()
+        return ser
+
+    def connect(self):
+        """打开串口并等待固件就绪；已连接时直接返回"""
+        if self.connected:
+            return self
+        started = time.perf_counter()
+        self.ser = self._open()
+        self.opens += 1
+        self.wait_ready()
+        self.ready_times.add(time.perf_counter() - started)
+        log.info("Connected to %s in %.0f ms (%s, protocol %s)", self.port,
+                 (time.perf_counter() - started) * 1000,
+                 "reset" if self._booted else "no reset", self.protocol or "text")
+        return self
+
+    def wait_ready(self):
+        """等到启动横幅或握手回复；两者都没有时超时后视为就绪，沿用已协商的协议"""
+        ser = self.ser
+        self.ready = False
+        self._booted = False
+        ser.timeout = HELLO_INTERVAL
+        deadline = time.monotonic() + self.ready_timeout
+        try:
+            # 没有复位的固件立即回复握手；复位中发出的握手被 bootloader 丢弃，之后重发
+            ser.write(hello_command())
+            while time.monotonic() < deadline:
+                line = ser.readline().decode(errors='replace').strip()
+                if not line:
+                    ser.write(hello_command())
+                    continue
+                if line == BOOT_BANNER:
+                    self._booted = True
+                    self.resets += 1
+                    deadline = min(deadline, time.monotonic() + BANNER_HELLO_WAIT)
+                    ser.write(hello_command())
+                    continue
+                version = parse_hello(line)
+                if version is not None:
+                    self.protocol = PROTOCOL_TEXT if not self.binary else \
+                        min(version, PROTOCOL_VERSION)
+                    self.negotiated = True
+                    break
+                self.backlog.append(line.encode() + b'\n')
+            else:
+                if not self.negotiated:
+                    self.protocol = PROTOCOL_TEXT
+                if not self._booted:
+                    log.warning("No banner or handshake from %s, assuming ready", self.port)
+        finally:
+            ser.timeout = self._timeout
+        self.ready = True
+
+    def reconnect(self):
+        """关闭并重新打开串口，直到成功或超过 RECONNECT_TIMEOUT"""
+        self.reconnects += 1
+        self._close_port()
+        deadline = time.monotonic() + RECONNECT_TIMEOUT
+        while True:
+            try:
+                return self.connect()
+            except (OSError, serial.SerialException) as e:
+                self._close_port()
+                if time.monotonic() >= deadline:
+                    raise
+                log.debug("Reconnect to %s failed: %s", self.port, e)
+                time.sleep(RECONNECT_INTERVAL)
+
+    def _close_port(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (OSError, serial.SerialException):
+                pass
+        self.ser = None
+        self.ready = False
+
+    def close(self):
+        """关闭串口；之后再读写时重新打开"""
+        was_open = self.ser is not None
+        self._close_port()
+        return was_open
+
+    # ---------- 首个效果计时 ----------
+
+    def begin(self):
+        """开始一次操作(如菜单中的一种模式)，计时到第一个效果写出为止"""
+        self._request = (time.perf_counter(), not self.connected)
+
+    def _wrote(self):
+        if self._request is not None:
+            started, cold = self._request
+            self._request = None
+            elapsed = time.perf_counter() - started
+            self.first_effect['cold' if cold else 'warm'].add(elapsed)
+            self.last_first_effect = (elapsed, cold)
+
+    # ---------- serial.Serial 接口 ----------
+
+    @property
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    def open(self):
+        self.connect()
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
+        if self.ser is not None:
+            self.ser.timeout = value
+
+    @property
+    def in_waiting(self):
+        if self.backlog:
+            return len(self.backlog[0])
+        return self.ser.in_waiting if self.connected else 0
+
+    def write(self, data):
+        """写出一条命令；出错时重连后补发，重连失败时命令留在队列中等下次写出"""
+        self.pending.append(bytes(data))
+        while self.pending:
+            self.connect()
+            try:
+                self.ser.write(self.pending[0])
+            except (OSError, serial.SerialException) as e:
+                log.warning("Write to %s failed: %s, reconnecting with %d queued commands",
+                            self.port, e, len(self.pending))
+                self.reconnect()
+                continue
+            self.pending.popleft()
+            self._wrote()
+        return len(data)
+
+    def _read(self, read):
+        self.connect()
+        try:
+            return read()
+        except (OSError, serial.SerialException) as e:
+            log.warning("Read from %s failed: %s, reconnecting", self.port, e)
+            self.reconnect()
+            return b''
+
+    def readline(self):
+        if self.backlog:
+            return self.backlog.popleft()
+        return self._read(lambda: self.ser.readline())
+
+    def read(self, size=1):
+        if self.backlog:
+            line = self.backlog.popleft()
+            if len(line) > size:
+                self.backlog.appendleft(line[size:])
+            return line[:size]
+        return self._read(lambda: self.ser.read(size))
+
+    def flush(self):
+        if self.connected:
+            self.ser.flush()
+
+    def reset_input_buffer(self):
+        self.backlog.clear()
+        if self.connected:
+            self.ser.reset_input_buffer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---------- 统计 ----------
+
+    def stats(self):
+        return {
+            'port': str(self.port),
+            'connected': self.connected,
+            'protocol': self.protocol,
+            'opens': self.opens,
+            'reconnects': self.reconnects,
+            'resets': self.resets,
+            'pending': len(self.pending),
+            'ready': self.ready_times.summary(),
+            'first_effect_cold': self.first_effect['cold'].summary(),
+            'first_effect_warm': self.first_effect['warm'].summary(),
+        }
+
+    def report(self):
+        """冷启动与热会话的首个效果耗时，供打印"""
+        parts = []
+        for kind, label in (('cold', "cold"), ('warm', "warm")):
+            summary = self.first_effect[kind].summary()
+            if summary['count']:
+                parts.append(f"{label} p50 {summary['p50_ms']:.1f} ms (n={summary['count']})")
+        return (f"Time to first effect: {', '.join(parts) or 'n/a'}; "
+                f"opens {self.opens}, reconnects {self.reconnects}, resets {self.resets}")
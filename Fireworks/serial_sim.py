@@ -0,0 +1,305 @@
+"""模拟 v2 固件的串口，替代 serial.Serial 做无硬件测试与基准测试
+
+模拟的行为 (见 v2/v2.ino 与 v2/Z_Utils.ino):
+- 打开串口后打印 "System Idle" 与 "IDLE MODE"；关闭后再打开时 DTR 为真则复位:
+  boot_time 秒的 bootloader 期间收到的字节被丢弃，之后重新打印启动横幅
+- 面板操作: 模式切换横幅、S 保存消息、数字键盘的 R 点播请求、T 测试数据
+- 收到 P 命令(文本或二进制帧)后解析并播放；播放期间 delay() 阻塞，
+  到达的字节先进入 64 字节接收缓冲区(溢出丢弃)，播放结束后被清空
+- 收到 H 握手回复支持的协议版本
+- 收到批量帧后连续播放其中的效果，每个之后回复 B,<序号>,<毫秒> 并等待间隔
+- 清空接收缓冲区时丢掉了命令字节则回复 O,<字节数>
+- 播放完串口发来的效果或批量后(清空接收缓冲区之后)回复 D,<毫秒>
+"""
+import threading
+import time
+
+import wire_protocol
+from effect_timing import PARSE_TIME_PER_FIELD
+
+RX_BUFFER_SIZE = 64
+# Serial.parseInt 每个字段的处理开销(秒)，另加线路上每字节 10 bit 的传输时间
+PARSE_DELAY_PER_FIELD = PARSE_TIME_PER_FIELD
+
+
+class PlayRecord:
+    """固件播放一次效果的记录 (时间为 time.perf_counter)"""
+    __slots__ = ('fields', 'received', 'started', 'finished')
+
+    def __init__(self, fields, received, started, finished):
+        self.fields = fields
+        self.received = received
+        self.started = started
+        self.finished = finished
+
+
+class SimulatedArduino:
+    """与 serial.Serial 接口兼容的 v2 固件模拟器
+
+    effect_duration: 每个效果的播放时长(秒)，或接受 14 个字段返回时长的函数
+    acks: 为 False 时模拟没有完成回执的旧固件
+    protocol_version: 固件支持的最高协议版本，1 为不支持批量帧的旧固件
+    boot_time: 复位后在 bootloader 中停留的秒数
+    """
+
+    def __init__(self, port='sim', baudrate=115200, timeout=None,
+                 effect_duration=0.0, parse_delay=PARSE_DELAY_PER_FIELD,
+                 binary=True, boot_messages=True, acks=True,
+                 protocol_version=wire_protocol.PROTOCOL_VERSION, boot_time=0.0):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.effect_duration = effect_duration
+        self.parse_delay = parse_delay
+        self.binary = binary
+        self.acks = acks
+        self.protocol_version = protocol_version
+        self.boot_time = boot_time
+        self.is_open = True
+        self.dtr = True
+        self.resets = 0
+
+        self._out = bytearray()  # 固件 -> 上位机
+        self._rx = bytearray()   # 上位机 -> 固件
+        self._out_cond = threading.Condition()
+        self._rx_cond = threading.Condition()
+        self.busy = False
+        self.rx_overruns = 0     # 接收缓冲区溢出丢弃的字节数
+        self.dropped_bytes = 0   # 播放结束后被清空的字节数
+        self.played = []         # PlayRecord 列表
+        self.bytes_received = 0
+
+        self._booting_until = 0.0
+        self._closed = threading.Event()  # 关闭串口时中断正在进行的播放与启动
+        self._thread = None
+        self._boot(boot_messages)
+
+    def _boot(self, boot_messages=True):
+        """(重新)启动固件: bootloader 结束后打印启动横幅，再进入主循环"""
+        self._booting_until = time.perf_counter() + self.boot_time
+        if boot_messages and not self.boot_time:
+            self.println("System Idle")
+            self.println("IDLE MODE")
+            boot_messages = False
+        self._thread = threading.Thread(target=self._firmware_loop, args=(boot_messages,),
+                                        daemon=True)
+        self._thread.start()
+
+    # ---------- serial.Serial 接口 ----------
+
+    @property
+    def in_waiting(self):
+        with self._out_cond:
+            return len(self._out)
+
+    def read(self, size=1):
+        with self._out_cond:
+            if not self._out_cond.wait_for(lambda: self._out or not self.is_open, self.timeout):
+                return b''
+            data = bytes(self._out[:size])
+            del self._out[:size]
+            return data
+
+    def readline(self):
+        with self._out_cond:
+            if not self._out_cond.wait_for(
+                    lambda: b'\n' in self._out or not self.is_open, self.timeout):
+                data = bytes(self._out)
+                self._out.clear()
+                return data
+            end = self._out.find(b'\n') + 1
+            data = bytes(self._out[:end])
+            del self._out[:end]
+            return data
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("port is closed")
+        data = bytes(data)
+        with self._rx_cond:
+            self.bytes_received += len(data)
+            if time.perf_counter() < self._booting_until:
+                # bootloader 不转交串口数据
+                self.dropped_bytes += len(data)
+                return len(data)
+            if self.busy:
+                # 播放期间固件不读串口，只有硬件缓冲区能接收
+                room = max(0, RX_BUFFER_SIZE - len(self._rx))
+                self.rx_overruns += max(0, len(data) - room)
+                data = data[:room]
+            self._rx += data
+            self._rx_cond.notify_all()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        with self._out_cond:
+            self._out.clear()
+
+    def open(self):
+        if self.is_open:
+            return
+        self._thread.join()
+        self._closed.clear()
+        self.is_open = True
+        if self.dtr:
+            # 打开串口拉高 DTR，固件复位: 缓冲区与播放状态全部丢失
+            self.resets += 1
+            with self._rx_cond:
+                self._rx.clear()
+                self.busy = False
+            with self._out_cond:
+                self._out.clear()
+            self._boot()
+        else:
+            self._thread = threading.Thread(target=self._firmware_loop, args=(False,),
+                                            daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self.is_open = False
+        self._closed.set()
+        with self._rx_cond:
+            self._rx_cond.notify_all()
+        with self._out_cond:
+            self._out_cond.notify_all()
+
+    # ---------- 面板操作 (固件 -> 上位机) ----------
+
+    def println(self, text):
+        with self._out_cond:
+            self._out += text.encode() + b'\r\n'
+            self._out_cond.notify_all()
+
+    def set_mode(self, state):
+        """切换模式横幅，state 为 'IDLE' / 'CUSTOMIZE' / 'PREVIEW' / 'SAVE'"""
+        self.println(f"{state} MODE")
+
+    def save_effect(self, effect):
+        """面板上保存当前效果 (saveCurrentEffect)，字段顺序与 P 命令一致"""
+        self.set_mode('SAVE')
+        self.println("S," + ",".join(str(v) for v in effect.fields()))
+        self.set_mode('IDLE')
+
+    def request_play(self, effect_number):
+        """数字键盘点播 (checkNumpadInput)"""
+        self.println(f"R,{effect_number}")
+
+    def send_test_data(self, kind, name, *values):
+        self.println(",".join(str(v) for v in ('T', kind, name, *values)))
+
+    # ---------- 固件主循环 ----------
+
+    def _take(self, count):
+        """从接收缓冲区取 count 字节，不足时等待"""
+        with self._rx_cond:
+            self._rx_cond.wait_for(lambda: len(self._rx) >= count or not self.is_open)
+            data = bytes(self._rx[:count])
+            del self._rx[:count]
+            return data
+
+    def _take_line(self):
+        with self._rx_cond:
+            self._rx_cond.wait_for(lambda: b'\n' in self._rx or not self.is_open)
+            end = self._rx.find(b'\n') + 1
+            data = bytes(self._rx[:end])
+            del self._rx[:end]
+            return data
+
+    def _line_time(self, nbytes):
+        return nbytes * 10 / self.baudrate
+
+    def _firmware_loop(self, boot_messages):
+        if boot_messages:
+            delay = self._booting_until - time.perf_counter()
+            if delay > 0 and self._closed.wait(delay):
+                return
+            self.println("System Idle")
+            self.println("IDLE MODE")
+        while self.is_open:
+            cmd = self._take(1)
+            if not cmd:
+                continue
+            received = time.perf_counter()
+            record = None
+            if cmd == b'P':
+                line = b'P' + self._take_line()
+                try:
+                    fields = wire_protocol.decode_text(line)
+                except ValueError:
+                    self._drain()
+                    continue
+                time.sleep(self._line_time(len(line)) + self.parse_delay * len(fields))
+                record = self._play(fields, received)
+            elif cmd == b'H':
+                line = self._take_line()
+                if self.binary:
+                    version = int(line.strip(b',\r\n') or 0)
+                    self.println(f"H,{min(version, self.protocol_version)}")
+            elif cmd[0] == wire_protocol.FRAME_SYNC and self.binary:
+                header = cmd + self._take(2)
+                if header[2] == wire_protocol.CMD_BATCH and \
+                        self.protocol_version >= wire_protocol.BATCH_MIN_VERSION:
+                    record = self._play_batch(header, received)
+                else:
+                    frame = header + self._take(wire_protocol.FRAME_SIZE - 3)
+                    time.sleep(self._line_time(len(frame)))
+                    try:
+                        fields = wire_protocol.decode_frame(frame)
+                    except wire_protocol.FrameError:
+                        self.println("Bad frame")
+                    else:
+                        record = self._play(fields, received)
+            self._drain()
+            if record is not None and self.acks:
+                self.println(f"D,{round((record.finished - record.started) * 1000)}")
+
+    def _drain(self):
+        """对应固件 processSerialCommand 末尾的清空接收缓冲区"""
+        with self._rx_cond:
+            discarded = len(self._rx) - self._rx.count(b'\n') - self._rx.count(b'\r')
+            self.dropped_bytes += len(self._rx)
+            self._rx.clear()
+        if discarded:
+            self.println(f"O,{discarded}")
+
+    def _play(self, fields, received, release=True):
+        self.println("Received effect parameters:")
+        duration = self.effect_duration
+        if callable(duration):
+            duration = duration(fields)
+        with self._rx_cond:
+            self.busy = True
+        started = time.perf_counter()
+        if duration:
+            self._closed.wait(duration)
+        finished = time.perf_counter()
+        if release:
+            with self._rx_cond:
+                self.busy = False
+        record = PlayRecord(fields, received, started, finished)
+        self.played.append(record)
+        return record
+
+    def _play_batch(self, header, received):
+        """readBatchFrame + playBatch；返回覆盖整个批量的记录"""
+        count = self._take(1)
+        size = wire_protocol.batch_size(count[0] if count else 0)
+        frame = header + count + self._take(size - len(header) - 1)
+        time.sleep(self._line_time(len(frame)))
+        try:
+            items = wire_protocol.decode_batch(frame)
+        except wire_protocol.FrameError:
+            self.println("Bad frame")
+            return None
+        started = time.perf_counter()
+        for i, (fields, gap) in enumerate(items):
+            record = self._play(fields, received, release=False)
+            self.println(f"B,{i},{round((record.finished - record.started) * 1000)}")
+            if gap and i + 1 < len(items):
+                time.sleep(gap / 1000)
+        with self._rx_cond:
+            self.busy = False
+        return PlayRecord(None, received, started, time.perf_counter())
@@ -0,0 +1,286 @@
+"""按完成回执推进的播放流水线
+
+固件播放期间不读串口，每个命令处理完后还会清空接收缓冲区，所以同一时刻
+只能有一个效果在途。流水线提前编码好下一个效果，收到完成回执 "D,<毫秒>"
+后立即发出；旧固件没有回执时，按预测时长加余量超时后再发。
+
+队列中的一项也可以是 EffectBatch: 整个播放列表一次上传，由固件本地连续播放，
+期间只接收 "B,<序号>,<毫秒>" 进度。
+
+这就是上位机的出站队列: 固件一次只能接收一个命令(信用为 1)，回执归还信用。
+带 key 的命令在发出前可被同 key 的新命令替换(如预览只有最新的有意义)；
+队列满时丢弃并计数。固件清空接收缓冲区时若丢掉了字节，会回复 "O,<字节数>"。
+
+gap 为每个效果播完(收到回执或超时)后额外等待的秒数，默认 0 即紧接着播放；
+批量自带每个效果之后的间隔，播完后不再额外等待。
+"""
+import logging
+import time
+from collections import deque
+
+from effect_model import EffectBatch
+from metrics import REGISTRY
+from wire_protocol import PROTOCOL_TEXT, parse_batch_progress, parse_done, parse_overrun
+
+# 等待回执的超时 = 预测时长 * ACK_TIMEOUT_SCALE + ACK_MARGIN
+ACK_TIMEOUT_SCALE = 1.5
+ACK_MARGIN = 0.5
+# 用回执中的实测时长校正预测值的平滑系数
+CALIBRATION_WEIGHT = 0.2
+# 等待发送的命令数上限
+MAX_PENDING = 256
+
+log = logging.getLogger(__name__)
+
+DRIFT_SECONDS = REGISTRY.histogram(
+    'fireworks_sequence_drift_seconds', '固件实测播放时长 - 校正后的预测时长',
+    buckets=(-1.0, -0.25, -0.1, -0.05, -0.02, -0.01, -0.005, 0.0,
+             0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 1.0))
+
+
+def item_duration(item):
+    """效果或批量的预测播放秒数 (缓存在对象上)"""
+    return item.duration()
+
+
+class ShowPipeline:
+    """一次只在途一个效果的播放队列，统计灯带占空比(忙碌时间 / 墙钟时间)
+
+    send(effect) 负责把效果写到串口；队列中的效果在入队时就已编码
+    (结果缓存在 FireworkEffect 上)，发送时不再做任何计算。
+    """
+
+    def __init__(self, send, protocol=PROTOCOL_TEXT, clock=time.monotonic,
+                 max_pending=MAX_PENDING, gap=0.0):
+        self.send = send
+        self.protocol = protocol
+        self.clock = clock
+        self.max_pending = max_pending
+        self.gap = gap
+        self.hold_until = None  # 播完后的间隔结束前不发下一个
+        self.pending = deque()  # 等待播放的 FireworkEffect
+        self.keys = {}          # key -> 等待中的可合并命令
+        self.current = None     # 正在播放的效果
+        self.started = None
+        self.deadline = None    # 超过该时刻仍无回执则视为已播放完
+        self.paused = False     # 握手期间暂停发送
+        self.scale = 1.0        # 实测时长 / 预测时长
+        self.busy_time = 0.0
+        self.first_start = None
+        self.completed = 0
+        self.timeouts = 0
+        self.batch_items = 0  # 批量中已播完的效果数
+        self.sent = 0
+        self.coalesced = 0    # 被同 key 的新命令替换掉的
+        self.dropped = 0      # 队列满时丢弃的
+        self.overrun_bytes = 0  # 固件报告清空接收缓冲区时丢掉的字节数
+
+    def __len__(self):
+        return len(self.pending)
+
+    @property
+    def idle(self):
+        return self.current is None
+
+    def enqueue(self, effect, urgent=False, key=None):
+        """加入队列；urgent 的效果排在队首(点播)。返回 False 表示被丢弃
+
+        key 不为 None 时，若同 key 的命令还没发出，就地替换它而不是再排一个。
+        """
+        effect.wire(self.protocol)
+        old = self.keys.get(key) if key is not None else None
+        if old is not None:
+            for i, item in enumerate(self.pending):
+                if item is old:
+                    self.pending[i] = effect
+                    break
+            self.keys[key] = effect
+            self.coalesced += 1
+            return True
+        if self.max_pending is not None and len(self.pending) >= self.max_pending:
+            if not urgent:
+                self.dropped += 1
+                return False
+            # 点播优先: 挤掉队尾最晚入队的
+            self._forget(self.pending.pop())
+            self.dropped += 1
+        if urgent:
+            self.pending.appendleft(effect)
+        else:
+            self.pending.append(effect)
+        if key is not None:
+            self.keys[key] = effect
+        self.pump()
+        return True
+
+    def _forget(self, effect):
+        for key, item in list(self.keys.items()):
+            if item is effect:
+                del self.keys[key]
+
+    def clear(self):
+        self.pending.clear()
+        self.keys.clear()
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.pump()
+
+    def predict(self, effect):
+        """经回执校正后的预测时长(秒)"""
+        return item_duration(effect) * self.scale
+
+    def pump(self, now=None):
+        """灯带空闲时发出队首的效果"""
+        if self.current is not None or self.paused or not self.pending:
+            return False
+        if self.hold_until is not None:
+            now = self.clock() if now is None else now
+            if now < self.hold_until:
+                return False
+            self.hold_until = None
+        effect = self.pending.popleft()
+        if self.keys:
+            self._forget(effect)
+        self.send(effect)
+        self.sent += 1
+        self.track(effect, now)
+        return True
+
+    def track(self, effect, now=None):
+        """记录一个已由调用方直接发出的效果(如多台控制器的同步起播)"""
+        now = self.clock() if now is None else now
+        self.current = effect
+        self.started = now
+        self.deadline = now + self.predict(effect) * ACK_TIMEOUT_SCALE + ACK_MARGIN
+        if self.first_start is None:
+            self.first_start = now
+
+    def complete(self, elapsed=None, now=None):
+        """收到完成回执；elapsed 为固件报告的播放秒数。没有在途效果时忽略"""
+        if self.current is None:
+            return False
+        now = self.clock() if now is None else now
+        if elapsed is None:
+            elapsed = now - self.started
+        predicted = item_duration(self.current)
+        DRIFT_SECONDS.observe(elapsed - predicted * self.scale)
+        if predicted > 0:
+            self.scale += CALIBRATION_WEIGHT * (elapsed / predicted - self.scale)
+        self.busy_time += elapsed
+        self.completed += 1
+        self.finish(now)
+        return True
+
+    def finish(self, now):
+        """在途效果结束: 需要间隔时先等 gap 秒，再发出下一个"""
+        if self.gap and not isinstance(self.current, EffectBatch):
+            self.hold_until = now + self.gap
+        self.current = None
+        self.pump(now)
+
+    def progress(self, index, now=None):
+        """批量中第 index 个效果播完: 按剩余部分重新计算回执超时"""
+        batch = self.current
+        if not isinstance(batch, EffectBatch) or not 0 <= index < len(batch):
+            return False
+        now = self.clock() if now is None else now
+        rest = EffectBatch(batch.effects[index + 1:], batch.gaps[index + 1:])
+        remaining = (item_duration(rest) + batch.gaps[index] / 1000) * self.scale
+        self.deadline = now + remaining * ACK_TIMEOUT_SCALE + ACK_MARGIN
+        self.batch_items += 1
+        return True
+
+    def overrun(self, nbytes):
+        """固件报告清空接收缓冲区时丢掉了 nbytes 字节(有命令在它忙时到达)"""
+        self.overrun_bytes += nbytes
+        log.warning("Firmware discarded %d bytes of commands", nbytes)
+
+    def poll(self, now=None):
+        """在读循环中调用: 回执超时则视为播放完成，然后发出下一个"""
+        now = self.clock() if now is None else now
+        if self.current is not None and now >= self.deadline:
+            self.busy_time += self.predict(self.current)
+            self.timeouts += 1
+            self.finish(now)
+        else:
+            self.pump(now)
+
+    def time_until_deadline(self, now=None):
+        """距离在途效果回执超时(或播完后的间隔结束)的秒数；都没有时返回 None"""
+        if self.current is None:
+            if self.hold_until is None or not self.pending:
+                return None
+            deadline = self.hold_until
+        else:
+            deadline = self.deadline
+        now = self.clock() if now is None else now
+        return max(0.0, deadline - now)
+
+    def duty_cycle(self, now=None):
+        if self.first_start is None:
+            return 0.0
+        now = self.clock() if now is None else now
+        wall = now - self.first_start
+        return min(1.0, self.busy_time / wall) if wall > 0 else 0.0
+
+    def stats(self):
+        return {
+            'completed': self.completed,
+            'timeouts': self.timeouts,
+            'queued': len(self.pending),
+            'duty_cycle': round(self.duty_cycle(), 3),
+            'duration_scale': round(self.scale, 3),
+            'batch_items': self.batch_items,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'overrun_bytes': self.overrun_bytes,
+        }
+
+
+def play_blocking(ser, effects, protocol=PROTOCOL_TEXT, send=None, on_message=print,
+                  stop=None, poll_interval=0.1):
+    """同步播放 effects (可以是无限生成器)，返回 ShowPipeline 以便查看统计
+
+    上一个效果播放期间就取出并编码下一个，回执一到立即发出。
+    send 默认直接写串口；stop 为 threading.Event 时可中途停止。
+    """
+    if send is None:
+        send = lambda effect: ser.write(effect.wire(protocol))
+    pipeline = ShowPipeline(send, protocol)
+    source = iter(effects)
+
+    def refill():
+        if not pipeline.pending:
+            effect = next(source, None)
+            if effect is not None:
+                pipeline.enqueue(effect)
+
+    old_timeout = ser.timeout
+    ser.timeout = poll_interval
+    try:
+        refill()
+        refill()
+        while pipeline.current is not None and not (stop is not None and stop.is_set()):
+            line = ser.readline().decode(errors='replace').strip()
+            if line:
+                elapsed = parse_done(line)
+                progress = parse_batch_progress(line) if elapsed is None else None
+                discarded = parse_overrun(line)
+                if elapsed is not None:
+                    pipeline.complete(elapsed)
+                elif progress is not None:
+                    pipeline.progress(progress[0])
+                elif discarded is not None:
+                    pipeline.overrun(discarded)
+                elif on_message is not None:
+                    on_message(line)
+            pipeline.poll()
+            refill()
+    finally:
+        ser.timeout = old_timeout
+    return pipeline
@@ -0,0 +1,211 @@
+"""按时间线播放的秀: 每个 cue 在相对开场的绝对时刻起播
+
+秀文件为 JSON:
+
+    {"name": "开场",
+     "cues": [{"at": 0.0, "effect": 12},
+              {"at": 4.5, "effect": {"color1": {"r": 255, "g": 0, "b": 0}, ...}}]}
+
+at 为开场后的秒数；effect 为效果库中的ID，或 effects_data.json 格式的内联效果。
+compile_show() 预先把 cue 排序、编码成 (起播时刻, 已编码命令) 的扁平数组；
+ShowRunner 按 time.monotonic_ns() 的绝对截止时刻写出，每个 cue 的时刻都从开场算起，
+写串口、打印等开销不会像连续 sleep(间隔) 那样逐个累积成漂移。
+
+迟到的 cue: CATCH_UP 立即补发(其后的 cue 仍按原时刻)；SKIP 迟到超过 late_limit 的丢弃。
+"""
+import json
+import logging
+import time
+from array import array
+
+from effect_model import FireworkEffect
+from effect_timing import command_latency
+from metrics import REGISTRY
+from serial_io import LatencyStats
+from wire_protocol import PROTOCOL_TEXT
+
+CATCH_UP = 'catch_up'
+SKIP = 'skip'
+POLICIES = (CATCH_UP, SKIP)
+# SKIP 策略下迟到多久的 cue 被丢弃(秒)
+LATE_LIMIT = 0.05
+# 截止时刻前最后这段时间忙等而不是 sleep，避开系统定时器的粒度(秒)
+SPIN_TIME = 0.002
+# 单次 sleep 的上限(秒)，长间隔中也能及时响应停止
+MAX_SLEEP = 0.5
+
+log = logging.getLogger(__name__)
+
+CUE_LATENESS = REGISTRY.histogram(
+    'fireworks_cue_lateness_seconds', '时间线 cue 实际写出时刻 - 截止时刻',
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+             0.1, 0.25, 1.0))
+CUES = REGISTRY.counter('fireworks_cues_total', '时间线 cue 计数', labels=('result',))
+
+
+def load_show(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class CompiledShow:
+    """排好序、已编码的 cue 数组
+
+    offsets[i] 为第 i 个 cue 的起播时刻(开场后纳秒)，leads[i] 为命令传输 + 解析
+    所需的纳秒数，写出时刻 = offsets[i] - leads[i]。
+    """
+    __slots__ = ('name', 'protocol', 'offsets', 'leads', 'commands', 'effects')
+
+    def __init__(self, name, protocol, offsets, leads, commands, effects):
+        self.name = name
+        self.protocol = protocol
+        self.offsets = offsets
+        self.leads = leads
+        self.commands = commands
+        self.effects = effects
+
+    def __len__(self):
+        return len(self.commands)
+
+    @property
+    def duration(self):
+        """最后一个 cue 播完的时刻(秒)"""
+        if not self.effects:
+            return 0.0
+        return self.offsets[-1] / 1e9 + self.effects[-1].duration()
+
+    def overlaps(self):
+        """起播时上一个效果按预测仍在播放的 cue 序号 (固件播放期间收到的命令会被丢弃)"""
+        return [i for i in range(1, len(self))
+                if self.offsets[i - 1] / 1e9 + self.effects[i - 1].duration() >
+                self.offsets[i] / 1e9]
+
+
+def compile_show(show, effects=None, protocol=PROTOCOL_TEXT, baudrate=115200):
+    """秀文件路径 / 字典 / (秒, 效果或ID) 列表 -> CompiledShow
+
+    effects 为 ID -> FireworkEffect (如 FireworkController.effects_data)，用于解析ID。
+    """
+    if isinstance(show, str):
+        show = load_show(show)
+    if isinstance(show, dict):
+        name = show.get('name', '')
+        cues = [(cue['at'], cue['effect']) for cue in show['cues']]
+    else:
+        name = ''
+        cues = list(show)
+    resolved = []
+    for i, (at, effect) in enumerate(cues):
+        at = float(at)
+        if at < 0:
+            raise ValueError(f"cue {i}: negative offset {at}")
+        if isinstance(effect, dict):
+            effect = FireworkEffect.from_json(effect)
+        elif not isinstance(effect, FireworkEffect):
+            if effects is None or int(effect) not in effects:
+                raise KeyError(f"cue {i}: unknown effect {effect}")
+            effect = effects[int(effect)]
+        resolved.append((round(at * 1e9), i, effect))
+    resolved.sort(key=lambda cue: cue[:2])
+
+    offsets = array('q')
+    leads = array('q')
+    commands = []
+    effect_list = []
+    for offset, _, effect in resolved:
+        data = effect.wire(protocol)
+        offsets.append(offset)
+        leads.append(round(command_latency(data, baudrate, text=protocol == PROTOCOL_TEXT) * 1e9))
+        commands.append(data)
+        effect_list.append(effect)
+    compiled = CompiledShow(name, protocol, offsets, leads, commands, effect_list)
+    overlaps = compiled.overlaps()
+    if overlaps:
+        log.warning("Show %r: %d cues start while the previous effect is still playing",
+                    name, len(overlaps))
+    return compiled
+
+
+class ShowRunner:
+    """按绝对截止时刻写出 CompiledShow 的 cue
+
+    write(bytes) 负责写串口；clock 与 sleep 可替换为模拟时钟(纳秒 / 秒)。
+    """
+
+    def __init__(self, show, write, policy=CATCH_UP, late_limit=LATE_LIMIT,
+                 clock=time.monotonic_ns, sleep=time.sleep, spin=SPIN_TIME):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r}, expected one of {POLICIES}")
+        self.show = show
+        self.write = write
+        self.policy = policy
+        self.late_limit = round(late_limit * 1e9)
+        self.clock = clock
+        self.sleep = sleep
+        self.spin = round(spin * 1e9)
+        self.start = None
+        self.position = 0        # 下一个 cue 的序号
+        self.fired = 0
+        self.skipped = 0
+        self.lateness = array('q')  # 每个已写出 cue 的迟到纳秒数
+        self.stats_lateness = LatencyStats()
+
+    def wait_until(self, deadline, stop=None):
+        """等到 deadline (clock 纳秒)；被 stop 打断时返回 False"""
+        clock, sleep, spin = self.clock, self.sleep, self.spin
+        while True:
+            if stop is not None and stop.is_set():
+                return False
+            remaining = deadline - clock()
+            if remaining <= 0:
+                return True
+            if remaining > spin:
+                sleep(min(remaining - spin, MAX_SLEEP * 1e9) / 1e9)
+            else:
+                sleep(0)
+
+    def run(self, stop=None, start=None):
+        """阻塞播放到最后一个 cue 或 stop (threading.Event) 被设置；返回 self
+
+        start 为开场时刻(clock 纳秒)，默认为当前时刻，开头的 cue 来不及提前写出时顺延；
+        中途停止后再次调用 run() 从下一个 cue 继续。
+        """
+        show = self.show
+        if self.start is None:
+            if start is None:
+                start = self.clock() + max(0, max((lead - offset for lead, offset in
+                                                   zip(show.leads, show.offsets)), default=0))
+            self.start = start
+        offsets, leads, commands = show.offsets, show.leads, show.commands
+        while self.position < len(show):
+            i = self.position
+            deadline = self.start + offsets[i] - leads[i]
+            if not self.wait_until(deadline, stop):
+                break
+            late = self.clock() - deadline
+            self.position += 1
+            if late > self.late_limit and self.policy == SKIP:
+                self.skipped += 1
+                CUES.inc('skipped')
+                continue
+            self.write(commands[i])
+            self.fired += 1
+            self.lateness.append(late)
+            self.stats_lateness.add(late / 1e9)
+            CUE_LATENESS.observe(late / 1e9)
+            CUES.inc('fired')
+        return self
+
+    @property
+    def finished(self):
+        return self.position >= len(self.show)
+
+    def stats(self):
+        return {
+            'cues': len(self.show),
+            'fired': self.fired,
+            'skipped': self.skipped,
+            'policy': self.policy,
+            'lateness': self.stats_lateness.summary(),
+            'max_late_ms': max(self.lateness) / 1e6 if self.lateness else None,
+        }
@@ -0,0 +1,376 @@
+"""固件上报的测试数据 (T,<类型>,<名称>,<数值>...) 的定长环形缓冲区
+
+每个数值是一个样本: 单调时钟纳秒(q) | 序列号(H) | 数值(d)，存放在预先分配的
+array 中，写满后覆盖最旧的样本，内存不随运行时间增长。序列为 (类型, 名称, 第几个数值)，
+不是数字的数值记为 NaN，没有数值的消息记一个 NaN 样本(只计入次数)。
+
+后台线程每 flush_interval 秒把新样本追加到磁盘上的分段文件，按大小或时长轮换，
+超过保留期的分段删除。分段文件格式 (小端):
+    文件头 : 魔数 b'FWTL' | 版本(H)
+    块     : 类型(B) | 长度(I) | 内容
+             BLOCK_SERIES  序列号(H) + "类型,名称,序号" (UTF-8)
+             BLOCK_SAMPLES 若干条 墙钟纳秒(q) | 序列号(H) | 数值(d)
+
+窗口查询 (rate / rate_per_minute / window_stats) 按时间二分定位后直接在缓冲区上遍历，
+不复制缓冲区。
+"""
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+from itertools import chain
+
+from metrics import REGISTRY
+
+# 缓冲区容量(样本数)，每个样本 18 字节
+CAPACITY = 1 << 18
+# 后台写盘的间隔(秒)
+FLUSH_INTERVAL = 5.0
+# 分段文件超过该大小或时长后轮换
+SEGMENT_BYTES = 16 * 2**20
+SEGMENT_SECONDS = 3600
+# 分段文件保留时长(秒)
+RETENTION = 7 * 24 * 3600
+# 序列号为 H，最多 65535 个序列
+MAX_SERIES = 0xFFFF
+
+MAGIC = b'FWTL'
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct('<4sH')
+BLOCK = struct.Struct('<BI')
+BLOCK_SERIES = 1
+BLOCK_SAMPLES = 2
+SERIES_ID = struct.Struct('<H')
+SAMPLE = struct.Struct('<qHd')
+SEGMENT_EXT = '.seg'
+
+log = logging.getLogger(__name__)
+
+TELEMETRY_SAMPLES = REGISTRY.counter('fireworks_telemetry_samples_total', '测试数据样本计数',
+                                     labels=('result',))
+FLUSH_SECONDS = REGISTRY.histogram('fireworks_telemetry_flush_seconds', '测试数据写盘的耗时')
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return math.nan
+
+
+def read_segment(path):
+    """读出分段文件，返回 [(墙钟纳秒, (类型, 名称, 序号), 数值), ...]"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version = SEGMENT_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a telemetry segment")
+    series = {}
+    samples = []
+    offset = SEGMENT_HEADER.size
+    # 最后一块可能只写了一半(写盘时断电)，忽略
+    while offset + BLOCK.size <= len(data):
+        kind, length = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        if offset + length > len(data):
+            break
+        if kind == BLOCK_SERIES:
+            (series_id,) = SERIES_ID.unpack_from(data, offset)
+            kind_, name, index = bytes(data[offset + SERIES_ID.size:offset + length]) \
+                .decode('utf-8').rsplit(',', 2)
+            series[series_id] = (kind_, name, int(index))
+        elif kind == BLOCK_SAMPLES:
+            for wall, series_id, value in SAMPLE.iter_unpack(data[offset:offset + length]):
+                samples.append((wall, series[series_id], value))
+        offset += length
+    return samples
+
+
+class TelemetryStore:
+    """测试数据的环形缓冲区 + 后台分段写盘
+
+    directory 为 None 时只保留在内存中。clock 返回单调纳秒，可替换为模拟时钟；
+    background 为 False 时不启动写盘线程，由调用方调用 flush()。
+    """
+
+    def __init__(self, directory=None, capacity=CAPACITY, flush_interval=FLUSH_INTERVAL,
+                 segment_bytes=SEGMENT_BYTES, segment_seconds=SEGMENT_SECONDS,
+                 retention=RETENTION, clock=time.monotonic_ns, background=True):
+        self.directory = directory
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention = retention
+        self.clock = clock
+        self.background = background
+        # 单调时钟 -> 墙钟 的差值，写盘时换算
+        self.wall_offset = time.time_ns() - clock()
+        zeros = bytes(capacity * 8)
+        self.times = array('q', zeros)
+        self.values = array('d', zeros)
+        self.series_ids = array('H', bytes(capacity * 2))
+        self.total = 0     # 累计写入的样本数，下一个样本位于 total % capacity
+        self.series = {}   # (类型, 名称, 序号) -> 序列号
+        self.series_keys = []
+        self.dropped_series = 0
+        self.flushed = 0   # 已写盘的样本数(按 total 计)
+        self.lost = 0      # 写盘前就被覆盖的样本数
+        self.segments = []
+        self._segment = None
+        self._segment_start = None
+        self._segment_series = set()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = False
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.segments = sorted(file for file in os.listdir(directory)
+                                   if file.endswith(SEGMENT_EXT))
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def _series_id(self, key):
+        series_id = self.series.get(key)
+        if series_id is None:
+            if len(self.series_keys) >= MAX_SERIES:
+                return None
+            series_id = self.series[key] = len(self.series_keys)
+            self.series_keys.append(key)
+        return series_id
+
+    def add(self, kind, name, values=(), now=None):
+        """记录一条 T 消息的各个数值；返回记录的样本数"""
+        now = self.clock() if now is None else now
+        values = [_number(v) for v in values] or [math.nan]
+        count = 0
+        with self._lock:
+            for index, value in enumerate(values):
+                series_id = self._series_id((kind, name, index))
+                if series_id is None:
+                    self.dropped_series += 1
+                    continue
+                pos = self.total % self.capacity
+                self.times[pos] = now
+                self.series_ids[pos] = series_id
+                self.values[pos] = value
+                self.total += 1
+                count += 1
+        TELEMETRY_SAMPLES.inc('recorded', amount=count)
+        if self.background and self.directory is not None and self._thread is None:
+            self._start()
+        return count
+
+    # ---------- 窗口查询 ----------
+
+    def _find(self, since):
+        """第一个时间 >= since 的样本的逻辑序号 (0 为缓冲区中最旧的样本)"""
+        size = len(self)
+        first = self.total - size
+        times, capacity = self.times, self.capacity
+        low, high = 0, size
+        while low < high:
+            mid = (low + high) // 2
+            if times[(first + mid) % capacity] < since:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _window(self, window, now):
+        """最近 window 秒内样本的物理位置: 一段或(跨过缓冲区末尾时)两段 range"""
+        now = self.clock() if now is None else now
+        size = len(self)
+        first = self.total - size
+        start = self._find(now - round(window * 1e9))
+        capacity = self.capacity
+        begin = (first + start) % capacity
+        end = begin + size - start
+        if end <= capacity:
+            return (range(begin, end),)
+        return range(begin, capacity), range(0, end - capacity)
+
+    def rate(self, window=60.0, key=None, now=None):
+        """最近 window 秒内每分钟的样本数；key 为 (类型, 名称) 时只统计该序列的首个数值"""
+        with self._lock:
+            ranges = self._window(window, now)
+            if key is None:
+                count = sum(map(len, ranges))
+            else:
+                series_id = self.series.get((*key, 0))
+                ids = self.series_ids
+                count = 0 if series_id is None else sum(
+                    1 for p in chain(*ranges) if ids[p] == series_id)
+        return count * 60.0 / window
+
+    def rate_per_minute(self, minutes=10, now=None):
+        """最近 minutes 分钟每分钟的样本数，最旧的在前"""
+        now = self.clock() if now is None else now
+        counts = [0] * minutes
+        with self._lock:
+            times = self.times
+            base = now - minutes * 60_000_000_000
+            for p in chain(*self._window(minutes * 60, now)):
+                counts[min(minutes - 1, (times[p] - base) // 60_000_000_000)] += 1
+        return counts
+
+    def window_stats(self, window=60.0, now=None):
+        """最近 window 秒内各序列的 次数 / 最小 / 最大 / 平均 (NaN 只计次数)"""
+        acc = {}
+        with self._lock:
+            ids, values = self.series_ids, self.values
+            for p in chain(*self._window(window, now)):
+                value = values[p]
+                entry = acc.get(ids[p])
+                if entry is None:
+                    entry = acc[ids[p]] = [0, math.inf, -math.inf, 0.0, 0]
+                entry[0] += 1
+                if value == value:  # 不是 NaN
+                    if value < entry[1]:
+                        entry[1] = value
+                    if value > entry[2]:
+                        entry[2] = value
+                    entry[3] += value
+                    entry[4] += 1
+            keys = self.series_keys
+        return {keys[series_id]: {'count': count,
+                                  'min': low if numeric else None,
+                                  'max': high if numeric else None,
+                                  'mean': total / numeric if numeric else None}
+                for series_id, (count, low, high, total, numeric) in acc.items()}
+
+    def latest(self, count=10):
+        """最近 count 个样本 [(单调纳秒, (类型, 名称, 序号), 数值), ...]"""
+        with self._lock:
+            count = min(count, len(self))
+            positions = [(self.total - count + i) % self.capacity for i in range(count)]
+            return [(self.times[p], self.series_keys[self.series_ids[p]], self.values[p])
+                    for p in positions]
+
+    # ---------- 写盘 ----------
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._loop, name='telemetry-flush', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if not self._closing:
+                    self._cond.wait(self.flush_interval)
+                closing = self._closing
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Telemetry flush failed")
+            if closing:
+                return
+
+    def flush(self):
+        """把上次写盘之后的样本追加到当前分段文件；返回写出的样本数"""
+        if self.directory is None:
+            return 0
+        with self._lock:
+            total = self.total
+            start = max(self.flushed, total - self.capacity)
+            lost = start - self.flushed
+            keys = list(self.series_keys)
+            wall_offset, capacity = self.wall_offset, self.capacity
+            times, ids, values = self.times, self.series_ids, self.values
+            records = bytearray(SAMPLE.size * (total - start))
+            pack = SAMPLE.pack_into
+            for i, n in enumerate(range(start, total)):
+                p = n % capacity
+                pack(records, i * SAMPLE.size, times[p] + wall_offset, ids[p], values[p])
+        if lost:
+            self.lost += lost
+            TELEMETRY_SAMPLES.inc('lost', amount=lost)
+            log.warning("Telemetry buffer overwrote %d samples before they were flushed", lost)
+        if not records:
+            self.flushed = total
+            return 0
+        with FLUSH_SECONDS.time():
+            f = self._segment_file()
+            # 轮换后的新分段要重新写出所有序列的定义
+            new_series = [(series_id, key) for series_id, key in enumerate(keys)
+                          if series_id not in self._segment_series]
+            for series_id, key in new_series:
+                name = ','.join(map(str, key)).encode('utf-8')
+                f.write(BLOCK.pack(BLOCK_SERIES, SERIES_ID.size + len(name)))
+                f.write(SERIES_ID.pack(series_id) + name)
+                self._segment_series.add(series_id)
+            f.write(BLOCK.pack(BLOCK_SAMPLES, len(records)))
+            f.write(records)
+            f.flush()
+        self.flushed = total
+        TELEMETRY_SAMPLES.inc('flushed', amount=total - start)
+        return total - start
+
+    def _segment_file(self):
+        """当前分段文件；超过大小或时长时轮换并删除过期分段"""
+        now = self.clock()
+        f = self._segment
+        if f is not None and (f.tell() >= self.segment_bytes or
+                              now - self._segment_start >= self.segment_seconds * 1e9):
+            f.close()
+            f = self._segment = None
+        if f is None:
+            wall = (now + self.wall_offset) / 1e9
+            file = f"telemetry_{datetime.fromtimestamp(wall).strftime('%Y%m%d_%H%M%S_%f')}" \
+                   f"{SEGMENT_EXT}"
+            f = self._segment = open(os.path.join(self.directory, file), 'ab')
+            f.write(SEGMENT_HEADER.pack(MAGIC, SEGMENT_VERSION))
+            self._segment_start = now
+            self._segment_series = set()
+            self.segments.append(file)
+            self.expire(now)
+        return f
+
+    def expire(self, now=None):
+        """删除最后一个样本已超过保留期的分段(即下一个分段在保留期之前就已开始)"""
+        now = self.clock() if now is None else now
+        cutoff = now + self.wall_offset - self.retention * 1e9
+        while len(self.segments) > 1 and self._started(self.segments[1]) <= cutoff:
+            try:
+                os.remove(os.path.join(self.directory, self.segments[0]))
+            except FileNotFoundError:
+                pass
+            del self.segments[0]
+
+    @staticmethod
+    def _started(file):
+        """分段文件名中的开始时刻(墙钟纳秒)"""
+        stamp = file[len('telemetry_'):-len(SEGMENT_EXT)]
+        return datetime.strptime(stamp, '%Y%m%d_%H%M%S_%f').timestamp() * 1e9
+
+    def close(self):
+        """停止写盘线程并把剩余样本写完"""
+        thread = self._thread
+        if thread is not None:
+            with self._cond:
+                self._closing = True
+                self._cond.notify()
+            thread.join()
+            self._thread = None
+            self._closing = False
+        self.flush()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def stats(self):
+        return {
+            'samples': self.total,
+            'buffered': len(self),
+            'capacity': self.capacity,
+            'series': len(self.series_keys),
+            'flushed': self.flushed,
+            'lost': self.lost,
+            'segments': len(self.segments),
+        }
@@ -0,0 +1,63 @@
+"""测试公用: 在模拟固件上运行 FireworkController 的读循环"""
+import asyncio
+import contextlib
+import time
+
+import pytest
+
+import control
+from effect_model import FireworkEffect
+from serial_sim import SimulatedArduino
+
+
+def make_effect(seed, **overrides):
+    """按序号生成互不相同的合法效果"""
+    fields = dict(color1=(seed % 256, 40, 80), color2=(200, seed * 7 % 256, 10),
+                  max_brightness=200, launch_mode=seed % 3, gradient_mode=seed // 3 % 3,
+                  explode_mode=seed // 9 % 3, laser_color=seed % 3, mirror_angle=seed % 181,
+                  explosion_led_count=10 + seed % 50, speed_delay=20)
+    fields.update(overrides)
+    return FireworkEffect(**fields)
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("simulated firmware did not respond")
+        await asyncio.sleep(0.001)
+
+
+@contextlib.asynccontextmanager
+async def running(controller):
+    """run_async 在后台运行，握手完成后交给测试；退出时停止读循环"""
+    task = asyncio.create_task(controller.run_async())
+    try:
+        await wait_for(lambda: controller.protocol != control.PROTOCOL_TEXT)
+        yield controller
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+@pytest.fixture
+def new_controller(tmp_path):
+    """工厂: 在同一个数据目录上(重新)创建控制器与模拟固件，测试结束时全部关闭"""
+    created = []
+
+    def factory(sequence_interval=control.SEQUENCE_INTERVAL, duplicates=control.DUPLICATES_ALLOW,
+                **sim_options):
+        sim_options.setdefault('timeout', 0.5)
+        sim_options.setdefault('boot_messages', False)
+        sim = SimulatedArduino(**sim_options)
+        controller = control.FireworkController(port=sim, data_dir=str(tmp_path),
+                                                duplicates=duplicates,
+                                                sequence_interval=sequence_interval)
+        created.append((controller, sim))
+        return controller, sim
+
+    yield factory
+    for controller, sim in created:
+        controller.close()
+        sim.close()
@@ -0,0 +1,65 @@
+"""出站队列: 同 key 的命令合并、队列满时丢弃、固件报告丢掉的字节"""
+import asyncio
+
+from conftest import make_effect, running, wait_for
+from show_pipeline import MAX_PENDING, ShowPipeline
+
+
+def test_only_latest_preview_plays_while_firmware_is_busy(new_controller):
+    controller, sim = new_controller(effect_duration=0.1)
+    first, previews = make_effect(0), [make_effect(i) for i in range(1, 6)]
+
+    async def run():
+        async with running(controller):
+            controller.preview(first)
+            await wait_for(lambda: sim.busy)
+            for effect in previews:
+                controller.preview(effect)
+            await wait_for(lambda: len(sim.played) >= 2 and controller.pipeline.idle)
+    asyncio.run(run())
+    assert [record.fields for record in sim.played] == [first.fields(), previews[-1].fields()]
+    assert controller.pipeline.coalesced == len(previews) - 1
+    assert sim.rx_overruns == 0 and controller.pipeline.overrun_bytes == 0
+
+
+def test_full_queue_drops_sequence_items_and_keypad_evicts_newest():
+    sent = []
+    pipeline = ShowPipeline(sent.append, max_pending=2)
+    effects = [make_effect(i) for i in range(5)]
+    assert pipeline.enqueue(effects[0])      # 立即发出，在途
+    assert pipeline.enqueue(effects[1])
+    assert pipeline.enqueue(effects[2])
+    assert not pipeline.enqueue(effects[3])  # 队列满，丢弃
+    assert pipeline.enqueue(effects[4], urgent=True)  # 点播挤掉队尾
+    assert sent == [effects[0]]
+    assert list(pipeline.pending) == [effects[4], effects[1]]
+    assert pipeline.dropped == 2
+
+
+def test_firmware_reports_commands_discarded_while_playing(new_controller):
+    controller, sim = new_controller(effect_duration=0.1)
+
+    async def run():
+        async with running(controller):
+            controller.preview(make_effect(0))
+            await wait_for(lambda: sim.busy)
+            sim.write(make_effect(1).wire())  # 绕过出站队列，播放期间直接写串口
+            await wait_for(lambda: controller.pipeline.overrun_bytes)
+    asyncio.run(run())
+    assert controller.pipeline.overrun_bytes == len(make_effect(1).wire()) - 1
+    assert len(sim.played) == 1
+
+
+def test_playlist_longer_than_the_queue_plays_every_effect(new_controller):
+    controller, sim = new_controller(protocol_version=1)
+    effects = [make_effect(i) for i in range(MAX_PENDING + 44)]
+
+    async def run():
+        async with running(controller):
+            assert controller.play_playlist(effects) == len(effects)
+            assert len(controller.pipeline.pending) <= 1
+            await wait_for(lambda: len(sim.played) >= len(effects), timeout=30)
+    asyncio.run(run())
+    assert [record.fields for record in sim.played] == [e.fields() for e in effects]
+    assert controller.pipeline.dropped == 0
+    assert not controller.playlist
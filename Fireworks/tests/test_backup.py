@@ -0,0 +1,35 @@
+"""后台备份与调用方线程的 flush / restore 并发时结果一致"""
+import threading
+
+from effect_store import EffectStore
+
+
+def test_flush_and_restore_race_with_background_backups(tmp_path):
+    store = EffectStore(str(tmp_path), compact_every=1)
+    store.backup.debounce = 0.0
+    effects = {}
+    stop = threading.Event()
+    errors = []
+
+    def restore_loop():
+        while not stop.is_set():
+            try:
+                restored = store.restore_backup()
+                assert all(restored[k] == {'n': k} for k in restored)
+            except Exception as e:  # 线程中的失败交给主线程断言
+                errors.append(e)
+                return
+
+    reader = threading.Thread(target=restore_loop)
+    reader.start()
+    try:
+        for i in range(1, 101):
+            effects[i] = {'n': i}
+            if store.append(i, effects[i]):
+                store.compact(effects)
+    finally:
+        stop.set()
+        reader.join()
+    store.close()
+    assert not errors
+    assert store.restore_backup() == effects
@@ -0,0 +1,50 @@
+"""播放列表整批上传: 固件本地连续播放，逐项回复进度，超过缓冲区时分批"""
+import asyncio
+
+from conftest import make_effect, running, wait_for
+from wire_protocol import MAX_BATCH_ITEMS
+
+
+def play_playlist(new_controller, effects, gaps=None, **sim_options):
+    controller, sim = new_controller(**sim_options)
+    uploads = []
+    send_effect = controller.send_effect
+    controller.pipeline.send = lambda item: (uploads.append(item), send_effect(item))
+
+    async def run():
+        async with running(controller):
+            controller.play_playlist(effects, gaps)
+            await wait_for(lambda: len(sim.played) >= len(effects)
+                           and controller.pipeline.idle and not controller.pipeline.pending)
+    asyncio.run(run())
+    return controller, sim, uploads
+
+
+def test_playlist_uploads_one_batch_and_plays_in_order(new_controller):
+    effects = [make_effect(i) for i in range(5)]
+    gaps = [30, 0, 30, 0, 0]
+    controller, sim, uploads = play_playlist(new_controller, effects, gaps,
+                                            effect_duration=0.01)
+    assert len(uploads) == 1
+    assert [record.fields for record in sim.played] == [e.fields() for e in effects]
+    assert controller.pipeline.batch_items == len(effects)
+    assert controller.pipeline.completed == 1
+    records = sim.played
+    idle = [b.started - a.finished for a, b in zip(records, records[1:])]
+    assert idle[0] >= 0.03 * 0.9 and idle[2] >= 0.03 * 0.9
+    assert idle[1] < 0.03
+
+
+def test_long_playlist_is_split_into_batches(new_controller):
+    effects = [make_effect(i) for i in range(MAX_BATCH_ITEMS + 3)]
+    controller, sim, uploads = play_playlist(new_controller, effects)
+    assert len(uploads) == 2
+    assert [record.fields for record in sim.played] == [e.fields() for e in effects]
+
+
+def test_v1_firmware_plays_playlist_per_effect(new_controller):
+    effects = [make_effect(i) for i in range(4)]
+    controller, sim, uploads = play_playlist(new_controller, effects, protocol_version=1)
+    assert len(uploads) == len(effects)
+    assert [record.fields for record in sim.played] == [e.fields() for e in effects]
+    assert controller.pipeline.batch_items == 0
@@ -0,0 +1,31 @@
+"""二级索引: 删除效果后按模式、按时间都查不到它"""
+from conftest import make_effect
+from effect_index import EffectIndex
+
+
+def test_removed_effect_is_gone_from_built_indexes():
+    effects = {i: make_effect(i * 3, id=i, timestamp=f"2024-01-01T00:00:{i:02d}")
+               for i in range(1, 6)}
+    index = EffectIndex.from_effects(effects)
+    mode = effects[2].launch_mode
+    assert 2 in index.ids_with(launch_mode=mode)
+    assert index.ids_between("2024-01-01T00:00:00", "2024-01-01T00:01:00") == [1, 2, 3, 4, 5]
+
+    index.remove(2)
+    del effects[2]
+    assert 2 not in index.ids_with(launch_mode=mode)
+    assert index.ids_between("2024-01-01T00:00:00", "2024-01-01T00:01:00") == [1, 3, 4, 5]
+    assert index.allocate_id() == 6
+
+
+def test_controller_delete_updates_the_index(new_controller):
+    controller, _ = new_controller()
+    for i in range(3):
+        controller.process_message("S," + ",".join(map(str, make_effect(i * 3).fields())))
+    mode = controller.effects_data[2].launch_mode
+    assert controller.index.ids_with(launch_mode=mode) == {1, 2, 3}
+
+    assert controller.delete_effect(2)
+    assert controller.index.ids_with(launch_mode=mode) == {1, 3}
+    assert 2 not in controller.effects_data
+    assert not controller.delete_effect(2)
@@ -0,0 +1,31 @@
+"""消息计时只在导出指标时抽样进行；状态量按控制器分标签，关闭时注销"""
+import control
+
+
+def test_message_timing_is_off_until_enabled_then_sampled(new_controller):
+    controller, _ = new_controller()
+    controller.register_handler('X', lambda parts: None)
+    before = control.MESSAGE_SECONDS.count('X')
+    for _ in range(64):
+        controller.process_message('X,1')
+    assert control.MESSAGE_SECONDS.count('X') == before
+
+    controller.enable_message_timing(every=16)
+    for _ in range(64):
+        controller.process_message('X,1')
+    assert control.MESSAGE_SECONDS.count('X') == before + 4
+    assert controller.message_counts['X'] == 128
+
+
+def test_each_controller_exports_its_own_gauges_until_closed(new_controller):
+    first, _ = new_controller()
+    second, _ = new_controller()
+    assert first.metrics_name != second.metrics_name
+    first.playlist.extend([None] * 3)
+    assert control.QUEUE_DEPTH.value(first.metrics_name, 'playlist') == 3
+    assert control.QUEUE_DEPTH.value(second.metrics_name, 'playlist') == 0
+
+    first.close()
+    for metric in (control.QUEUE_DEPTH, control.DUTY_CYCLE, control.SHOW_COMMANDS):
+        assert not [labels for labels in metric.functions if labels[0] == first.metrics_name]
+    assert (second.metrics_name, 'playlist') in control.QUEUE_DEPTH.functions
@@ -0,0 +1,42 @@
+"""协议协商: 握手成功用二进制帧，固件不回复时超时后退回文本 P 命令"""
+import asyncio
+import contextlib
+
+import control
+from conftest import make_effect, wait_for
+from wire_protocol import PROTOCOL_TEXT, PROTOCOL_VERSION
+
+
+def play_one(controller, sim, effect, ready):
+    async def run():
+        task = asyncio.create_task(controller.run_async())
+        try:
+            await wait_for(ready)
+            controller.preview(effect)
+            await wait_for(lambda: sim.played)
+        finally:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+    asyncio.run(run())
+
+
+def test_binary_firmware_negotiates_frames(new_controller):
+    controller, sim = new_controller()
+    effect = make_effect(1)
+    play_one(controller, sim, effect,
+             lambda: controller.protocol == PROTOCOL_VERSION)
+    assert controller.protocol == PROTOCOL_VERSION
+    assert [record.fields for record in sim.played] == [effect.fields()]
+
+
+def test_silent_firmware_falls_back_to_text(monkeypatch, new_controller):
+    monkeypatch.setattr(control, 'NEGOTIATE_TIMEOUT', 0.6)
+    controller, sim = new_controller(binary=False)  # 不回复握手、不认二进制帧的旧固件
+    effect = make_effect(2)
+    # 握手超时之前流水线暂停，效果先排队，退回文本后才发出
+    play_one(controller, sim, effect,
+             lambda: controller.next_hello_time is not None)
+    assert controller.protocol == PROTOCOL_TEXT
+    assert controller.next_hello_time is None
+    assert [tuple(record.fields) for record in sim.played] == [effect.fields()]
@@ -0,0 +1,59 @@
+"""保存 -> 重启 -> 点播: 效果ID 跨重启保持不变，删除的ID 不再分配"""
+import asyncio
+
+from conftest import make_effect, running, wait_for
+
+
+def test_saved_effect_plays_after_restart(new_controller):
+    effect = make_effect(1)
+
+    async def save():
+        controller, sim = new_controller()
+        async with running(controller):
+            sim.save_effect(effect)
+            await wait_for(lambda: len(controller.effects_data) == 1)
+        effect_id, = controller.effects_data
+        controller.close()
+        return effect_id
+
+    async def replay(effect_id):
+        controller, sim = new_controller()
+        assert effect_id in controller.effects_data
+        async with running(controller):
+            sim.request_play(effect_id)
+            await wait_for(lambda: sim.played)
+        return sim.played
+
+    effect_id = asyncio.run(save())
+    played = asyncio.run(replay(effect_id))
+    assert [record.fields for record in played] == [effect.fields()]
+
+
+def test_deleted_ids_are_not_reused_after_restart(new_controller):
+    controller, _ = new_controller()
+    for i in range(3):
+        controller.process_message("S," + ",".join(map(str, make_effect(i).fields())))
+    assert sorted(controller.effects_data) == [1, 2, 3]
+    controller.delete_effect(3)
+    controller.close()
+
+    controller, _ = new_controller()
+    assert sorted(controller.effects_data) == [1, 2]
+    controller.process_message("S," + ",".join(map(str, make_effect(9).fields())))
+    assert sorted(controller.effects_data) == [1, 2, 4]
+
+
+def test_torn_journal_tail_does_not_swallow_later_saves(new_controller):
+    controller, _ = new_controller()
+    controller.process_message("S," + ",".join(map(str, make_effect(1).fields())))
+    controller.close()
+    with open(controller.store.journal_file, 'a') as f:
+        f.write('{"id":2,"effect":{"col')  # 崩溃时写了一半
+
+    controller, _ = new_controller()
+    controller.process_message("S," + ",".join(map(str, make_effect(2).fields())))
+    controller.close()
+
+    controller, _ = new_controller()
+    assert sorted(controller.effects_data) == [1, 2]
+    assert controller.effects_data[2].fields() == make_effect(2).fields()
@@ -0,0 +1,34 @@
+"""多台控制器: 每个端点经串口会话握手，不支持握手的固件退回文本协议"""
+import asyncio
+
+import controller_pool
+from conftest import make_effect, wait_for
+from controller_pool import ControllerPool
+from serial_sim import SimulatedArduino
+from wire_protocol import PROTOCOL_TEXT, PROTOCOL_VERSION
+
+
+def test_units_negotiate_through_their_sessions(monkeypatch):
+    monkeypatch.setattr(controller_pool, 'NEGOTIATE_TIMEOUT', 0.6)
+    sims = {'binary': SimulatedArduino(timeout=0.5, boot_messages=False),
+            'text': SimulatedArduino(timeout=0.5, boot_messages=False, binary=False)}
+    pool = ControllerPool(sims)
+    effect = make_effect(1)
+
+    async def run():
+        stop = asyncio.Event()
+        task = asyncio.create_task(pool.run_async(stop))
+        await wait_for(lambda: pool.ready)
+        pool.broadcast(effect)
+        await wait_for(lambda: all(sim.played for sim in sims.values()))
+        stop.set()
+        await task
+    try:
+        asyncio.run(run())
+    finally:
+        for sim in sims.values():
+            sim.close()
+    assert pool.units['binary'].protocol == PROTOCOL_VERSION
+    assert pool.units['text'].protocol == PROTOCOL_TEXT
+    for sim in sims.values():
+        assert [record.fields for record in sim.played] == [effect.fields()]
@@ -0,0 +1,53 @@
+"""烟花长河: 按回执推进，可选的 sequence_interval 停顿"""
+import asyncio
+
+import pytest
+
+from conftest import make_effect, running, wait_for
+
+INTERVAL = 0.05
+
+
+def play_sequence(new_controller, count, protocol_version, **options):
+    controller, sim = new_controller(protocol_version=protocol_version, effect_duration=0.01,
+                                     **options)
+    controller.effects_data = {i: make_effect(i) for i in range(1, count + 1)}
+
+    async def run():
+        async with running(controller):
+            sim.set_mode('IDLE')
+            await wait_for(lambda: len(sim.played) >= count)
+    asyncio.run(run())
+    records = sim.played
+    return [b.started - a.finished for a, b in zip(records, records[1:])]
+
+
+@pytest.mark.parametrize('protocol_version', [1, 2])
+def test_sequence_interval_pauses_after_each_effect(new_controller, protocol_version):
+    gaps = play_sequence(new_controller, 4, protocol_version, sequence_interval=INTERVAL)
+    assert len(gaps) == 3
+    assert min(gaps) >= INTERVAL * 0.9
+
+
+def test_sequence_plays_back_to_back_by_default(new_controller):
+    gaps = play_sequence(new_controller, 4, 1)
+    assert max(gaps) < INTERVAL
+
+
+def test_sequence_keeps_the_read_loop_responsive(new_controller):
+    controller, sim = new_controller(protocol_version=1, effect_duration=0.1)
+    controller.effects_data = {i: make_effect(i) for i in range(1, 6)}
+
+    async def run():
+        async with running(controller):
+            sim.set_mode('IDLE')
+            await wait_for(lambda: sim.busy)
+            # 播放期间到达的消息立即处理，模式切换停止后续烟花
+            sim.send_test_data('SENSOR', 'light', 1)
+            await wait_for(lambda: controller.message_counts['T'])
+            assert len(sim.played) < 5
+            sim.set_mode('CUSTOMIZE')
+            await wait_for(lambda: not controller.is_sequence_playing)
+            await wait_for(lambda: controller.pipeline.idle)
+    asyncio.run(run())
+    assert len(sim.played) < 5
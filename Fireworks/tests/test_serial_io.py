@@ -0,0 +1,16 @@
+"""异步串口收发: 读串口出错时读循环退出并抛出，而不是一直等待"""
+import asyncio
+
+import pytest
+
+
+def test_read_error_ends_the_read_loop(new_controller):
+    controller, sim = new_controller()
+
+    def unplugged(size=1):
+        raise OSError("device disconnected")
+    sim.read = unplugged
+
+    with pytest.raises(OSError, match="device disconnected"):
+        asyncio.run(asyncio.wait_for(controller.run_async(), timeout=5))
+    assert controller.transport is None
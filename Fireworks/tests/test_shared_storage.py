@@ -0,0 +1,43 @@
+"""control.py 与 control_test.py 共用同一份效果存储，交替保存不会互相覆盖"""
+import control
+import control_test
+from conftest import make_effect
+from serial_sim import SimulatedArduino
+
+
+def test_both_tools_keep_each_others_effects(tmp_path):
+    data_dir = str(tmp_path)
+    sim = SimulatedArduino(timeout=0.5, boot_messages=False)
+
+    # control.py 保存两个效果 (第一个写快照，第二个只在日志中)
+    controller = control.FireworkController(port=sim, data_dir=data_dir,
+                                            duplicates=control.DUPLICATES_ALLOW)
+    for i in range(2):
+        controller.process_message("S," + ",".join(map(str, make_effect(i).fields())))
+    controller.close()
+
+    # control_test.py 读入后加一个效果并压缩
+    tool = control_test.FireworkController(port=sim, data_dir=data_dir)
+    assert sorted(tool.effects_data) == [1, 2]
+    tool.effects_data[3] = make_effect(3, id=3)
+    tool.save_to_file()
+    tool.store.close()
+
+    # control.py 重新加载: 三个效果都在，接着保存不会重用ID
+    controller = control.FireworkController(port=sim, data_dir=data_dir,
+                                            duplicates=control.DUPLICATES_ALLOW)
+    try:
+        assert sorted(controller.effects_data) == [1, 2, 3]
+        assert controller.effects_data[1].fields() == make_effect(0).fields()
+        assert controller.effects_data[3].fields() == make_effect(3).fields()
+        controller.process_message("S," + ",".join(map(str, make_effect(4).fields())))
+        assert sorted(controller.effects_data) == [1, 2, 3, 4]
+    finally:
+        controller.close()
+        sim.close()
+
+    tool = control_test.FireworkController(port=sim, data_dir=data_dir)
+    try:
+        assert sorted(tool.effects_data) == [1, 2, 3, 4]
+    finally:
+        tool.store.close()
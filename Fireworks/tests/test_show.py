@@ -0,0 +1,30 @@
+"""秀播放期间不发握手、握手回复也不恢复流水线；秀结束后才恢复"""
+import time
+
+from conftest import make_effect
+from wire_protocol import hello_command
+
+
+def test_handshake_waits_until_the_show_ends(new_controller):
+    controller, sim = new_controller()
+    writes = []
+    write = sim.write
+    sim.write = lambda data: (writes.append(bytes(data)), write(data))[1]
+    cues = [make_effect(1), make_effect(2)]
+    runner = controller.play_show([(0.0, cues[0]), (0.2, cues[1])])
+
+    # 握手到了重发时刻，但秀的线程正在写 cue
+    controller.next_hello_time = time.monotonic()
+    controller.hello_deadline = controller.next_hello_time + 5
+    controller.update_negotiation()
+    assert hello_command() not in writes
+    # 迟到的握手回复不能让流水线在秀中间恢复发送
+    controller.handle_hello(['2'])
+    assert controller.pipeline.paused
+
+    deadline = time.monotonic() + 5
+    while controller.show_runner is runner and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert controller.show_runner is None
+    assert not controller.pipeline.paused
+    assert writes == [effect.wire() for effect in cues]
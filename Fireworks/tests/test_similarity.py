@@ -0,0 +1,95 @@
+"""近似重复索引: 由库文件的列建立的索引与逐个加入的一致，保存的重复不进索引，
+整库去重与按ID顺序逐个查找的结果相同"""
+import random
+
+import pytest
+
+import control
+import effect_similarity
+from conftest import make_effect
+from effect_columns import EffectColumns
+from effect_library import MappedEffectStore
+from effect_model import FireworkEffect
+from effect_similarity import SimilarityIndex
+
+
+def _library(count):
+    # 每 4 个效果只差一点颜色，互为近似重复
+    return {i: make_effect(i // 4, color1=(i // 4 % 256, 40 + i % 4, 80), id=i)
+            for i in range(1, count + 1)}
+
+
+def test_index_from_columns_matches_from_effects():
+    effects = _library(400)
+    by_effect = SimilarityIndex.from_effects(effects)
+    by_column = SimilarityIndex.from_columns(EffectColumns.from_effects(effects))
+    assert len(by_column) == len(by_effect) == 400
+    for index in (by_effect, by_column):
+        index.remove(5)
+        index.add(6, make_effect(999))
+    assert len(by_column) == len(by_effect) == 399
+    for effect in [*effects.values(), make_effect(999)]:
+        assert by_column.find_all(effect) == by_effect.find_all(effect)
+
+
+def test_library_columns_skip_deleted_and_include_overlay(tmp_path):
+    effects = _library(50)
+    store = MappedEffectStore(str(tmp_path))
+    store.compact(effects)
+    store.close()
+    store = MappedEffectStore(str(tmp_path))
+    library = store.load()
+    try:
+        del library[3]
+        library[7] = make_effect(77, id=7)
+        library[60] = make_effect(60, id=60)
+        columns = library.to_columns()
+        assert sorted(columns.ids) == sorted(library)
+        assert {effect.id: effect.fields() for effect in columns.effects()} == \
+            {effect_id: effect.fields() for effect_id, effect in library.items()}
+        del columns
+    finally:
+        store.close()
+
+
+def test_saved_near_duplicates_are_flagged_but_not_indexed(new_controller):
+    controller, _ = new_controller(duplicates=control.DUPLICATES_FLAG)
+    for i in range(20):
+        controller.process_message("S," + ",".join(map(str, make_effect(i).fields())))
+    controller.close()
+
+    # 重启后索引在后台由库文件建立
+    controller, _ = new_controller(duplicates=control.DUPLICATES_FLAG)
+    near = make_effect(4, speed_delay=22)
+    for _ in range(3):
+        controller.process_message("S," + ",".join(map(str, near.fields())))
+    assert controller.near_duplicates == {21: 5, 22: 5, 23: 5}
+    assert len(controller.similarity) == 20
+
+
+def _clustered(count, clusters, seed=7):
+    """少数几簇互相微调出来的效果，同一个桶里挤着几十上百个"""
+    rng = random.Random(seed)
+    jitter = lambda value, amount, high: min(high, max(0, value + rng.randint(-amount, amount)))
+    effects = {}
+    for i in range(1, count + 1):
+        if i <= clusters:
+            effects[i] = make_effect(i * 37, id=i)
+            continue
+        base = effects[rng.randrange(1, i)]
+        effects[i] = FireworkEffect(
+            (jitter(base.color1[0], 12, 255), base.color1[1], base.color1[2]), base.color2,
+            jitter(base.max_brightness, 12, 255), base.launch_mode, base.gradient_mode,
+            base.explode_mode, base.laser_color, jitter(base.mirror_angle, 4, 180),
+            jitter(base.explosion_led_count, 4, 280), jitter(base.speed_delay, 1, 0xFFFF),
+            id=i)
+    return effects
+
+
+@pytest.mark.parametrize('pairs_per_effect', [10 ** 6, 0], ids=['vectorized', 'fallback'])
+def test_dedupe_of_crowded_buckets_matches_sequential(monkeypatch, pairs_per_effect):
+    monkeypatch.setattr(effect_similarity, 'MAX_PAIRS_PER_EFFECT', pairs_per_effect)
+    columns = EffectColumns.from_effects(_clustered(2000, 20))
+    sequential = SimilarityIndex()._duplicates_sequential(columns)
+    assert len(sequential) > 1000
+    assert SimilarityIndex().duplicates_in(columns) == sequential
@@ -0,0 +1,59 @@
+"""快照 + 日志存储: 重放日志时跳过损坏的行，截掉崩溃时写了一半的最后一行"""
+import json
+
+from effect_store import EffectStore
+
+
+def _store(path):
+    # 默认编解码原样存取字典，不经过 FireworkEffect
+    return EffectStore(str(path), background_backups=False)
+
+
+def test_journal_replays_over_the_snapshot(tmp_path):
+    store = _store(tmp_path)
+    store.compact({1: {'v': 1}, 2: {'v': 2}})
+    store.append(2, {'v': 20})
+    store.append(3, {'v': 3})
+    store.close()
+
+    store = _store(tmp_path)
+    assert store.load() == {1: {'v': 1}, 2: {'v': 20}, 3: {'v': 3}}
+    assert store.next_id == 4
+    store.close()
+
+
+def test_torn_tail_is_truncated_and_later_appends_survive(tmp_path):
+    store = _store(tmp_path)
+    store.append(1, {'v': 1})
+    store.close()
+    with open(store.journal_file, 'a') as f:
+        f.write('{"id": 2, "eff')  # 崩溃时只写了一半
+
+    store = _store(tmp_path)
+    assert store.load() == {1: {'v': 1}}
+    store.append(3, {'v': 3})
+    store.close()
+
+    with open(store.journal_file) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line['id'] for line in lines] == [1, 3]
+    store = _store(tmp_path)
+    assert store.load() == {1: {'v': 1}, 3: {'v': 3}}
+    store.close()
+
+
+def test_corrupt_middle_line_is_skipped_and_missing_newline_added(tmp_path):
+    store = _store(tmp_path)
+    store.close()
+    with open(store.journal_file, 'w') as f:
+        f.write('{"id": 1, "effect": {"v": 1}}\n'
+                'not json\n'
+                '{"id": 2, "effect": {"v": 2}}')  # 完整记录，只差换行
+
+    store = _store(tmp_path)
+    assert store.load() == {1: {'v': 1}, 2: {'v': 2}}
+    store.append(3, {'v': 3})
+    store.close()
+    store = _store(tmp_path)
+    assert store.load() == {1: {'v': 1}, 2: {'v': 2}, 3: {'v': 3}}
+    store.close()
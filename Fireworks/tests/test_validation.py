@@ -0,0 +1,26 @@
+"""多进程检查效果库: 日志中改过的效果以日志为准，快照中的旧记录在各进程中跳过"""
+import pytest
+
+from conftest import make_effect
+from effect_library import MappedEffectStore
+from effect_validation import validate_library
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_journal_records_replace_snapshot_records(tmp_path, workers):
+    effects = {i: make_effect(i, id=i) for i in range(1, 11)}
+    effects[3] = make_effect(3, id=3, speed_delay=1000)
+    store = MappedEffectStore(str(tmp_path))
+    try:
+        store.compact(effects)
+        before = validate_library(store.snapshot_file, store.journal_file,
+                                  workers=workers, chunk_records=2)
+        store.append(3, make_effect(3, id=3))
+        after = validate_library(store.snapshot_file, store.journal_file,
+                                 workers=workers, chunk_records=2)
+    finally:
+        store.close()
+    assert before['flagged'] == {'speed_delay_range': [3]}
+    assert after['chunks'] > 1
+    assert after['effects'] == 10
+    assert after['errors'] == 0
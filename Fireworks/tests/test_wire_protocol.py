@@ -0,0 +1,21 @@
+"""P 命令编码: 效果按协商的协议编码，解码后得到原来的字段"""
+import pytest
+
+import wire_protocol
+from conftest import make_effect
+from wire_protocol import PROTOCOL_TEXT, PROTOCOL_VERSION, decode_play, encode_play
+
+
+@pytest.mark.parametrize('version', [PROTOCOL_TEXT, 1, PROTOCOL_VERSION])
+def test_play_command_round_trips(version):
+    effect = make_effect(5, speed_delay=0xFFFF, mirror_angle=180)
+    data = effect.wire(version)
+    assert data == encode_play(effect.fields(), version)
+    assert tuple(decode_play(data)) == effect.fields()
+
+
+def test_corrupted_frame_is_rejected():
+    frame = bytearray(encode_play(make_effect(1).fields(), PROTOCOL_VERSION))
+    frame[5] ^= 0xFF
+    with pytest.raises(wire_protocol.FrameError):
+        decode_play(bytes(frame))
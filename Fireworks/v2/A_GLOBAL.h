@@ -41,6 +41,23 @@
 #define MSG_PLAY_EFFECT    'P'
 #define MSG_PREVIEW        'V'
 #define MSG_TEST_DATA      'T'
+#define MSG_HELLO          'H'
+#define MSG_EFFECT_DONE    'D'   // 串口点播的效果播放完成回执: D,<毫秒>
+#define MSG_BATCH          'B'   // 批量帧命令；批量中每播完一个回复 B,<序号>,<毫秒>
+#define MSG_OVERRUN        'O'   // 清空接收缓冲区时丢掉了命令字节: O,<字节数>
+
+// 二进制帧: 同步字节 | 版本 | 命令 | 效果负载 | CRC16 (CCITT, 小端)
+#define FRAME_SYNC         0xA5
+#define PROTOCOL_VERSION   2
+#define FRAME_PAYLOAD_SIZE 17
+#define FRAME_SIZE         (3 + FRAME_PAYLOAD_SIZE + 2)
+
+// 批量帧(版本 2 起): 同步字节 | 版本 | 'B' | 个数 | 个数 * (效果负载 + 间隔毫秒) | CRC16
+// 播放期间 FastLED.show() 关中断会丢失串口字节，播放列表只能在开始前一次收下，
+// 缓冲区占 MAX_BATCH_ITEMS * BATCH_ITEM_SIZE = 1216 字节 RAM
+#define BATCH_MIN_VERSION  2
+#define MAX_BATCH_ITEMS    64
+#define BATCH_ITEM_SIZE    (FRAME_PAYLOAD_SIZE + 2)
 
 // 数字输入相关
 #define MAX_INPUT_DIGITS 3  // 最多输入3位数
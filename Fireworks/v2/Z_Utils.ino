@@ -42,7 +42,7 @@ void enterSaveMode() {
 
 /// 保存当前效果
 void saveCurrentEffect() {
-  // 构建消息字符串
+  // 构建消息字符串，字段顺序与 P 命令一致(上位机按同一顺序解析)
   String msg = String(MSG_SAVE_EFFECT) + ","
              + String(currentEffect.color1.r) + ","
              + String(currentEffect.color1.g) + ","
@@ -52,9 +52,8 @@ void saveCurrentEffect() {
              + String(currentEffect.color2.b) + ","
              + String(currentEffect.maxBrightness) + ","
              + String(currentEffect.launchMode) + ","
-             + String(currentEffect.explodeMode) + ","
              + String(currentEffect.gradientMode) + ","
-             + String(currentEffect.launchMode) + ","
+             + String(currentEffect.explodeMode) + ","
              + String(currentEffect.laserColor) + ","
              + String(currentEffect.mirrorAngle) + ","
              + String(currentEffect.explosionLEDCount) + ","
@@ -75,6 +74,13 @@ void playEffect(const FireworkEffect &effect) {
   // 完成后的处理……
 }
 
+// 播放效果并返回耗时(毫秒)，用于串口点播的完成回执
+unsigned long playEffectTimed(const FireworkEffect &effect) {
+  unsigned long started = millis();
+  playEffect(effect);
+  return millis() - started;
+}
+
 /************************************************** 
  *   launchFirework & explodeFirework 仅示例
  **************************************************/
@@ -377,6 +383,8 @@ int getSpeedFromSlider() {
 void processSerialCommand() {
   if (Serial.available() > 0) {
     char cmdType = Serial.read();
+    bool played = false;
+    unsigned long playMillis = 0;
     
     if (cmdType == MSG_PLAY_EFFECT) {
       // 读取完整的效果参数
@@ -412,12 +420,156 @@ void processSerialCommand() {
       Serial.println(effect.speedDelay);
       
       // 执行效果
-      playEffect(effect);
+      played = true;
+      playMillis = playEffectTimed(effect);
+    } else if (cmdType == MSG_HELLO) {
+      // 协议握手: 回复双方都支持的最高版本
+      int version = Serial.parseInt();
+      Serial.print("H,");
+      Serial.println(version < PROTOCOL_VERSION ? version : PROTOCOL_VERSION);
+    } else if ((uint8_t)cmdType == FRAME_SYNC) {
+      // 二进制帧，一次性读取，不再逐个 parseInt
+      uint8_t header[3] = {FRAME_SYNC, 0, 0};
+      if (Serial.readBytes(header + 1, 2) != 2) {
+        Serial.println("Bad frame");
+      } else if (header[2] == MSG_BATCH) {
+        // 整个播放列表收下后在本地连续播放，上位机只需等待进度与最终回执
+        uint8_t count = readBatchFrame(header);
+        if (count > 0) {
+          played = true;
+          playMillis = playBatch(count);
+        } else {
+          Serial.println("Bad frame");
+        }
+      } else {
+        FireworkEffect effect;
+        if (readEffectFrame(header, effect)) {
+          played = true;
+          playMillis = playEffectTimed(effect);
+        } else {
+          Serial.println("Bad frame");
+        }
+      }
     }
     
-    // 清空剩余的串口缓冲区
+    // 清空剩余的串口缓冲区；播放期间到达的命令在这里丢失，报告给上位机(行尾的换行不算)
+    unsigned int discarded = 0;
     while(Serial.available() > 0) {
-      Serial.read();
+      char c = Serial.read();
+      if (c != '\n' && c != '\r') {
+        discarded++;
+      }
+    }
+    if (discarded > 0) {
+      Serial.print(MSG_OVERRUN);
+      Serial.print(",");
+      Serial.println(discarded);
+    }
+
+    // 清空之后才发完成回执，上位机随即发来的下一个命令不会被清掉
+    if (played) {
+      Serial.print(MSG_EFFECT_DONE);
+      Serial.print(",");
+      Serial.println(playMillis);
+    }
+  }
+}
+
+// CRC16-CCITT (多项式 0x1021，初值 0xFFFF)，与上位机 binascii.crc_hqx 一致
+// crc 为前一段数据的结果时可分段计算
+uint16_t crc16Ccitt(const uint8_t *data, size_t len, uint16_t crc) {
+  for (size_t i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (uint8_t bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
     }
   }
-}
\ No newline at end of file
+  return crc;
+}
+
+// 读取帧头(同步字节, 版本, 命令)之后的 P 帧并校验，成功时填充 effect
+bool readEffectFrame(const uint8_t *header, FireworkEffect &effect) {
+  uint8_t frame[FRAME_SIZE];
+  memcpy(frame, header, 3);
+  if (Serial.readBytes(frame + 3, FRAME_SIZE - 3) != FRAME_SIZE - 3) {
+    return false;
+  }
+  if (frame[1] == 0 || frame[1] > PROTOCOL_VERSION || frame[2] != MSG_PLAY_EFFECT) {
+    return false;
+  }
+  uint16_t crc = frame[FRAME_SIZE - 2] | ((uint16_t)frame[FRAME_SIZE - 1] << 8);
+  if (crc != crc16Ccitt(frame + 1, FRAME_SIZE - 3, 0xFFFF)) {
+    return false;
+  }
+  decodeEffectPayload(frame + 3, effect);
+  return true;
+}
+
+// 负载字段顺序与文本 P 命令一致
+void decodeEffectPayload(const uint8_t *p, FireworkEffect &effect) {
+  effect.color1 = CRGB(p[0], p[1], p[2]);
+  effect.color2 = CRGB(p[3], p[4], p[5]);
+  effect.maxBrightness = p[6];
+  effect.launchMode = static_cast<LaunchMode>(p[7]);
+  effect.gradientMode = static_cast<GradientMode>(p[8]);
+  effect.explodeMode = static_cast<ExplodeMode>(p[9]);
+  effect.laserColor = static_cast<LaserColor>(p[10]);
+  effect.mirrorAngle = (int16_t)(p[11] | ((uint16_t)p[12] << 8));
+  effect.explosionLEDCount = p[13] | ((uint16_t)p[14] << 8);
+  effect.speedDelay = p[15] | ((uint16_t)p[16] << 8);
+}
+
+// 批量帧中的效果，由 playBatch 逐个解码播放
+uint8_t batchBuffer[MAX_BATCH_ITEMS * BATCH_ITEM_SIZE];
+
+// 读取帧头之后的批量帧并校验，返回效果个数；出错返回 0
+uint8_t readBatchFrame(const uint8_t *header) {
+  uint8_t count;
+  if (Serial.readBytes(&count, 1) != 1) {
+    return 0;
+  }
+  if (header[1] < BATCH_MIN_VERSION || header[1] > PROTOCOL_VERSION ||
+      count == 0 || count > MAX_BATCH_ITEMS) {
+    return 0;
+  }
+  size_t len = (size_t)count * BATCH_ITEM_SIZE;
+  uint8_t crcBytes[2];
+  if (Serial.readBytes(batchBuffer, len) != len || Serial.readBytes(crcBytes, 2) != 2) {
+    return 0;
+  }
+  // CRC 覆盖同步字节之后的全部内容
+  uint16_t crc = crc16Ccitt(header + 1, 2, 0xFFFF);
+  crc = crc16Ccitt(&count, 1, crc);
+  crc = crc16Ccitt(batchBuffer, len, crc);
+  if (crc != (crcBytes[0] | ((uint16_t)crcBytes[1] << 8))) {
+    return 0;
+  }
+  return count;
+}
+
+// 连续播放批量缓冲区中的 count 个效果，返回总耗时(毫秒)
+unsigned long playBatch(uint8_t count) {
+  unsigned long started = millis();
+  for (uint8_t i = 0; i < count; i++) {
+    const uint8_t *item = batchBuffer + i * BATCH_ITEM_SIZE;
+    FireworkEffect effect;
+    decodeEffectPayload(item, effect);
+    unsigned long itemMillis = playEffectTimed(effect);
+    Serial.print(MSG_BATCH);
+    Serial.print(",");
+    Serial.print(i);
+    Serial.print(",");
+    Serial.println(itemMillis);
+
+    // 播放期间不走 loop()，在效果之间检查自定义开关，拨动时中止剩余部分
+    if (currentState == STATE_IDLE && digitalRead(CUSTOMIZE_BUTTON_PIN) == HIGH) {
+      enterCustomizeMode();
+      break;
+    }
+    uint16_t gap = item[FRAME_PAYLOAD_SIZE] | ((uint16_t)item[FRAME_PAYLOAD_SIZE + 1] << 8);
+    if (gap > 0 && i + 1 < count) {
+      delay(gap);
+    }
+  }
+  return millis() - started;
+}
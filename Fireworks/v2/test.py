@@ -1,31 +1,31 @@
-import serial
-import time
-import random
+import os
+import sys
 
-def generate_random_effect():
-    return {
-        'color1': (random.randint(0,255), random.randint(0,255), random.randint(0,255)),
-        'color2': (random.randint(0,255), random.randint(0,255), random.randint(0,255)),
-        'maxBrightness': random.randint(100,255),
-        'launchMode': random.randint(0,2),
-        'gradientMode': random.randint(0,2),
-        'explodeMode': random.randint(0,2),
-        'laserColor': random.randint(0,2),
-        'mirrorAngle': random.randint(0,30),
-        'explosionLEDCount': random.randint(10,50),
-        'speedDelay': random.randint(3,8)
-    }
+# 共用上一级目录中的效果模型
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from show_pipeline import play_blocking
+from serial_session import SerialSession
+
+_random_effects = {}  # no_repeat -> 批量生成器
+
+def generate_random_effect(no_repeat=()):
+    """随机效果，使用短小快速的参数范围；NumPy 按块批量抽取
+
+    no_repeat: 与同一约束下的上一个效果不能相同的模式字段；默认不约束
+    """
+    generator = _random_effects.get(no_repeat)
+    if generator is None:
+        from effect_generator import EffectGenerator, QUICK_RANGES
+        generator = _random_effects[no_repeat] = iter(
+            EffectGenerator(ranges=QUICK_RANGES, no_repeat=no_repeat))
+    return next(generator)
 
 def send_effect(ser, effect):
-    command = f"P,{effect['color1'][0]},{effect['color1'][1]},{effect['color1'][2]}," + \
-              f"{effect['color2'][0]},{effect['color2'][1]},{effect['color2'][2]}," + \
-              f"{effect['maxBrightness']},{effect['launchMode']},{effect['gradientMode']}," + \
-              f"{effect['explodeMode']},{effect['laserColor']},{effect['mirrorAngle']}," + \
-              f"{effect['explosionLEDCount']},{effect['speedDelay']}\n"
+    command = effect.wire()
     
     try:
-        ser.write(command.encode())
-        print(f"发送命令: {command.strip()}")
+        ser.write(command)
+        print(f"发送命令: {command.decode().strip()}")
         return True
     except Exception as e:
         print(f"发送错误: {e}")
@@ -33,21 +33,20 @@ def send_effect(ser, effect):
 
 def main():
     try:
-        ser = serial.Serial('COM8', 115200, timeout=1)
-        time.sleep(2)  # 等待连接稳定
+        # 不再固定等待 2 秒: 收到启动横幅或握手回复即开始发送
+        ser = SerialSession('COM8', 115200, timeout=1, binary=False).connect()
         
-        while True:
-            effect = generate_random_effect()
-            if send_effect(ser, effect):
-                time.sleep(10)  # 每5秒发送一个新效果
+        # 上一个效果播完(收到 D 回执)立即发送下一个
+        # 相邻烟花的发射方式不重复
+        effects = iter(lambda: generate_random_effect(no_repeat=('launch_mode',)), None)
+        play_blocking(ser, effects, send=lambda effect: send_effect(ser, effect))
             
     except KeyboardInterrupt:
         print("\n程序已停止")
     except Exception as e:
         print(f"错误: {e}")
     finally:
-        if 'ser' in locals() and ser.is_open:
-            ser.close()
+        if 'ser' in locals() and ser.close():
             print("串口已关闭")
 
 if __name__ == "__main__":
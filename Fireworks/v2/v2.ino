@@ -8,6 +8,7 @@ void enterCustomizeMode();
 void enterPreviewMode();
 void saveCurrentEffect();
 void playEffect(const FireworkEffect &effect);
+unsigned long playEffectTimed(const FireworkEffect &effect);
 void cycleLaunchMode();
 void cycleLaserColor();
 void cycleGradientMode();
@@ -29,6 +30,11 @@ void checkNumpadInput();
 
 // 添加串口命令处理函数
 void processSerialCommand();
+bool readEffectFrame(const uint8_t *header, FireworkEffect &effect);
+void decodeEffectPayload(const uint8_t *payload, FireworkEffect &effect);
+uint8_t readBatchFrame(const uint8_t *header);
+unsigned long playBatch(uint8_t count);
+uint16_t crc16Ccitt(const uint8_t *data, size_t len, uint16_t crc);
 
 // 在全局变量区域添加这些变量来记录上一次的值
 uint8_t lastBrightness = 0;
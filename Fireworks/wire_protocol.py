@@ -0,0 +1,217 @@
+"""P 命令的串口协议编解码
+
+文本协议: "P,r1,g1,b1,r2,g2,b2,亮度,发射,渐变,爆炸,激光,镜子角度,LED数,延迟\\n"
+二进制帧: 同步字节 | 版本 | 命令 | 效果负载(17 字节) | CRC16 (CCITT, 小端)
+
+二进制协议在连接时协商: 上位机发送 "H,<版本>\\n"，固件支持时回复 "H,<版本>"，
+否则继续使用文本协议。
+
+批量帧(协议版本 2 起): 同步字节 | 版本 | 'B' | 个数 | 个数 * (效果负载 + 间隔毫秒 uint16) | CRC16
+固件收下整个播放列表后在本地连续播放，每播完一个回复 "B,<序号>,<毫秒>"。
+
+固件播放完串口发来的效果(或整个批量)后回复 "D,<播放毫秒数>"，上位机据此发送下一个命令。
+固件处理完命令清空接收缓冲区时若丢掉了字节(它忙时到达的命令)，回复 "O,<字节数>"。
+"""
+import struct
+import time
+from binascii import crc_hqx
+
+FRAME_SYNC = 0xA5
+PROTOCOL_VERSION = 2
+PROTOCOL_TEXT = 0  # 未协商/不支持时的文本协议
+BATCH_MIN_VERSION = 2  # 支持批量帧的最低协议版本
+
+CMD_PLAY = ord('P')
+CMD_BATCH = ord('B')
+CMD_HELLO = 'H'
+MSG_DONE = 'D'  # 效果播放完成回执
+MSG_BATCH_PROGRESS = 'B'  # 批量中的一个效果播放完成
+MSG_OVERRUN = 'O'  # 固件丢弃了接收缓冲区中的字节
+
+# 14 个字段的顺序与文本 P 命令一致
+PLAY_FIELDS = (
+    'r1', 'g1', 'b1', 'r2', 'g2', 'b2', 'maxBrightness',
+    'launchMode', 'gradientMode', 'explodeMode', 'laserColor',
+    'mirrorAngle', 'explosionLEDCount', 'speedDelay',
+)
+
+HEADER = struct.Struct('<BBB')            # 同步字节, 版本, 命令
+PAYLOAD = struct.Struct('<11BhHH')        # 7 个颜色/亮度 + 4 个模式, 角度, LED数, 延迟
+CRC = struct.Struct('<H')
+FRAME_SIZE = HEADER.size + PAYLOAD.size + CRC.size
+
+BATCH_HEADER = struct.Struct('<BBBB')     # 同步字节, 版本, 命令, 个数
+BATCH_ITEM = struct.Struct('<11BhHHH')    # 效果负载 + 播完后的间隔毫秒
+# 固件的批量缓冲区能容纳的效果数 (见 v2/A_GLOBAL.h)；播放期间不能续传，
+# 更长的播放列表分成多批，每批之间多一次上传的时间
+MAX_BATCH_ITEMS = 64
+# 间隔字段是 uint16 毫秒
+MAX_BATCH_GAP_MS = 0xFFFF
+
+# 连接时协商的总等待时间，以及重发握手的间隔(Arduino 打开串口后会复位)
+NEGOTIATE_TIMEOUT = 3.0
+HELLO_INTERVAL = 0.5
+
+
+class FrameError(ValueError):
+    """二进制帧格式或校验错误"""
+
+
+def hello_command(version=PROTOCOL_VERSION):
+    return f"{CMD_HELLO},{version}\n".encode()
+
+
+def parse_hello(msg):
+    """解析固件的握手回复，返回其支持的协议版本；不是握手回复返回 None"""
+    if not msg.startswith(CMD_HELLO + ','):
+        return None
+    try:
+        return int(msg.split(',')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_batch_progress(msg):
+    """解析 "B,<序号>,<毫秒>"，返回 (序号, 秒)；不是批量进度返回 None"""
+    if not msg.startswith(MSG_BATCH_PROGRESS + ','):
+        return None
+    try:
+        _, index, millis = msg.split(',')
+        return int(index), int(millis) / 1000
+    except ValueError:
+        return None
+
+
+def parse_overrun(msg):
+    """解析 "O,<字节数>"，返回丢弃的字节数；不是该消息返回 None"""
+    if not msg.startswith(MSG_OVERRUN + ','):
+        return None
+    try:
+        return int(msg.split(',')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def parse_done(msg):
+    """解析完成回执，返回固件报告的播放秒数；不是完成回执返回 None"""
+    if not msg.startswith(MSG_DONE + ','):
+        return None
+    try:
+        return int(msg.split(',')[1]) / 1000
+    except (IndexError, ValueError):
+        return None
+
+
+def encode_text(fields):
+    """14 个字段 -> 文本 P 命令"""
+    return ("P," + ",".join(str(int(v)) for v in fields) + "\n").encode()
+
+
+def decode_text(line):
+    """文本 P 命令 -> 14 个字段"""
+    if isinstance(line, bytes):
+        line = line.decode()
+    parts = line.strip().split(',')
+    if parts[0] != 'P' or len(parts) != len(PLAY_FIELDS) + 1:
+        raise ValueError(f"Invalid play command: {line!r}")
+    return tuple(int(p) for p in parts[1:])
+
+
+def encode_frame(fields, version=PROTOCOL_VERSION):
+    """14 个字段 -> 二进制 P 帧"""
+    body = HEADER.pack(FRAME_SYNC, version, CMD_PLAY) + PAYLOAD.pack(*fields)
+    # CRC 覆盖同步字节之后的全部内容
+    return body + CRC.pack(crc_hqx(body[1:], 0xFFFF))
+
+
+def decode_frame(frame):
+    """二进制 P 帧 -> 14 个字段"""
+    if len(frame) != FRAME_SIZE:
+        raise FrameError(f"Frame size {len(frame)} != {FRAME_SIZE}")
+    sync, version, cmd = HEADER.unpack_from(frame)
+    if sync != FRAME_SYNC or cmd != CMD_PLAY:
+        raise FrameError("Bad frame header")
+    if not 0 < version <= PROTOCOL_VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+    (crc,) = CRC.unpack_from(frame, FRAME_SIZE - CRC.size)
+    if crc != crc_hqx(frame[1:FRAME_SIZE - CRC.size], 0xFFFF):
+        raise FrameError("CRC mismatch")
+    return PAYLOAD.unpack_from(frame, HEADER.size)
+
+
+def batch_size(count):
+    """count 个效果的批量帧字节数"""
+    return BATCH_HEADER.size + count * BATCH_ITEM.size + CRC.size
+
+
+def encode_batch(items, version=PROTOCOL_VERSION):
+    """[(14 个字段, 间隔毫秒), ...] -> 批量帧"""
+    if not 0 < len(items) <= MAX_BATCH_ITEMS:
+        raise ValueError(f"Batch must hold 1..{MAX_BATCH_ITEMS} effects, got {len(items)}")
+    if version < BATCH_MIN_VERSION:
+        raise ValueError(f"Protocol v{version} has no batch frames")
+    body = bytearray(BATCH_HEADER.pack(FRAME_SYNC, version, CMD_BATCH, len(items)))
+    for fields, gap in items:
+        body += BATCH_ITEM.pack(*fields, gap)
+    return bytes(body + CRC.pack(crc_hqx(body[1:], 0xFFFF)))
+
+
+def decode_batch(frame):
+    """批量帧 -> [(14 个字段, 间隔毫秒), ...]"""
+    if len(frame) < BATCH_HEADER.size + CRC.size:
+        raise FrameError("Batch frame too short")
+    sync, version, cmd, count = BATCH_HEADER.unpack_from(frame)
+    if sync != FRAME_SYNC or cmd != CMD_BATCH or not 0 < count <= MAX_BATCH_ITEMS:
+        raise FrameError("Bad batch header")
+    if not BATCH_MIN_VERSION <= version <= PROTOCOL_VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+    if len(frame) != batch_size(count):
+        raise FrameError(f"Batch size {len(frame)} != {batch_size(count)}")
+    (crc,) = CRC.unpack_from(frame, len(frame) - CRC.size)
+    if crc != crc_hqx(frame[1:len(frame) - CRC.size], 0xFFFF):
+        raise FrameError("CRC mismatch")
+    items = []
+    for i in range(count):
+        values = BATCH_ITEM.unpack_from(frame, BATCH_HEADER.size + i * BATCH_ITEM.size)
+        items.append((values[:-1], values[-1]))
+    return items
+
+
+def encode_play(fields, version):
+    """按协商结果编码 P 命令 (FireworkEffect.wire 经此编码)"""
+    if version == PROTOCOL_TEXT:
+        return encode_text(fields)
+    return encode_frame(fields, version)
+
+
+def decode_play(data):
+    """encode_play 的逆: 文本 P 命令或二进制 P 帧 -> 14 个字段"""
+    if data[:1] == bytes((FRAME_SYNC,)):
+        return decode_frame(data)
+    return decode_text(data)
+
+
+def negotiate(ser, timeout=NEGOTIATE_TIMEOUT):
+    """阻塞式握手，返回 (协议版本, 握手期间收到的其他消息)
+
+    固件不支持时版本为 PROTOCOL_TEXT；其他消息交给调用者继续处理。
+    """
+    other_messages = []
+    old_timeout = ser.timeout
+    ser.timeout = HELLO_INTERVAL
+    deadline = time.monotonic() + timeout
+    try:
+        ser.write(hello_command())
+        while time.monotonic() < deadline:
+            line = ser.readline().decode(errors='replace').strip()
+            if not line:
+                # 固件可能还在复位启动中，重发握手
+                ser.write(hello_command())
+                continue
+            version = parse_hello(line)
+            if version is not None:
+                return min(version, PROTOCOL_VERSION), other_messages
+            other_messages.append(line)
+        return PROTOCOL_TEXT, other_messages
+    finally:
+        ser.timeout = old_timeout